@@ -0,0 +1,105 @@
+from typing import List, Callable, Iterator
+import contextlib
+import threading
+
+
+class Cancelled(Exception):
+    """
+    Raised by CancelToken.check once the work it is checked for is no
+    longer wanted
+    """
+
+
+class CancelToken:
+    """
+    Set when the work it is passed to should stop. The work checks it at
+    regular points and stops cleanly by raising Cancelled.
+    """
+
+    def __init__(self):
+        # read without the lock, so that checking in a hot loop is cheap
+        self.cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for c in callbacks:
+            c()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """
+        Call callback once the token is cancelled, right away if it already is
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+
+class _Never(CancelToken):
+    def cancel(self):
+        pass
+
+
+NEVER = _Never()
+"""
+The token of work that can't be cancelled, like handling a notification
+"""
+
+
+class SharedToken(CancelToken):
+    """
+    The token of work that several requests wait for, like parsing a file.
+    It is only cancelled once every token that shares it is, so the work
+    goes on as long as one of them still needs it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._live = 0
+
+    def share(self, token: CancelToken):
+        with self._lock:
+            self._live += 1
+        if token is not NEVER:
+            token.on_cancel(self._release)
+
+    def _release(self):
+        with self._lock:
+            self._live -= 1
+            done = self._live == 0
+        if done:
+            self.cancel()
+
+
+_current = threading.local()
+
+
+def current() -> CancelToken:
+    """
+    The token of the request the calling thread is handling
+    """
+    return getattr(_current, "token", NEVER)
+
+
+@contextlib.contextmanager
+def scope(token: CancelToken) -> Iterator[CancelToken]:
+    """
+    Make token the current one of the calling thread while in the block
+    """
+    previous = current()
+    _current.token = token
+    try:
+        yield token
+    finally:
+        _current.token = previous
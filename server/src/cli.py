@@ -1,6 +1,159 @@
+import argparse
+import importlib.abc
+import sys
+import time
+from typing import Dict, List, Tuple
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, profile: "StartupProfile"):
+        self._loader = loader
+        self._profile = profile
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profile.enter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profile.exit(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _TimedFinder(importlib.abc.MetaPathFinder):
+    def __init__(self, profile: "StartupProfile"):
+        self._profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self._profile)
+                return spec
+        return None
+
+
+class StartupProfile:
+    """
+    Records how long each module takes to import and initialize, and how
+    long each phase of starting the server takes, for --startup-profile
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.modules: Dict[str, float] = dict()
+        """
+        The time spent importing each module, not counting the modules it
+        imports
+        """
+        self.phases: List[Tuple[str, float]] = []
+        # the start time and child time of the imports in progress
+        self._stack: List[List[float]] = []
+
+    def install(self):
+        sys.meta_path.insert(0, _TimedFinder(self))
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, name: str):
+        start, children = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.modules[name] = elapsed - children
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def mark(self, phase: str):
+        self.phases.append((phase, time.perf_counter() - self.start))
+
+    def report(self, top: int = 25):
+        # stdout is used by the language server protocol
+        out = sys.stderr
+        print("startup profile:", file=out)
+        for phase, t in self.phases:
+            print(f"  {t * 1000:8.1f} ms  {phase}", file=out)
+        total = sum(self.modules.values())
+        print(
+            f"imports: {total * 1000:.1f} ms in {len(self.modules)} modules", file=out
+        )
+        slowest = sorted(self.modules.items(), key=lambda x: x[1], reverse=True)
+        for name, t in slowest[:top]:
+            print(f"  {t * 1000:8.1f} ms  {name}", file=out)
+
+
+def _add_profile_option(parser: argparse.ArgumentParser, **kwargs):
+    # the option is accepted both before and after the command. A command
+    # mustn't set a default, which would replace the value given before it
+    kwargs.setdefault("default", argparse.SUPPRESS)
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="report the time spent importing and initializing each module to stderr",
+        **kwargs,
+    )
+
+
 def run():
-    from lllsp.lsp import run_lsp
-    run_lsp()
+    parser = argparse.ArgumentParser(
+        prog="lllsp", description="Language server for LLVM IR"
+    )
+    _add_profile_option(parser, default=False)
+    commands = parser.add_subparsers(dest="command")
+
+    lsp = commands.add_parser(
+        "lsp", help="start the language server, the default without a command"
+    )
+    _add_profile_option(lsp)
+
+    index = commands.add_parser(
+        "index", help="index .ll files without starting the language server"
+    )
+    _add_profile_option(index)
+    index.add_argument(
+        "paths", nargs="+", help=".ll files, or directories to search for them"
+    )
+    index.add_argument(
+        "-o", "--output", default="-", help="file to write to, defaults to stdout"
+    )
+    index.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of processes to use, defaults to the number of cores",
+    )
+
+    args = parser.parse_args()
+
+    profile = None
+    if args.startup_profile:
+        profile = StartupProfile()
+        profile.install()
+
+    # only import what the command needs
+    if args.command == "index":
+        from lllsp.index import run_index
+
+        if profile:
+            profile.mark("imports")
+        run_index(args.paths, args.output, args.jobs)
+        if profile:
+            profile.mark("index")
+            profile.report()
+    else:
+        from lllsp.lsp import run_lsp
+
+        if profile:
+            profile.mark("imports")
+        run_lsp(profile)
+
 
 if __name__ == "__main__":
     run()
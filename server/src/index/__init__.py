@@ -0,0 +1,126 @@
+from typing import List, Dict, Iterable, Iterator, Optional, Any
+import itertools
+import json
+import os
+import sys
+
+import lllsp.ir as ir
+from lllsp.ir.location import Range
+from lllsp.parser import IRParser, NameParser
+from lllsp.parser.reader import Reader, LL_SUFFIXES
+
+
+def find_files(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the files to index. Directories are searched recursively for .ll
+    files, including compressed ones, anything else is taken as-is.
+    """
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.endswith(LL_SUFFIXES):
+                        yield os.path.join(root, f)
+        else:
+            yield p
+
+
+def _rng(rng: Range) -> List[int]:
+    return [rng.start.line, rng.start.column, rng.end.line, rng.end.column]
+
+
+def _symbols(mod: ir.Module) -> Iterator[Dict[str, Any]]:
+    kinds = [
+        (mod.types, "type"),
+        (mod.constants, "global"),
+        (mod.functions, "function"),
+        (mod.attributes, "attribute"),
+    ]
+    for elts, kind in kinds:
+        for i in elts:
+            yield {
+                "kind": "symbol",
+                "name": i.name.name,
+                "type": kind,
+                "range": _rng(i.location.rng),
+            }
+
+
+def _definitions(mod: ir.Module) -> Iterator[Dict[str, Any]]:
+    for i in itertools.chain(mod.symbols.values(), mod.metadata):
+        yield {
+            "kind": "definition",
+            "name": i.name.name,
+            "range": _rng(i.name.location.rng),
+        }
+    for f in mod.functions:
+        for name, i in f.symbols.items():
+            if n := ir.definition_name(i):
+                yield {
+                    "kind": "definition",
+                    "name": name,
+                    "range": _rng(n.location.rng),
+                    "scope": f.name.name,
+                }
+
+
+def _references(mod: ir.Module, names: List[ir.Name]) -> Iterator[Dict[str, Any]]:
+    for n in names:
+        d = None
+        if (i := mod.resolve(n)) and (dn := ir.definition_name(i)):
+            d = _rng(dn.location.rng)
+        yield {
+            "kind": "reference",
+            "name": n.name,
+            "range": _rng(n.location.rng),
+            "definition": d,
+        }
+
+
+def index_file(filename: str) -> str:
+    """
+    Index a single file, returning the records for it as JSON Lines
+    """
+    try:
+        with Reader(filename) as r:
+            mod = IRParser().parse(r)
+        with Reader(filename) as r:
+            names = NameParser().parse(r)
+        # the records are built lazily, so build them here for errors to be
+        # caught
+        records = list(
+            itertools.chain(_symbols(mod), _definitions(mod), _references(mod, names))
+        )
+    except Exception as e:
+        records = [{"kind": "error", "message": str(e)}]
+
+    lines = []
+    for rec in records:
+        rec["file"] = filename
+        lines.append(json.dumps(rec, separators=(",", ":")))
+        lines.append("\n")
+    return "".join(lines)
+
+
+def run_index(paths: List[str], output: str = "-", jobs: Optional[int] = None):
+    """
+    Index every file in paths across a pool of 'jobs' processes, writing
+    JSON Lines records to output. Each record has a 'file' and a 'kind',
+    which is one of 'symbol', 'definition', 'reference' or 'error'.
+    """
+    files = list(find_files(paths))
+    out = sys.stdout if output == "-" else open(output, "w")
+    try:
+        if jobs == 1 or len(files) <= 1:
+            for f in files:
+                out.write(index_file(f))
+        else:
+            import multiprocessing
+
+            with multiprocessing.Pool(jobs) as pool:
+                for text in pool.imap_unordered(index_file, files):
+                    out.write(text)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,66 @@
+from typing import List, Dict, Iterable
+import bisect
+
+import lllsp.ir as ir
+
+
+class CallGraph:
+    """
+    The direct calls between the functions of a module. Outgoing calls are
+    the call sites recorded on each Define when it is parsed, this indexes
+    the incoming calls of each function by the name of the callee.
+    """
+
+    def __init__(self):
+        self._callers: Dict[str, List[ir.Define]] = dict()
+
+    @classmethod
+    def build(cls, functions: Iterable[ir.Function]) -> "CallGraph":
+        g = cls()
+        for f in functions:
+            g.add_function(f)
+        return g
+
+    def copy(self) -> "CallGraph":
+        g = CallGraph()
+        g._callers = {
+            callee: list(callers) for callee, callers in self._callers.items()
+        }
+        return g
+
+    def add_function(self, f: ir.Function):
+        """
+        Add the calls of f. The callers of each function are kept in file
+        order, so f can be added after functions that come after it.
+        """
+        if not isinstance(f, ir.Define):
+            return
+        line = f.location.rng.start.line
+        for callee in {c.callee.name for c in f.calls}:
+            callers = self._callers.setdefault(callee, [])
+            idx = bisect.bisect_right(
+                callers, line, key=lambda c: c.location.rng.start.line
+            )
+            callers.insert(idx, f)
+
+    def remove_function(self, f: ir.Function):
+        if not isinstance(f, ir.Define):
+            return
+        for callee in {c.callee.name for c in f.calls}:
+            callers = self._callers.get(callee, [])
+            self._callers[callee] = [c for c in callers if c is not f]
+
+    def callers(self, name: str) -> List[ir.Define]:
+        """
+        The functions that call the function named 'name'
+        """
+        return self._callers.get(name, [])
+
+    @staticmethod
+    def calls(caller: ir.Function, callee: str) -> List[ir.CallSite]:
+        """
+        The call sites in caller that call the function named 'callee'
+        """
+        if not isinstance(caller, ir.Define):
+            return []
+        return [c for c in caller.calls if c.callee.name == callee]
@@ -0,0 +1,129 @@
+from typing import List, Dict, Optional
+from dataclasses import dataclass, field
+import bisect
+import re
+
+import lllsp.ir as ir
+from lllsp.parser.reader import strip_comment
+
+# the blocks a terminator can branch to: br, switch, indirectbr, invoke,
+# callbr, and the exception handling terminators are all written this way
+_successor_regex = re.compile(r"\blabel\s+(%[-a-zA-Z0-9_.$]+)")
+_quoted_regex = re.compile(r'"[^"]*"')
+
+
+@dataclass
+class BasicBlock:
+    # the name branches refer to the block by, None for an entry block
+    # without a label
+    name: Optional[str]
+    label: Optional[ir.Label]
+    # the first and last line of the block
+    start: int
+    end: int
+    # the line the last instruction starts on, None if the block is empty
+    terminator: Optional[int] = None
+    successors: List[int] = field(default_factory=list)
+    predecessors: List[int] = field(default_factory=list)
+
+
+class ControlFlowGraph:
+    """
+    The basic blocks of a function and the edges between them, read from the
+    labels the parser found and the label operands of the terminators
+    """
+
+    def __init__(self, f: ir.Define, blocks: List[BasicBlock]):
+        self.function = f
+        self.blocks = blocks
+        self._starts = [b.start for b in blocks]
+        self._by_name: Dict[str, int] = dict()
+        for i, b in enumerate(blocks):
+            if b.name is not None:
+                self._by_name.setdefault(b.name, i)
+
+    @classmethod
+    def build(
+        cls, f: ir.Define, lines: List[str], first_line: int
+    ) -> "ControlFlowGraph":
+        """
+        Build the graph of f from its lines, the first of which is
+        first_line. The header of the function is expected to be on its
+        first line, like LLVM prints it.
+        """
+        labels = [s for s in f.statements if isinstance(s, ir.Label)]
+        last_line = first_line + len(lines) - 1
+        # the closing brace isn't part of any block
+        body_end = last_line - 1 if lines[-1].strip().startswith("}") else last_line
+        blocks: List[BasicBlock] = []
+
+        first_label = labels[0].location.rng.start.line if labels else body_end + 1
+        for n in range(first_line + 1, first_label):
+            if strip_comment(lines[n - first_line]).strip():
+                blocks.append(BasicBlock(None, None, first_line + 1, first_label - 1))
+                break
+        for label, next in zip(labels, labels[1:] + [None]):
+            start = label.location.rng.start.line
+            end = next.location.rng.start.line - 1 if next else body_end
+            blocks.append(BasicBlock("%" + label.basename(), label, start, end))
+
+        targets: List[List[str]] = []
+        for b in blocks:
+            names = []
+            # the brackets left open by the instruction so far, an instruction
+            # like a switch continues on the lines until they are closed
+            depth = 0
+            for n in range(b.start, b.end + 1):
+                code = lines[n - first_line]
+                if ";" in code:
+                    code = strip_comment(code)
+                if n == b.start and b.label:
+                    code = code[b.label.location.rng.end.column :]
+                if code.isspace() or not code:
+                    continue
+                if depth == 0:
+                    b.terminator = n
+                if "label" in code:
+                    names.extend(_successor_regex.findall(code))
+                if '"' in code:
+                    code = _quoted_regex.sub("", code)
+                depth += sum(code.count(c) for c in "[({")
+                depth -= sum(code.count(c) for c in "])}")
+                depth = max(depth, 0)
+            targets.append(names)
+
+        cfg = cls(f, blocks)
+        for i, names in enumerate(targets):
+            b = blocks[i]
+            seen = set()
+            for name in names:
+                j = cfg._by_name.get(name)
+                # undefined labels are reported as undefined values
+                if j is None or j in seen:
+                    continue
+                seen.add(j)
+                b.successors.append(j)
+                blocks[j].predecessors.append(i)
+        return cfg
+
+    def block(self, name: str) -> Optional[BasicBlock]:
+        """
+        The block a label operand like '%bb' refers to
+        """
+        i = self._by_name.get(name)
+        return None if i is None else self.blocks[i]
+
+    def block_at(self, line: int) -> Optional[BasicBlock]:
+        """
+        The block a line of the function is in
+        """
+        i = bisect.bisect_right(self._starts, line) - 1
+        if i < 0 or line > self.blocks[i].end:
+            return None
+        return self.blocks[i]
+
+    def successors(self, b: BasicBlock) -> List[BasicBlock]:
+        return [self.blocks[i] for i in b.successors]
+
+    def predecessors(self, b: BasicBlock) -> List[BasicBlock]:
+        return [self.blocks[i] for i in b.predecessors]
@@ -0,0 +1,38 @@
+from typing import List, Dict, Iterable, Optional
+
+import lllsp.ir as ir
+from lllsp.cancel import CancelToken, NEVER
+
+
+class DefUse:
+    """
+    The def-use chains of the local names of a single function: formals,
+    values and labels, keyed by the name they are referred to by
+    """
+
+    def __init__(self):
+        self.defs: Dict[str, ir.Name] = dict()
+        self.uses: Dict[str, List[ir.Name]] = dict()
+
+    @classmethod
+    def build(
+        cls, f: ir.Function, names: Iterable[ir.Name], token: CancelToken = NEVER
+    ) -> "DefUse":
+        """
+        Build the chains from the names that occur in f
+        """
+        du = cls()
+        for key, i in f.symbols.items():
+            if n := ir.definition_name(i):
+                du.defs[key] = n
+        for n in names:
+            token.check()
+            if (d := du.defs.get(n.name)) and n.location.rng != d.location.rng:
+                du.uses.setdefault(n.name, []).append(n)
+        return du
+
+    def definition(self, name: str) -> Optional[ir.Name]:
+        return self.defs.get(name)
+
+    def uses_of(self, name: str) -> List[ir.Name]:
+        return self.uses.get(name, [])
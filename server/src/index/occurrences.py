@@ -0,0 +1,146 @@
+from typing import List, Dict, Tuple, Iterable, Optional, Union
+from dataclasses import dataclass, field
+import operator
+
+import lllsp.ir as ir
+from lllsp.cancel import CancelToken, NEVER
+
+# a local definition is identified by where its name is written, and a module
+# level one by its name alone, so that the occurrences of a module level name
+# in other spans stay where they are when its definition moves
+OccurrenceKey = Union[str, Tuple[str, int, int]]
+
+_locals = (ir.Formal, ir.StatementWithValue, ir.Label)
+
+
+def occurrence_key(i: ir.IR) -> Optional[OccurrenceKey]:
+    """
+    A key that identifies a definition, which is stable even for IR that is
+    decoded on demand, like metadata
+    """
+    n = ir.definition_name(i)
+    if n is None:
+        return None
+    if isinstance(i, _locals):
+        start = n.location.rng.start
+        return (n.name, start.line, start.column)
+    return n.name
+
+
+_position = operator.attrgetter("location.rng.start.line", "location.rng.start.column")
+
+
+@dataclass
+class SpanOccurrences:
+    """
+    The occurrences of the names in one span of a file, grouped by the
+    definition they resolve to, and the names that didn't resolve to anything
+    when the top level definitions were the ones hashed to globals_key
+    """
+
+    occurrences: Dict[OccurrenceKey, List[ir.Name]] = field(default_factory=dict)
+    unresolved: List[ir.Name] = field(default_factory=list)
+    globals_key: int = 0
+
+    @classmethod
+    def build(
+        cls,
+        module: ir.Module,
+        names: Iterable[ir.Name],
+        labels: Iterable[ir.Label],
+        globals_key: int,
+        token: CancelToken = NEVER,
+    ) -> "SpanOccurrences":
+        occ = cls(globals_key=globals_key)
+        for n in names:
+            token.check()
+            if i := module.resolve(n):
+                occ.add(i, n)
+            else:
+                occ.unresolved.append(n)
+        # labels are only ever written as '%name', except at their definition
+        for l in labels:
+            occ.add(l, l)
+        return occ
+
+    def add(self, definition: ir.IR, name: ir.Name):
+        if key := occurrence_key(definition):
+            self.occurrences.setdefault(key, []).append(name)
+
+    def shifted(self, moved: Dict[int, ir.Name], delta: int) -> "SpanOccurrences":
+        """
+        A copy for the span moved down by delta lines, with each name replaced
+        by its moved copy in 'moved', keyed by the id of the original
+        """
+        occurrences: Dict[OccurrenceKey, List[ir.Name]] = dict()
+        for key, names in self.occurrences.items():
+            if isinstance(key, tuple):
+                key = (key[0], key[1] + delta, key[2])
+            occurrences[key] = [moved[id(n)] for n in names]
+        unresolved = [moved[id(n)] for n in self.unresolved]
+        return SpanOccurrences(occurrences, unresolved, self.globals_key)
+
+    def resolved(self, module: ir.Module, globals_key: int) -> "SpanOccurrences":
+        """
+        The occurrences once the top level definitions are the ones hashed to
+        globals_key. Only the names that didn't resolve are looked up again:
+        the ones that did are keyed by the name they were written with, and
+        still are occurrences of whatever has that name now.
+        """
+        if globals_key == self.globals_key:
+            return self
+        occ = SpanOccurrences(dict(self.occurrences), [], globals_key)
+        found: Dict[OccurrenceKey, List[ir.Name]] = dict()
+        for n in self.unresolved:
+            if (i := module.resolve(n)) and (key := occurrence_key(i)):
+                found.setdefault(key, []).append(n)
+            else:
+                occ.unresolved.append(n)
+        # the lists are shared with the occurrences this was copied from
+        for key, names in found.items():
+            names.extend(occ.occurrences.get(key, ()))
+            occ.occurrences[key] = sorted(names, key=_position)
+        return occ
+
+
+class OccurrenceIndex:
+    """
+    Every occurrence of every name in a module, grouped by the definition it
+    resolves to. Local names resolve to a definition in their function, so
+    their occurrences never leave the function.
+
+    The occurrences are kept for each span of the file the module was parsed
+    from, so that a reparse only resolves the names in the spans that
+    changed, and shares the rest.
+    """
+
+    def __init__(self):
+        self.spans: List[SpanOccurrences] = []
+
+    @classmethod
+    def build(
+        cls, module: ir.Module, names: Iterable[ir.Name], token: CancelToken = NEVER
+    ) -> "OccurrenceIndex":
+        idx = cls()
+        labels = (
+            s
+            for f in module.functions
+            if isinstance(f, ir.Define)
+            for s in f.statements
+            if isinstance(s, ir.Label)
+        )
+        idx.spans.append(SpanOccurrences.build(module, names, labels, 0, token))
+        return idx
+
+    def add(self, definition: ir.IR, name: ir.Name):
+        if not self.spans:
+            self.spans.append(SpanOccurrences())
+        self.spans[-1].add(definition, name)
+
+    def get(self, definition: ir.IR) -> List[ir.Name]:
+        """
+        Return all of the occurrences of a definition, including itself
+        """
+        if (key := occurrence_key(definition)) is None:
+            return []
+        return [n for s in self.spans for n in s.occurrences.get(key, ())]
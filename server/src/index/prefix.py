@@ -0,0 +1,67 @@
+from typing import List, Tuple, Iterable, TypeVar, Generic, Optional
+from bisect import bisect_left, bisect_right
+
+ValueT = TypeVar("ValueT")
+
+
+class PrefixIndex(Generic[ValueT]):
+    """
+    A sorted index of names, for finding all of the names that start with a
+    prefix in logarithmic time, plus the number of matches returned.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, ValueT]] = ()):
+        pairs = sorted(items, key=lambda x: x[0])
+        self._keys: List[str] = [k for k, _ in pairs]
+        self._values: List[ValueT] = [v for _, v in pairs]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def copy(self) -> "PrefixIndex[ValueT]":
+        idx: PrefixIndex[ValueT] = PrefixIndex()
+        idx._keys = list(self._keys)
+        idx._values = list(self._values)
+        return idx
+
+    def add(self, key: str, value: ValueT):
+        idx = bisect_right(self._keys, key)
+        self._keys.insert(idx, key)
+        self._values.insert(idx, value)
+
+    def remove(self, key: str, value: ValueT):
+        """
+        Remove the entry for key that holds exactly this value, if any
+        """
+        idx = bisect_left(self._keys, key)
+        while idx < len(self._keys) and self._keys[idx] == key:
+            if self._values[idx] is value:
+                del self._keys[idx]
+                del self._values[idx]
+                return
+            idx += 1
+
+    def discard(self, key: str):
+        """
+        Remove every entry for key
+        """
+        lo = bisect_left(self._keys, key)
+        hi = bisect_right(self._keys, key, lo)
+        del self._keys[lo:hi]
+        del self._values[lo:hi]
+
+    def find(
+        self, prefix: str, limit: Optional[int] = None
+    ) -> Tuple[List[Tuple[str, ValueT]], bool]:
+        """
+        Find the entries whose key starts with prefix, in sorted order.
+        Returns at most 'limit' entries, and whether there were more.
+        """
+        res = []
+        idx = bisect_left(self._keys, prefix)
+        while idx < len(self._keys) and self._keys[idx].startswith(prefix):
+            if limit is not None and len(res) >= limit:
+                return res, True
+            res.append((self._keys[idx], self._values[idx]))
+            idx += 1
+        return res, False
@@ -0,0 +1,234 @@
+from typing import List, Dict, Iterable, Tuple, Set, TypeVar, Generic, Optional
+from array import array
+from collections import Counter
+import heapq
+import itertools
+import math
+
+ValueT = TypeVar("ValueT")
+
+FUZZY_MATCH = 0.6
+"""
+The fraction of the trigrams of a query that a key needs to share with it
+to match, when the query isn't a substring of the key
+"""
+
+RANKED_MATCHES = 4
+"""
+At most this many times the limit of matches are ranked. When a query
+matches far more keys than that, the ones found first are returned.
+"""
+
+FUZZY_POSTING_LIMIT = 20_000
+"""
+Trigrams that this many keys share say little about a fuzzy match and are
+expensive to count, so they are left out of it
+"""
+
+
+def trigrams(s: str) -> Iterable[str]:
+    return (s[i : i + 3] for i in range(len(s) - 2))
+
+
+class TrigramIndex(Generic[ValueT]):
+    """
+    An index of keys by the trigrams they contain, for finding the keys that
+    contain a string, or that are close to it, without looking at every
+    key. Keys are matched ignoring case.
+
+    Each distinct key is stored once, however many values it has, and gets
+    an id that the posting list of each of its trigrams holds. Posting lists
+    are only appended to. A key that loses all of its values is left in them
+    and skipped, and gets its id back if it is added again. The posting
+    lists are rebuilt once most of the keys are dead.
+
+    An index is changed in place, or copied with copy(), in which case the
+    copy shares its lists of values and posting lists with the original
+    until it changes them, and the original can still be searched while the
+    copy is changed.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = dict()
+        self._keys: List[str] = []
+        self._values: List[List[ValueT]] = []
+        self._postings: Dict[str, array] = dict()
+        # the keys that are too short to have a trigram
+        self._short = array("i")
+        self._dead = 0
+        # for a copy, the ids of the lists of values and the trigrams of the
+        # posting lists it has copied, the rest are shared with the original
+        self._copied: Optional[Tuple[Set[int], Set[str]]] = None
+
+    def copy(self) -> "TrigramIndex[ValueT]":
+        idx: TrigramIndex[ValueT] = TrigramIndex()
+        idx._ids = dict(self._ids)
+        idx._keys = list(self._keys)
+        idx._values = list(self._values)
+        idx._postings = dict(self._postings)
+        idx._short = array("i", self._short)
+        idx._dead = self._dead
+        idx._copied = (set(), set())
+        return idx
+
+    def _own_values(self, k: int) -> List[ValueT]:
+        """
+        The values of key k, to be changed
+        """
+        if self._copied is not None and k not in self._copied[0]:
+            self._copied[0].add(k)
+            self._values[k] = list(self._values[k])
+        return self._values[k]
+
+    def _own_posting(self, t: str) -> array:
+        """
+        The posting list of trigram t, to be appended to
+        """
+        if (p := self._postings.get(t)) is None:
+            p = self._postings[t] = array("i")
+        elif self._copied is not None and t not in self._copied[1]:
+            p = self._postings[t] = array("i", p)
+        if self._copied is not None:
+            self._copied[1].add(t)
+        return p
+
+    def __len__(self) -> int:
+        return len(self._keys) - self._dead
+
+    def add(self, key: str, value: ValueT):
+        key = key.lower()
+        if (k := self._ids.get(key)) is None:
+            k = len(self._keys)
+            self._ids[key] = k
+            self._keys.append(key)
+            self._values.append([])
+            if len(key) < 3:
+                self._short.append(k)
+            for t in set(trigrams(key)):
+                self._own_posting(t).append(k)
+        elif not self._values[k]:
+            self._dead -= 1
+        self._own_values(k).append(value)
+
+    def remove(self, key: str, value: ValueT):
+        """
+        Remove the entry for key that holds exactly this value, if any
+        """
+        if (k := self._ids.get(key.lower())) is None:
+            return
+        for i, v in enumerate(self._values[k]):
+            if v is value:
+                values = self._own_values(k)
+                del values[i]
+                if not values:
+                    self._dead += 1
+                break
+        if self._dead > 1024 and self._dead * 2 > len(self._keys):
+            self._compact()
+
+    def _compact(self):
+        entries = [
+            (key, values) for key, values in zip(self._keys, self._values) if values
+        ]
+        self.__init__()
+        for key, values in entries:
+            for v in values:
+                self.add(key, v)
+
+    @staticmethod
+    def _rank(key: str, query: str, at: int) -> int:
+        if key == query:
+            return 0
+        if at == 0:
+            return 1
+        # the start of a word, like a namespace or a part of a mangled name
+        if not key[at - 1].isalnum():
+            return 2
+        return 3
+
+    def _candidates(self, terms: List[str]) -> Iterable[int]:
+        """
+        The ids of the keys that may contain all of the terms, from the
+        shortest posting list of their trigrams. A key can be a candidate
+        more than once.
+        """
+        shortest: Optional[array] = None
+        for term in terms:
+            for t in trigrams(term):
+                p = self._postings.get(t)
+                if p is None:
+                    return ()
+                if shortest is None or len(p) < len(shortest):
+                    shortest = p
+        if shortest is not None:
+            return shortest
+        # every term is too short to have a trigram, so take the keys of the
+        # trigrams that contain the first one
+        term = terms[0]
+        lists = [p for t, p in self._postings.items() if term in t]
+        return itertools.chain(self._short, *lists)
+
+    def _fuzzy(self, query: str) -> Iterable[Tuple[float, int]]:
+        """
+        The keys that share enough trigrams with the query, and how close
+        they are
+        """
+        grams = set(trigrams(query))
+        if not grams:
+            return []
+        counts: Counter = Counter()
+        for t in grams:
+            p = self._postings.get(t)
+            if p is not None and len(p) < FUZZY_POSTING_LIMIT:
+                counts.update(p)
+        needed = math.ceil(len(grams) * FUZZY_MATCH)
+        return [(4 + 1 - n / len(grams), k) for k, n in counts.items() if n >= needed]
+
+    def search(self, query: str, limit: int) -> List[ValueT]:
+        """
+        The values of the keys that contain every word of the query, best
+        matches first. The key equal to the query comes first, then the keys
+        that start with it, then the ones where it starts a word, and then the
+        rest, shorter keys first. If there aren't enough of those, keys that
+        only share most of their trigrams with the query follow.
+        """
+        query = query.lower()
+        terms = query.split()
+        if not terms:
+            everything = (v for values in self._values for v in values)
+            return list(itertools.islice(everything, limit))
+
+        scored: List[Tuple[float, int]] = []
+        found = set()
+        if (k := self._ids.get(query)) is not None and self._values[k]:
+            found.add(k)
+            scored.append((0, k))
+        for k in self._candidates(terms):
+            if k in found:
+                continue
+            key = self._keys[k]
+            if not self._values[k] or not all(t in key for t in terms):
+                continue
+            found.add(k)
+            scored.append((self._rank(key, query, key.find(terms[0])), k))
+            if len(scored) >= limit * RANKED_MATCHES:
+                break
+
+        if len(scored) < limit:
+            scored.extend(
+                (rank, k)
+                for rank, k in self._fuzzy(query)
+                if k not in found and self._values[k]
+            )
+
+        best = heapq.nsmallest(
+            limit, scored, key=lambda x: (x[0], len(self._keys[x[1]]))
+        )
+        res = []
+        seen = set()
+        for _, k in best:
+            for v in self._values[k]:
+                if id(v) not in seen:
+                    seen.add(id(v))
+                    res.append(v)
+        return res[:limit]
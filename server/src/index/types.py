@@ -0,0 +1,290 @@
+from typing import List, Dict, Iterator, Tuple, Optional
+import re
+
+import lllsp.ir as ir
+
+_OPENING = "([{<"
+_CLOSING = ")]}>"
+
+_type_regex = re.compile(
+    r"(?:i\d+|ptr(?:\s+addrspace\(\d+\))?|void|half|bfloat|float|double|fp128"
+    r"|x86_fp80|ppc_fp128|x86_amx|x86_mmx|label|metadata|token"
+    r'|%[-a-zA-Z0-9_.$]+|%"[^"]*")(?![\w.])'
+)
+_word_regex = re.compile(r"[a-z_][a-z0-9_.]*|-?\d+")
+_space_regex = re.compile(r"\s*")
+_pointer_regex = re.compile(r"(?:\s*\*)*")
+_opcode_regex = re.compile(r"\s*(?:(?:tail|musttail|notail)\s+)?([a-z_]+)")
+_vector_regex = re.compile(r"<\s*((?:vscale\s+x\s+)?\d+)\s+x\s+(.*)>", re.DOTALL)
+_array_regex = re.compile(r"\[\s*\d+\s+x\s+(.*)\]", re.DOTALL)
+_addrspace_regex = re.compile(r",\s*addrspace\((\d+)\)")
+
+_CASTS = {
+    "trunc",
+    "zext",
+    "sext",
+    "fptrunc",
+    "fpext",
+    "fptoui",
+    "fptosi",
+    "uitofp",
+    "sitofp",
+    "ptrtoint",
+    "inttoptr",
+    "bitcast",
+    "addrspacecast",
+}
+# the result has the type of the first type written after the opcode
+_FIRST_TYPE = {
+    "add",
+    "sub",
+    "mul",
+    "udiv",
+    "sdiv",
+    "urem",
+    "srem",
+    "shl",
+    "lshr",
+    "ashr",
+    "and",
+    "or",
+    "xor",
+    "fadd",
+    "fsub",
+    "fmul",
+    "fdiv",
+    "frem",
+    "fneg",
+    "load",
+    "phi",
+    "freeze",
+    "insertvalue",
+    "insertelement",
+    "landingpad",
+    "call",
+    "invoke",
+    "callbr",
+}
+
+
+def _close(text: str, i: int) -> int:
+    """
+    The offset after the bracket that closes the one at text[i]. Strings
+    inside of the brackets are skipped.
+    """
+    depth = 0
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            close = text.find('"', i + 1)
+            i = len(text) if close == -1 else close
+        elif c in _OPENING:
+            depth += 1
+        elif c in _CLOSING:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(text)
+
+
+def read_type(text: str, i: int) -> Optional[int]:
+    """
+    If a type starts at text[i], after any whitespace, the offset it ends at
+    """
+    i = _space_regex.match(text, i).end()
+    if i >= len(text):
+        return None
+    if text[i] in "[{<":
+        end = _close(text, i)
+    elif m := _type_regex.match(text, i):
+        end = m.end()
+    else:
+        return None
+    # typed pointers, from before opaque pointers
+    return _pointer_regex.match(text, end).end()
+
+
+def first_type(text: str, i: int = 0) -> Optional[str]:
+    """
+    The first type at or after text[i], skipping over the flags, attributes,
+    calling conventions and numbers in front of it. Stops at the end of the
+    operand.
+    """
+    while i < len(text):
+        i = _space_regex.match(text, i).end()
+        if i >= len(text) or text[i] in ",)]}":
+            return None
+        if end := read_type(text, i):
+            return text[i:end].strip()
+        m = _word_regex.match(text, i)
+        if m is None:
+            return None
+        i = m.end()
+        # like 'align(8)' or 'range(i32 0, 10)'
+        if i < len(text) and text[i] == "(":
+            i = _close(text, i)
+    return None
+
+
+def top_level_commas(text: str, i: int = 0) -> Iterator[int]:
+    """
+    The offsets of the commas from text[i] on that aren't inside of brackets
+    or strings, stopping at a closing bracket that wasn't opened
+    """
+    while i < len(text):
+        c = text[i]
+        if c == ",":
+            yield i
+        elif c == '"' or c in _OPENING:
+            i = _close(text, i) - 1
+        elif c in _CLOSING or c == ";":
+            return
+        i += 1
+
+
+def _operand_type(text: str, n: int) -> Optional[str]:
+    """
+    The type of the nth operand, counting from 0
+    """
+    if n == 0:
+        return first_type(text, _opcode_regex.match(text).end())
+    for i, comma in enumerate(top_level_commas(text)):
+        if i == n - 1:
+            return first_type(text, comma + 1)
+    return None
+
+
+def _last_type(text: str) -> Optional[str]:
+    commas = list(top_level_commas(text))
+    return first_type(text, commas[-1] + 1) if commas else None
+
+
+def _members(t: str) -> List[str]:
+    """
+    The member types of a literal struct type
+    """
+    inner = t.lstrip("<").rstrip(">").strip()[1:-1]
+    bounds = [-1, *top_level_commas(inner), len(inner)]
+    return [inner[a + 1 : b].strip() for a, b in zip(bounds, bounds[1:])]
+
+
+def _element(t: str, index: int) -> Optional[str]:
+    if m := _array_regex.fullmatch(t) or _vector_regex.fullmatch(t):
+        return m.groups()[-1].strip()
+    if t.startswith("{") or t.startswith("<{"):
+        members = _members(t)
+        return members[index] if index < len(members) else None
+    # named struct types would have to be looked up
+    return None
+
+
+def result_type(text: str) -> Optional[str]:
+    """
+    The type of the value an instruction produces, from its text after the
+    '='. Only the instruction itself is looked at, so the type isn't known if
+    it depends on an operand without a written type.
+    """
+    m = _opcode_regex.match(text)
+    if m is None:
+        return None
+    op = m.group(1)
+    if op in _FIRST_TYPE:
+        return _operand_type(text, 0)
+    if op in ("icmp", "fcmp"):
+        t = _operand_type(text, 0)
+        if t and (v := _vector_regex.fullmatch(t)):
+            return f"<{v.group(1)} x i1>"
+        return t and "i1"
+    if op in _CASTS:
+        to = text.rfind(" to ")
+        return None if to == -1 else first_type(text, to + 4)
+    if op == "alloca":
+        if a := _addrspace_regex.search(text):
+            return f"ptr addrspace({a.group(1)})"
+        return "ptr"
+    if op == "getelementptr":
+        # a vector of pointers gives a vector of pointers
+        t = _operand_type(text, 1)
+        return t if t and t.startswith("<") else "ptr"
+    if op in ("select", "atomicrmw"):
+        return _operand_type(text, 1)
+    if op == "cmpxchg":
+        t = _operand_type(text, 1)
+        return t and f"{{ {t}, i1 }}"
+    if op == "va_arg":
+        return _last_type(text)
+    if op == "extractelement":
+        t = _operand_type(text, 0)
+        return t and _element(t, 0)
+    if op == "shufflevector":
+        t, mask = _operand_type(text, 0), _last_type(text)
+        v, w = t and _vector_regex.fullmatch(t), mask and _vector_regex.fullmatch(mask)
+        return v and w and f"<{w.group(1)} x {v.group(2).strip()}>"
+    if op == "extractvalue":
+        t = _operand_type(text, 0)
+        indices = list(top_level_commas(text))
+        for a, b in zip(indices, indices[1:] + [len(text)]):
+            index = text[a + 1 : b].strip()
+            if index.startswith("!"):
+                # metadata attachments follow the indices
+                break
+            if t is None or not index.isdigit():
+                return None
+            t = _element(t, int(index))
+        return t
+    return None
+
+
+class FunctionTypes:
+    """
+    The types of the local values of a function, read from the text of the
+    statement or formal that defines them. Each type is only worked out the
+    first time it is asked for, so that showing the types of a few lines of
+    a large function doesn't look at the rest of it.
+    """
+
+    def __init__(self, f: ir.Function, lines: List[str], first_line: int):
+        self.function = f
+        # the lines of the function, the first of which is first_line
+        self.lines = lines
+        self.first_line = first_line
+        self._types: Dict[str, Optional[str]] = dict()
+
+    def line(self, n: int) -> str:
+        return self.lines[n - self.first_line]
+
+    def _text(self, i: ir.IR) -> str:
+        rng = i.location.rng
+        return self.line(rng.start.line)[rng.start.column : rng.end.column]
+
+    def type_of(self, name: str) -> Optional[str]:
+        if name in self._types:
+            return self._types[name]
+        t = None
+        i = self.function.symbols.get(name)
+        if isinstance(i, ir.Formal):
+            t = first_type(self._text(i))
+        elif isinstance(i, ir.StatementWithValue):
+            text = self._text(i)
+            if (eq := text.find("=")) != -1:
+                t = result_type(text[eq + 1 :])
+        self._types[name] = t
+        return t
+
+
+def call_arguments(line: str, open_paren: int) -> List[Tuple[int, int]]:
+    """
+    The spans of the arguments of a call whose argument list starts at
+    line[open_paren], without the whitespace around them
+    """
+    bounds = [open_paren, *top_level_commas(line, open_paren + 1)]
+    close = _close(line, open_paren) - 1
+    bounds.append(close)
+    spans = []
+    for a, b in zip(bounds, bounds[1:]):
+        arg = line[a + 1 : b]
+        if stripped := arg.strip():
+            start = a + 1 + len(arg) - len(arg.lstrip())
+            spans.append((start, start + len(stripped)))
+    return spans
@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+from typing import List, Dict, Iterable, Iterator, Tuple, Callable, Optional
+
+import lllsp.ir as ir
+from lllsp.cancel import CancelToken, NEVER
+from lllsp.parser.reader import strip_comment
+from lllsp.parser.spans import SourceSpan
+
+
+@dataclass
+class Chunk:
+    """
+    The names in a span of lines that aren't defined in the span itself,
+    found when the span started at line 'start'. The ones that aren't
+    defined anywhere are kept for the top level definitions they were
+    looked up in.
+    """
+
+    start: int
+    names: List[ir.Name]
+    undefined: Optional[Tuple[int, List[ir.Name]]] = None
+
+
+def _in_string(line: str, column: int) -> bool:
+    return line.count('"', 0, column) % 2 == 1
+
+
+def _implicit_entry(f: ir.Define) -> Optional[str]:
+    """
+    The name of the entry block of f if it has no label. It is numbered
+    after the unnamed formals.
+    """
+    if f.statements and isinstance(f.statements[0], ir.Label):
+        return None
+    unnamed = sum(1 for a in f.formals if a.name.basename().isdigit())
+    return f"%{unnamed}"
+
+
+class UndefinedNames:
+    """
+    The names in a file that don't refer to anything. They are checked a
+    span of the file at a time, keyed by the hash of the span's text. Only
+    the spans that changed since the previous version are checked again,
+    the others are reused and shifted to their new lines. Names that could
+    be defined at the top level are looked up in the module again only if
+    the top level definitions changed, since those are where they are
+    defined.
+    """
+
+    def __init__(self):
+        # the chunks in file order, with the line they start at now
+        self.chunks: List[Tuple[int, int, Chunk]] = []
+        # identifies the top level definitions
+        self.globals_key = 0
+
+    @classmethod
+    def build(
+        cls,
+        module: ir.Module,
+        spans: Iterable[SourceSpan],
+        names_in: Callable[[int, int], Iterable[ir.Name]],
+        lines_in: Callable[[int, int], List[str]],
+        globals_key: int,
+        previous: Optional["UndefinedNames"] = None,
+        token: CancelToken = NEVER,
+    ) -> "UndefinedNames":
+        """
+        Find the undefined names, reusing the chunks of 'previous' whose
+        spans didn't change. names_in(start, end) and lines_in(start, end)
+        return the names and the text of the lines [start, end).
+        """
+        reuse: Dict[int, Chunk] = {}
+        if previous:
+            reuse = {key: c for key, _, c in previous.chunks}
+
+        u = cls()
+        u.globals_key = globals_key
+        for span in spans:
+            token.check()
+            if (c := reuse.get(span.key)) is None:
+                names = names_in(span.start, span.end)
+                if span.error is not None:
+                    # the names of an unfinished entity aren't defined yet
+                    error = span.error.rng.start
+                    names = (n for n in names if n.location.rng.start < error)
+                lines = lines_in(span.start, span.end)
+                c = Chunk(span.start, cls._check(module, names, lines, span.start))
+            u.chunks.append((span.key, span.start, c))
+        return u
+
+    @staticmethod
+    def _check(
+        module: ir.Module,
+        names: Iterable[ir.Name],
+        lines: List[str],
+        first_line: int,
+    ) -> List[ir.Name]:
+        entries: Dict[int, Optional[str]] = {}
+        res = []
+        for n in names:
+            start = n.location.rng.start
+            # metadata kinds, specialized nodes and debug records look like
+            # names, but only numbered nodes and groups are references
+            if isinstance(n, (ir.MetadataName, ir.AttributeName)):
+                if not n.basename().isdigit():
+                    continue
+            if isinstance(n, ir.ValueName):
+                # the formals of a declare are outside of any Define
+                if f := module.function_at(start):
+                    if n.name in f.symbols:
+                        continue
+                    if isinstance(f, ir.Define):
+                        if id(f) not in entries:
+                            entries[id(f)] = _implicit_entry(f)
+                        if n.name == entries[id(f)]:
+                            continue
+            code = strip_comment(lines[start.line - first_line])
+            if start.column >= len(code) or _in_string(code, start.column):
+                continue
+            res.append(n)
+        return res
+
+    @staticmethod
+    def _defined(module: ir.Module, n: ir.Name) -> bool:
+        if isinstance(n, ir.ValueName):
+            return isinstance(module.symbols.get(n.name), ir.TypeDefinition)
+        # the rest of the names don't depend on where they are
+        return module.resolve(n) is not None
+
+    def undefined(self, module: ir.Module) -> Iterator[Tuple[ir.Name, int]]:
+        """
+        The undefined names, and how many lines they moved by since their
+        chunk was checked
+        """
+        for _, start, c in self.chunks:
+            if c.undefined is None or c.undefined[0] != self.globals_key:
+                names = [n for n in c.names if not self._defined(module, n)]
+                c.undefined = (self.globals_key, names)
+            for n in c.undefined[1]:
+                yield n, start - c.start
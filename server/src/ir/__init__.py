@@ -1,14 +1,18 @@
-from typing import Optional, Any, List, Sequence
+from typing import Optional, Any, List, Sequence, Dict, Iterator, Tuple
 from dataclasses import dataclass, field
 import abc
-from .location import Location
+from .location import Location, Range, Position
 import itertools
+import functools
+from bisect import bisect_right
+from array import array
 
 
 @dataclass
 class IR:
     location: Location
 
+
 @dataclass
 class SourceFilename(IR):
     filename: str
@@ -59,7 +63,6 @@ class SymbolName(Name):
         return self.name.removeprefix("@")
 
 
-
 @dataclass
 class MetadataName(Name):
     """
@@ -70,7 +73,6 @@ class MetadataName(Name):
         return self.name.removeprefix("!")
 
 
-
 @dataclass
 class AttributeName(Name):
     """
@@ -86,12 +88,11 @@ class Label(Name):
     """
     :-suffixed names
     """
-    
+
     def basename(self) -> str:
         return self.name.removesuffix(":")
 
 
-
 @dataclass
 class TypeDefinition(IR):
     name: ValueName
@@ -117,32 +118,49 @@ class StatementWithValue(Statement):
     value: ValueName
 
 
+@dataclass
+class CallSite(IR):
+    """
+    A direct call, invoke or callbr of a function
+    """
+
+    callee: SymbolName
+
+
 @dataclass
 class Function(IR, metaclass=abc.ABCMeta):
     name: SymbolName
     formals: List[Formal]
 
-    def resolve(self, i: Name):
+    @functools.cached_property
+    def symbols(self) -> Dict[str, IR]:
+        """
+        The local definitions in this function, keyed by the name used to
+        refer to them. If a name is defined twice, the first one wins.
+        """
+        symbols: Dict[str, IR] = dict()
         for f in self.formals:
-            import sys
-            if i.name == f.name.name:
-                return f
-        return None
+            symbols.setdefault(f.name.name, f)
+        return symbols
+
+    def resolve(self, i: Name):
+        return self.symbols.get(i.name)
+
 
 @dataclass
 class Define(Function):
     statements: List[Statement | Label]
-    
-    def resolve(self, i: Name):
-        if x := super().resolve(i):
-            return x
-    
+    calls: List[CallSite] = field(default_factory=list)
+
+    @functools.cached_property
+    def symbols(self) -> Dict[str, IR]:
+        symbols = super().symbols
         for s in self.statements:
-            if isinstance(s, Label) and s.name.removesuffix(":") == i.name.removeprefix("%"):
-                return s
-            elif isinstance(s, StatementWithValue) and s.value.name == i.name:
-                return s
-        return None
+            if isinstance(s, Label):
+                symbols.setdefault("%" + s.basename(), s)
+            elif isinstance(s, StatementWithValue):
+                symbols.setdefault(s.value.name, s)
+        return symbols
 
 
 @dataclass
@@ -160,11 +178,169 @@ class Metadata(IR):
     name: MetadataName
 
 
+@dataclass
+class MetadataSpan:
+    """
+    The source span of a numbered metadata node, '!N = ...', without its body
+    """
+
+    id: int
+    start: Position
+    end: Position
+
+
+class MetadataTable:
+    """
+    All of the metadata nodes in a module.
+
+    Numbered nodes ('!N') make up most of a module with debug info, so they
+    are stored compactly: dense arrays indexed by N that only hold where the
+    node is in the source. The ir.Metadata for a node is only created when
+    it is looked up. Named nodes ('!llvm.dbg.cu') are few and stored as-is.
+    """
+
+    def __init__(self, filename: str = ""):
+        self.filename = filename
+        self.named: Dict[str, Metadata] = dict()
+        self._start_line = array("l")
+        self._start_col = array("l")
+        self._end_line = array("l")
+        self._end_col = array("l")
+        self._count = 0
+
+    def add(self, m: Metadata):
+        self.named[m.name.name] = m
+
+    def _reserve(self, id: int):
+        missing = id + 1 - len(self._start_line)
+        if missing > 0:
+            fill = [-1] * missing
+            self._start_line.extend(fill)
+            self._start_col.extend(fill)
+            self._end_line.extend(fill)
+            self._end_col.extend(fill)
+
+    def add_span(self, span: MetadataSpan):
+        self._reserve(span.id)
+        if self._start_line[span.id] == -1:
+            self._count += 1
+        self._start_line[span.id] = span.start.line
+        self._start_col[span.id] = span.start.column
+        self._end_line[span.id] = span.end.line
+        self._end_col[span.id] = span.end.column
+
+    def copy_spans(self, other: "MetadataTable", ids: Sequence[int], delta: int):
+        """
+        Add the numbered nodes 'ids' of another table, moved down by delta
+        lines
+        """
+        if not ids:
+            return
+        self._reserve(max(ids))
+        for id in ids:
+            if self._start_line[id] == -1:
+                self._count += 1
+            self._start_line[id] = other._start_line[id] + delta
+            self._start_col[id] = other._start_col[id]
+            self._end_line[id] = other._end_line[id] + delta
+            self._end_col[id] = other._end_col[id]
+
+    def get(self, id: int) -> Optional[Metadata]:
+        """
+        Decode the numbered node '!id', if it exists
+        """
+        if id < 0 or id >= len(self._start_line) or self._start_line[id] == -1:
+            return None
+        name = f"!{id}"
+        line = self._start_line[id]
+        col = self._start_col[id]
+        name_rng = Range(Position(col, line), Position(col + len(name), line))
+        rng = Range(
+            Position(col, line),
+            Position(self._end_col[id], self._end_line[id]),
+        )
+        return Metadata(
+            Location(self.filename, rng),
+            MetadataName(Location(self.filename, name_rng), name),
+        )
+
+    def lookup(self, name: str) -> Optional[Metadata]:
+        """
+        Find a node by its name, like '!12' or '!llvm.module.flags'
+        """
+        basename = name.removeprefix("!")
+        if basename.isdigit():
+            return self.get(int(basename))
+        return self.named.get(name)
+
+    def ids_with_prefix(self, digits: str) -> Iterator[int]:
+        """
+        The ids of the numbered nodes whose number starts with digits, in
+        the order of their names, without writing out the name of every node
+        """
+        end = len(self._start_line)
+
+        def visit(id: int) -> Iterator[int]:
+            # every id under this one is larger
+            if id >= end:
+                return
+            if self._start_line[id] != -1:
+                yield id
+            # numbers don't have leading zeros
+            if id != 0:
+                for child in range(id * 10, id * 10 + 10):
+                    yield from visit(child)
+
+        if digits == "":
+            for id in range(10):
+                yield from visit(id)
+        elif digits.isdigit() and (digits == "0" or not digits.startswith("0")):
+            yield from visit(int(digits))
+
+    def line_spans(self) -> Iterator[Tuple[int, int]]:
+        """
+        The first and last line of every node, without decoding them
+        """
+        for m in self.named.values():
+            yield m.location.rng.start.line, m.location.rng.end.line
+        for id in self.ids():
+            yield self._start_line[id], self._end_line[id]
+
+    def ids(self) -> Iterator[int]:
+        for id, line in enumerate(self._start_line):
+            if line != -1:
+                yield id
+
+    def __iter__(self) -> Iterator[Metadata]:
+        yield from self.named.values()
+        for id in self.ids():
+            if m := self.get(id):
+                yield m
+
+    def __len__(self) -> int:
+        return len(self.named) + self._count
+
+
 @dataclass
 class Attribute(IR):
     name: AttributeName
 
 
+def definition_name(i: IR) -> Optional[Name]:
+    """
+    Return the name written at the definition of i, if it has one
+    """
+    if isinstance(i, Name):
+        return i
+    elif isinstance(i, StatementWithValue):
+        return i.value
+    elif isinstance(
+        i, (Function, TypeDefinition, Formal, Constant, Metadata, Attribute)
+    ):
+        return i.name
+    return None
+
+
 @dataclass
 class Module(IR):
     source_filename: Optional[SourceFilename] = field(default=None)
@@ -172,11 +348,10 @@ class Module(IR):
     types: List[TypeDefinition] = field(default_factory=list)
     constants: List[Constant] = field(default_factory=list)
     functions: List[Function] = field(default_factory=list)
-    metadata: List[Metadata] = field(default_factory=list)
+    metadata: MetadataTable = field(default_factory=MetadataTable)
     attributes: List[Attribute] = field(default_factory=list)
 
-
-    def add(self, i: IR):
+    def add(self, i: IR | MetadataSpan):
         if isinstance(i, SourceFilename):
             self.source_filename = i
         elif isinstance(i, TargetString):
@@ -188,11 +363,37 @@ class Module(IR):
         elif isinstance(i, Function):
             self.functions.append(i)
         elif isinstance(i, Metadata):
-            self.metadata.append(i)
+            self.metadata.add(i)
+        elif isinstance(i, MetadataSpan):
+            self.metadata.add_span(i)
         elif isinstance(i, Attribute):
             self.attributes.append(i)
         else:
             raise ValueError("don't know how to add that")
+        # the symbol table is now stale
+        self.__dict__.pop("symbols", None)
+
+    @functools.cached_property
+    def symbols(self) -> Dict[str, IR]:
+        """
+        The module level definitions, other than metadata, keyed by their
+        name. If a name is defined twice, the first one wins.
+        """
+        symbols: Dict[str, IR] = dict()
+        for i in itertools.chain(
+            self.types, self.functions, self.constants, self.attributes
+        ):
+            symbols.setdefault(i.name.name, i)
+        return symbols
+
+    def function_at(self, pos: Position) -> Optional[Function]:
+        """
+        Return the function whose location contains pos, if any
+        """
+        idx = bisect_right(self.functions, pos, key=lambda f: f.location.rng.start)
+        if idx > 0 and pos in self.functions[idx - 1].location.rng:
+            return self.functions[idx - 1]
+        return None
 
     def resolve(self, i: Name) -> Optional[IR]:
         """
@@ -200,28 +401,21 @@ class Module(IR):
         """
         if isinstance(i, ValueName):
             # it could be a typedef or a statement in a function or a formal
-            for f in self.functions:
-                if i.location.rng in f.location.rng:
-                    if res := f.resolve(i):
-                        return res
-                    
+            if f := self.function_at(i.location.rng.start):
+                if res := f.resolve(i):
+                    return res
+
             # if we get here, its a typedef
-            for t in self.types:
-                if i.name == t.name.name:
-                    return t
+            if isinstance(t := self.symbols.get(i.name), TypeDefinition):
+                return t
         elif isinstance(i, SymbolName):
             # it could be a constant or function
-            for c in itertools.chain(self.functions, self.constants):
-                if i.name == c.name.name:
-                    return c
+            if isinstance(c := self.symbols.get(i.name), (Function, Constant)):
+                return c
         elif isinstance(i, MetadataName):
-            for m in self.metadata:
-                if i.name == m.name.name:
-                    return m
+            return self.metadata.lookup(i.name)
         elif isinstance(i, AttributeName):
-            for a in self.attributes:
-                if i.name == a.name.name:
-                    return a
-                
-        return None
+            if isinstance(a := self.symbols.get(i.name), Attribute):
+                return a
 
+        return None
@@ -3,7 +3,6 @@ from dataclasses import dataclass, field
 import functools
 
 
-
 @dataclass
 @functools.total_ordering
 class Position:
@@ -16,13 +15,14 @@ class Position:
         else:
             self.column = modifier(self.column)
         return self
+
     def mod_line(self, modifier: Callable[[int], int] | int) -> Self:
         if isinstance(modifier, int):
             self.line += modifier
         else:
             self.line = modifier(self.line)
         return self
-    
+
     def __eq__(self, o: Self) -> bool:
         if not isinstance(o, Position):
             return NotImplemented
@@ -48,7 +48,6 @@ class Range:
             return NotImplemented
 
 
-
 @dataclass
 class Location:
     filename: str = ""
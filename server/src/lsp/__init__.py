@@ -1,155 +1,1623 @@
 import lsprotocol.types as lsT
 from pygls.server import LanguageServer
+from pygls.protocol import LanguageServerProtocol, default_converter, lsp_method
+from pygls.feature_manager import is_thread_function
+from pygls.exceptions import JsonRpcRequestCancelled
 from dataclasses import dataclass, field
 import lllsp.ir.location as location
 from lllsp.parser import IRParser, NameParser
-from lllsp.parser.reader import Reader
-from typing import List, Dict, Iterable, Tuple, Optional
+from lllsp.parser.reader import (
+    Reader,
+    TextReader,
+    TextLines,
+    FileStamp,
+    open_text,
+    is_compressed,
+    split_lines,
+    LL_SUFFIXES,
+)
+from typing import List, Dict, Iterable, Tuple, Optional, Any, Callable, TYPE_CHECKING
 import lllsp.ir as ir
+import lllsp.cancel as cancel
+from lllsp.cancel import Cancelled, CancelToken, SharedToken, NEVER
 import sys
 from lllsp.segments import PositionList
+from lllsp.index.prefix import PrefixIndex
+from lllsp.index.calls import CallGraph
+from lllsp.index.defuse import DefUse
+from lllsp.lsp.columns import ColumnMap, UTF8, UTF16, UTF32
+import bisect
+import concurrent.futures
 import functools
+import heapq
+import itertools
+import os
+import re
+import time
+
+# only imported when a feature that needs them is first used
+if TYPE_CHECKING:
+    from lllsp.cli import StartupProfile
+    from lllsp.parser.skeleton import LineIndex
+    from lllsp.parser.spans import SpanParse, SourceSpan
+    from lllsp.index.occurrences import OccurrenceIndex
+    from lllsp.index.undefined import UndefinedNames
+    from lllsp.index.types import FunctionTypes
+    from lllsp.index.cfg import ControlFlowGraph, BasicBlock
+    from lllsp.lsp.document import DocumentStore
+    from lllsp.lsp.workspace import WorkspaceIndex, WorkspaceSymbol, Preindexer
+
 
 def log(*args, **kwargs):
     print(*args, **kwargs, file=sys.stderr)
 
-def pos_to_lsppos(pos: location.Position):
-    return lsT.Position(pos.line, pos.column)
 
-def rng_to_lsprng(rng: location.Range):
-    return lsT.Range(pos_to_lsppos(rng.start), pos_to_lsppos(rng.end))
+def pos_to_lsppos(pos: location.Position, columns: Optional[ColumnMap] = None):
+    if columns is None:
+        return lsT.Position(pos.line, pos.column)
+    return lsT.Position(pos.line, columns.to_client(pos.line, pos.column))
+
+
+def rng_to_lsprng(rng: location.Range, columns: Optional[ColumnMap] = None):
+    return lsT.Range(pos_to_lsppos(rng.start, columns), pos_to_lsppos(rng.end, columns))
+
 
-def loc_to_lsploc(loc: location.Location):
-    return lsT.Location(loc.filename, rng_to_lsprng(loc.rng))
+def loc_to_lsploc(loc: location.Location, columns: Optional[ColumnMap] = None):
+    return lsT.Location(loc.filename, rng_to_lsprng(loc.rng, columns))
 
-def lsppos_to_pos(pos: lsT.Position):
-    return location.Position(pos.character, pos.line)
 
-def lsprng_to_rng(rng: lsT.Range):
-    return location.Range(lsppos_to_pos(rng.start), lsppos_to_pos(rng.end))
+def lsppos_to_pos(pos: lsT.Position, columns: Optional[ColumnMap] = None):
+    if columns is None:
+        return location.Position(pos.character, pos.line)
+    return location.Position(columns.from_client(pos.line, pos.character), pos.line)
+
+
+def lsprng_to_rng(rng: lsT.Range, columns: Optional[ColumnMap] = None):
+    return location.Range(
+        lsppos_to_pos(rng.start, columns), lsppos_to_pos(rng.end, columns)
+    )
+
+
+def lsploc_to_loc(loc: lsT.Location, columns: Optional[ColumnMap] = None):
+    return location.Location(loc.uri, lsprng_to_rng(loc.range, columns))
 
-def lsploc_to_loc(loc: lsT.Location):
-    return location.Location(loc.uri, lsprng_to_rng(loc.range))
 
 def range_to_lines(rng: location.Range, lines: List[str]) -> List[str]:
     if rng.start.line == rng.end.line:
-        return [lines[rng.start.line][rng.start.column:rng.end.column]]
-    
-    res = [
-        lines[rng.start.line][rng.start.column:]
-    ]
-    for idx in range(rng.start.line+1, rng.end.line):
+        return [lines[rng.start.line][rng.start.column : rng.end.column]]
+
+    res = [lines[rng.start.line][rng.start.column :]]
+    for idx in range(rng.start.line + 1, rng.end.line):
         res.append(lines[idx])
-    res.append(lines[rng.end.line][:rng.end.column])
+    res.append(lines[rng.end.line][: rng.end.column])
     return res
 
+
 def range_to_text(rng: location.Range, lines: List[str]) -> str:
     return "\n".join(range_to_lines(rng, lines))
 
+
 @dataclass
 class LSPIRName:
     """
     A wrapper class around ir.Name, with lsp helpers
     """
+
     name: ir.Name
-    
+    columns: Optional[ColumnMap] = field(default=None, repr=False)
+
     @functools.cached_property
     def rng(self):
-        return rng_to_lsprng(self.name.location.rng)
+        return rng_to_lsprng(self.name.location.rng, self.columns)
+
+
+def name_to_symbol(
+    i: ir.IR,
+    name: ir.Name,
+    kind: lsT.SymbolKind,
+    children: Optional[List[lsT.DocumentSymbol]] = None,
+    basename: bool = True,
+    columns: Optional[ColumnMap] = None,
+) -> lsT.DocumentSymbol:
+    return lsT.DocumentSymbol(
+        name.basename() if basename else name.name,
+        kind,
+        rng_to_lsprng(i.location.rng, columns),
+        rng_to_lsprng(name.location.rng, columns),
+        children=children,
+    )
+
+
+def group_symbols(
+    name: str, kind: lsT.SymbolKind, children: List[lsT.DocumentSymbol]
+) -> lsT.DocumentSymbol:
+    """
+    Group a list of symbols under a single collapsible parent, which spans
+    from the child that starts first to the one that ends last. The children
+    don't need to be in order.
+    """
+    first = min(children, key=lambda c: c.range.start)
+    end = max(c.range.end for c in children)
+    rng = lsT.Range(first.range.start, end)
+    return lsT.DocumentSymbol(name, kind, rng, first.selection_range, children=children)
+
+
+COMPLETION_LIMIT = 200
+"""
+The most completion items returned for one request
+"""
+
+_completion_prefix_regex = re.compile(r"[%@!#][a-zA-Z0-9_.]*$")
+_rename_regex = re.compile(r"[%@!#]?([a-zA-Z0-9_.]+):?")
+
+
+def basename_range(n: ir.Name, columns: Optional[ColumnMap] = None) -> lsT.Range:
+    """
+    The range of a name, without its sigil or trailing ':'
+    """
+    rng = rng_to_lsprng(n.location.rng, columns)
+    if isinstance(n, ir.Label):
+        end = lsT.Position(rng.end.line, rng.end.character - 1)
+        return lsT.Range(rng.start, end)
+    start = lsT.Position(rng.start.line, rng.start.character + 1)
+    return lsT.Range(start, rng.end)
+
+
+def undefined_message(n: ir.Name) -> str:
+    if isinstance(n, ir.MetadataName):
+        return f"use of undefined metadata '{n.name}'"
+    elif isinstance(n, ir.AttributeName):
+        return f"use of undefined attribute group '{n.name}'"
+    return f"use of undefined value '{n.name}'"
+
+
+def completion_kind(i: Optional[ir.IR]) -> lsT.CompletionItemKind:
+    if isinstance(i, ir.Function):
+        return lsT.CompletionItemKind.Function
+    elif isinstance(i, ir.TypeDefinition):
+        return lsT.CompletionItemKind.Struct
+    elif isinstance(i, ir.Attribute):
+        return lsT.CompletionItemKind.Property
+    elif isinstance(i, (ir.Label, ir.Metadata)) or i is None:
+        return lsT.CompletionItemKind.Reference
+    return lsT.CompletionItemKind.Variable
+
+
+def _labels(items: Iterable[ir.IR]) -> List[ir.Label]:
+    """
+    The labels of the Defines among items
+    """
+    return [
+        s
+        for i in items
+        if isinstance(i, ir.Define)
+        for s in i.statements
+        if isinstance(s, ir.Label)
+    ]
+
+
+def _occurrence_index() -> "OccurrenceIndex":
+    from lllsp.index.occurrences import OccurrenceIndex
+
+    return OccurrenceIndex()
+
 
 @dataclass
 class FileInfo:
+    """
+    A snapshot of a parsed file, tagged with the version of the document it
+    was parsed for. The parsed module and names are not changed once the
+    snapshot is published, so queries can run on it from several threads.
+    The indexes derived from them are built the first time they are needed,
+    and building one twice from two threads is harmless, so no locks are
+    taken.
+    """
+
     uri: str
     module: ir.Module
+    columns: ColumnMap = field(default_factory=ColumnMap)
+    version: Optional[int] = None
+    # the text of the document, if it was parsed from an unsaved buffer
+    document: Optional["DocumentStore"] = None
+    # the text that was parsed, if it was read from disk
+    source: Optional[TextLines] = None
     name_segments: PositionList[LSPIRName] = field(init=False)
+    _cache: Dict[str, Tuple[Optional[int], Any]] = field(
+        init=False, default_factory=dict
+    )
+    # keyed by id, but holding on to the function, so that an id that is
+    # reused by another function is never mistaken for it
+    _local_indexes: Dict[int, Tuple[ir.Function, PrefixIndex[ir.IR]]] = field(
+        init=False, default_factory=dict
+    )
+    _def_uses: Dict[int, Tuple[ir.Function, DefUse]] = field(
+        init=False, default_factory=dict
+    )
+    _function_types: Dict[int, Tuple[ir.Function, "FunctionTypes"]] = field(
+        init=False, default_factory=dict
+    )
+    _cfgs: Dict[int, Tuple[ir.Function, "ControlFlowGraph"]] = field(
+        init=False, default_factory=dict
+    )
+    occurrences: "OccurrenceIndex" = field(
+        init=False, default_factory=lambda: _occurrence_index()
+    )
+    undefined: Optional["UndefinedNames"] = field(init=False, default=None)
+    # the contents on disk the snapshot was parsed from
+    stamp: Optional[FileStamp] = field(init=False, default=None)
+    # the top level spans the module was parsed from, for reusing the
+    # unchanged ones when the file is parsed again
+    spans: List["SourceSpan"] = field(init=False, default_factory=list)
+    # the workspace symbols of each span
+    span_symbols: List[List["WorkspaceSymbol"]] = field(
+        init=False, default_factory=list
+    )
 
     def __post_init__(self):
         self.name_segments = PositionList(lambda x: x.rng)
 
+    def cached(
+        self, key: str, version: Optional[int], compute: Callable[[], Any]
+    ) -> Any:
+        """
+        Return the cached value for 'key' if it was computed for this
+        version of the document, otherwise compute and cache it
+        """
+        if (c := self._cache.get(key)) and c[0] == version:
+            return c[1]
+        value = compute()
+        self._cache[key] = (version, value)
+        return value
+
+    def to_lsprng(self, rng: location.Range) -> lsT.Range:
+        return rng_to_lsprng(rng, self.columns)
+
+    def to_lsploc(self, loc: location.Location) -> lsT.Location:
+        return loc_to_lsploc(loc, self.columns)
+
     def build_name_segments(self, names: List[ir.Name]):
+        # names are found in file order, and never overlap
         self.name_segments.clear()
-        for n in names:
-            self.name_segments.append(LSPIRName(n))
-        self.name_segments.sort()
+        self.name_segments.merge([LSPIRName(n, self.columns) for n in names])
+
+    def build_span_names(
+        self,
+        parse: "SpanParse",
+        previous: Optional["FileInfo"],
+        token: CancelToken = NEVER,
+    ):
+        """
+        Build the name segments and the occurrences a span at a time. The
+        names of the spans that were parsed are resolved. The spans reused
+        from the previous snapshot share its names and occurrences if they
+        didn't move, or copy them to their new lines if they did.
+        """
+        from lllsp.parser.spans import shifted
+        from lllsp.index.occurrences import OccurrenceIndex, SpanOccurrences
+
+        globals_key = parse.globals_key()
+        segments = self.name_segments
+        segments.clear()
+        self.occurrences = OccurrenceIndex()
+        reused: Dict[int, SpanOccurrences] = dict()
+        if previous is not None:
+            reused = {
+                id(s): o for s, o in zip(previous.spans, previous.occurrences.spans)
+            }
+
+        for i, (span, old) in enumerate(zip(parse.spans, parse.origins)):
+            token.check()
+            names: Optional[List[LSPIRName]] = None
+            occ = None
+            if old is None or previous is None:
+                names = [LSPIRName(n, self.columns) for n in parse.names[i]]
+                segments.extend(names)
+            elif span.start == old.start:
+                lines = lsT.Range(lsT.Position(old.start, 0), lsT.Position(old.end, 0))
+                segments.extend_from(previous.name_segments, lines)
+                occ = reused.get(id(old))
+            else:
+                delta = span.start - old.start
+                old_names = previous._names_in_lines(old.start, old.end)
+                names = [
+                    LSPIRName(shifted(n.name, delta), self.columns) for n in old_names
+                ]
+                segments.extend(names)
+                if (o := reused.get(id(old))) is not None:
+                    moved: Dict[int, ir.Name] = {
+                        id(a.name): b.name for a, b in zip(old_names, names)
+                    }
+                    moved.update(
+                        (id(a), b)
+                        for a, b in zip(_labels(old.items), _labels(span.items))
+                    )
+                    occ = o.shifted(moved, delta)
+            if occ is None:
+                if names is None:
+                    names = self._names_in_lines(span.start, span.end)
+                occ = SpanOccurrences.build(
+                    self.module,
+                    (n.name for n in names),
+                    _labels(span.items),
+                    globals_key,
+                    token,
+                )
+            self.occurrences.spans.append(occ.resolved(self.module, globals_key))
+
+    def _names_in_lines(self, start: int, end: int) -> List[LSPIRName]:
+        """
+        The names on the lines [start, end)
+        """
+        elts = self.name_segments.elts
+        key = lambda n: n.name.location.rng.start.line
+        lo = bisect.bisect_left(elts, start, key=key)
+        return elts[lo : bisect.bisect_left(elts, end, lo, key=key)]
+
+    def keep_indexes(self, previous: "FileInfo", parse: "SpanParse"):
+        """
+        Keep the indexes that the previous snapshot built, for the parts of
+        the module that were reused from it as they are. The per-function
+        indexes of the functions that were reused are kept as they are, and
+        the module level index and the call graph are copied and updated for
+        the spans that changed.
+        """
+        functions = {id(f): f for f in self.module.functions}
+        for mine, theirs in (
+            (self._local_indexes, previous._local_indexes),
+            (self._def_uses, previous._def_uses),
+            (self._function_types, previous._function_types),
+            (self._cfgs, previous._cfgs),
+        ):
+            for k, entry in list(theirs.items()):
+                if functions.get(k) is entry[0]:
+                    mine[k] = entry
+
+        # the items of a span that was reused at the same lines are the same
+        # objects, the rest were parsed or moved
+        kept = {
+            id(old)
+            for span, old in zip(parse.spans, parse.origins)
+            if old is not None and old.start == span.start
+        }
+        removed = [i for s in previous.spans if id(s) not in kept for i in s.items]
+        added = [
+            i
+            for span, old in zip(parse.spans, parse.origins)
+            if id(old) not in kept
+            for i in span.items
+        ]
+        if "global_index" in previous.__dict__:
+            index = {s: idx.copy() for s, idx in previous.global_index.items()}
+            symbols = self.module.symbols
+            for i in itertools.chain(removed, added):
+                if isinstance(
+                    i, (ir.TypeDefinition, ir.Function, ir.Constant, ir.Attribute)
+                ):
+                    name = i.name.name
+                    index[name[0]].discard(name)
+                    if (defined := symbols.get(name)) is not None:
+                        index[name[0]].add(name, defined)
+            self.__dict__["global_index"] = index
+        if "call_graph" in previous.__dict__:
+            graph = previous.call_graph.copy()
+            for i in removed:
+                graph.remove_function(i)
+            for i in added:
+                graph.add_function(i)
+            self.__dict__["call_graph"] = graph
+
+    def build_symbols(self, parse: "SpanParse", previous: Optional["FileInfo"]):
+        """
+        Build the workspace symbols of the spans that were parsed or moved,
+        and share the previous snapshot's for the spans that weren't
+        """
+        from lllsp.lsp.workspace import item_symbols, demangle_symbols
+
+        reused: Dict[int, List["WorkspaceSymbol"]] = dict()
+        if previous is not None:
+            reused = dict(zip(map(id, previous.spans), previous.span_symbols))
+        built = []
+        for span, old in zip(parse.spans, parse.origins):
+            symbols = None
+            if old is not None and old.start == span.start:
+                symbols = reused.get(id(old))
+            if symbols is None:
+                symbols = item_symbols(self.uri, span.items, self.columns)
+                built.extend(symbols)
+            self.span_symbols.append(symbols)
+        # demangled together, by a single c++filt
+        demangle_symbols(built)
+
+    def workspace_symbols(self) -> List["WorkspaceSymbol"]:
+        if not self.span_symbols:
+            from lllsp.lsp.workspace import module_symbols
+
+            return module_symbols(self.uri, self.module, self.columns)
+        return [s for symbols in self.span_symbols for s in symbols]
+
+    def build_undefined(
+        self,
+        parse: "SpanParse",
+        previous: Optional["FileInfo"],
+        token: CancelToken = NEVER,
+    ):
+        """
+        Find the undefined names, only checking the spans that changed since
+        the previous snapshot
+        """
+
+        from lllsp.index.undefined import UndefinedNames
+
+        def names_in(start: int, end: int) -> Iterable[ir.Name]:
+            return (n.name for n in self._names_in_lines(start, end))
+
+        self.undefined = UndefinedNames.build(
+            self.module,
+            parse.spans,
+            names_in,
+            self._lines,
+            parse.globals_key(),
+            previous and previous.undefined,
+            token,
+        )
+
+    def diagnostics(self) -> List[lsT.Diagnostic]:
+        res = [
+            lsT.Diagnostic(
+                self.to_lsprng(s.error.rng),
+                "incomplete definition",
+                severity=lsT.DiagnosticSeverity.Error,
+                source="lllsp",
+            )
+            for s in self.spans
+            if s.error is not None
+        ]
+        if not self.undefined:
+            return res
+        for n, shift in self.undefined.undefined(self.module):
+            rng = n.location.rng
+            if shift:
+                rng = location.Range(
+                    location.Position(rng.start.column, rng.start.line + shift),
+                    location.Position(rng.end.column, rng.end.line + shift),
+                )
+            res.append(
+                lsT.Diagnostic(
+                    self.to_lsprng(rng),
+                    undefined_message(n),
+                    severity=lsT.DiagnosticSeverity.Error,
+                    source="lllsp",
+                )
+            )
+        return res
 
     def functions(self) -> Iterable[ir.Function]:
         yield from self.module.functions
-    
+
+    def document_symbols(self, token: CancelToken = NEVER) -> List[lsT.DocumentSymbol]:
+        """
+        Build the outline of the module. Attribute groups and metadata are
+        each grouped under a single parent, so that large debug info sections
+        stay collapsed.
+        """
+        columns = self.columns
+        syms = []
+        for t in self.module.types:
+            syms.append(
+                name_to_symbol(t, t.name, lsT.SymbolKind.Struct, columns=columns)
+            )
+        for c in self.module.constants:
+            syms.append(
+                name_to_symbol(c, c.name, lsT.SymbolKind.Variable, columns=columns)
+            )
+        for f in self.module.functions:
+            token.check()
+            labels = None
+            if isinstance(f, ir.Define):
+                labels = [
+                    name_to_symbol(s, s, lsT.SymbolKind.Key, columns=columns)
+                    for s in f.statements
+                    if isinstance(s, ir.Label)
+                ]
+            syms.append(
+                name_to_symbol(
+                    f, f.name, lsT.SymbolKind.Function, labels, columns=columns
+                )
+            )
+        if attrs := [
+            name_to_symbol(
+                a, a.name, lsT.SymbolKind.Property, basename=False, columns=columns
+            )
+            for a in self.module.attributes
+        ]:
+            syms.append(group_symbols("attributes", lsT.SymbolKind.Namespace, attrs))
+        md = []
+        for m in self.module.metadata:
+            token.check()
+            md.append(
+                name_to_symbol(
+                    m, m.name, lsT.SymbolKind.Object, basename=False, columns=columns
+                )
+            )
+        if md:
+            syms.append(group_symbols("metadata", lsT.SymbolKind.Namespace, md))
+
+        syms.sort(key=lambda s: (s.range.start.line, s.range.start.character))
+        return syms
+
+    @functools.cached_property
+    def global_index(self) -> Dict[str, PrefixIndex[ir.IR]]:
+        """
+        Prefix indexes of the module level names, keyed by their sigil
+        """
+        by_sigil = {"%": [], "@": [], "#": []}
+        for name, i in self.module.symbols.items():
+            by_sigil[name[0]].append((name, i))
+        return {s: PrefixIndex(items) for s, items in by_sigil.items()}
+
+    @functools.cached_property
+    def metadata_index(self) -> PrefixIndex[ir.Metadata]:
+        """
+        Prefix index of the named metadata nodes. Numbered nodes are found by
+        their number when they are completed.
+        """
+        return PrefixIndex(self.module.metadata.named.items())
+
+    def _metadata_completions(
+        self, prefix: str, limit: int
+    ) -> Tuple[List[Tuple[str, Optional[ir.IR]]], bool]:
+        """
+        The metadata names starting with prefix, in sorted order. Returns at
+        most 'limit' names, and whether there were more.
+        """
+        named, _ = self.metadata_index.find(prefix)
+        numbered = (
+            (f"!{id}", None) for id in self.module.metadata.ids_with_prefix(prefix[1:])
+        )
+        found = list(
+            itertools.islice(
+                heapq.merge(named, numbered, key=lambda x: x[0]), limit + 1
+            )
+        )
+        return found[:limit], len(found) > limit
+
+    def _parsed(self, f: ir.Function) -> Tuple[ir.Function, PositionList[LSPIRName]]:
+        """
+        The fully parsed version of f, and the name segments that cover it
+        """
+        return f, self.name_segments
+
+    def local_index(self, f: ir.Function) -> PrefixIndex[ir.IR]:
+        """
+        Prefix index of the names local to a function, built the first time
+        the function is asked for
+        """
+        f, _ = self._parsed(f)
+        if (entry := self._local_indexes.get(id(f))) and entry[0] is f:
+            return entry[1]
+        idx = PrefixIndex(f.symbols.items())
+        self._local_indexes[id(f)] = (f, idx)
+        return idx
+
+    def def_use(self, f: ir.Function) -> DefUse:
+        """
+        The def-use chains of a function, built the first time the function
+        is asked for
+        """
+        f, segments = self._parsed(f)
+        if (entry := self._def_uses.get(id(f))) and entry[0] is f:
+            return entry[1]
+        names = segments.range(self.to_lsprng(f.location.rng))
+        du = DefUse.build(f, (n.name for n in names), cancel.current())
+        self._def_uses[id(f)] = (f, du)
+        return du
+
+    def function_types(self, f: ir.Function) -> "FunctionTypes":
+        """
+        The types of the values local to a function, which are worked out as
+        they are asked for
+        """
+        from lllsp.index.types import FunctionTypes
+
+        f, _ = self._parsed(f)
+        if (entry := self._function_types.get(id(f))) and entry[0] is f:
+            return entry[1]
+        rng = f.location.rng
+        start = rng.start.line
+        lines = self.lines(location.Range(location.Position(0, start), rng.end))
+        types = FunctionTypes(f, lines, start)
+        self._function_types[id(f)] = (f, types)
+        return types
+
+    def cfg(self, f: ir.Define) -> "ControlFlowGraph":
+        """
+        The control flow graph of a function, built the first time the
+        function is asked for
+        """
+        from lllsp.index.cfg import ControlFlowGraph
+
+        f, _ = self._parsed(f)
+        if (entry := self._cfgs.get(id(f))) and entry[0] is f:
+            return entry[1]
+        rng = f.location.rng
+        start = rng.start.line
+        lines = self.lines(location.Range(location.Position(0, start), rng.end))
+        cfg = ControlFlowGraph.build(f, lines, start)
+        self._cfgs[id(f)] = (f, cfg)
+        return cfg
+
+    def block_at(
+        self, pos: lsT.Position
+    ) -> Optional[Tuple["ControlFlowGraph", "BasicBlock"]]:
+        """
+        The basic block at a position, and the graph of its function
+        """
+        f = self.module.function_at(location.Position(0, pos.line))
+        if not isinstance(f, ir.Define):
+            return None
+        cfg = self.cfg(f)
+        if b := cfg.block_at(pos.line):
+            return cfg, b
+        return None
+
+    def block_location(self, b: "BasicBlock", terminator: bool = False) -> lsT.Location:
+        """
+        The location of a block's label, or of its terminator. A block without
+        a label is located at its first line.
+        """
+        if terminator and b.terminator is not None:
+            line = self.lines(
+                location.Range(
+                    location.Position(0, b.terminator),
+                    location.Position(0, b.terminator + 1),
+                )
+            )[0]
+            text = line.rstrip("\r\n")
+            rng = location.Range(
+                location.Position(len(text) - len(text.lstrip()), b.terminator),
+                location.Position(len(text), b.terminator),
+            )
+        elif b.label:
+            rng = b.label.location.rng
+        else:
+            rng = location.Range(
+                location.Position(0, b.start), location.Position(0, b.start)
+            )
+        return lsT.Location(self.uri, self.to_lsprng(rng))
+
+    def _value_hints(
+        self, f: ir.Define, segments: List[LSPIRName], types: "FunctionTypes"
+    ) -> Iterable[lsT.InlayHint]:
+        for seg in segments:
+            n = seg.name
+            d = f.symbols.get(n.name) if isinstance(n, ir.ValueName) else None
+            if isinstance(d, ir.Formal):
+                defined_at = d.name.location.rng.start
+            elif isinstance(d, ir.StatementWithValue):
+                defined_at = d.value.location.rng.start
+            else:
+                continue
+            start = n.location.rng.start
+            if start == defined_at or not (t := types.type_of(n.name)):
+                continue
+            # most operands already have their type written in front of them
+            if types.line(start.line)[: start.column].rstrip().endswith(t):
+                continue
+            yield lsT.InlayHint(
+                pos_to_lsppos(n.location.rng.end, self.columns),
+                f": {t}",
+                kind=lsT.InlayHintKind.Type,
+            )
+
+    def _argument_hints(
+        self, f: ir.Define, first: int, last: int, types: "FunctionTypes"
+    ) -> Iterable[lsT.InlayHint]:
+        from lllsp.index.types import call_arguments
+
+        calls = f.calls
+        idx = bisect.bisect_left(calls, first, key=lambda c: c.location.rng.start.line)
+        for c in itertools.islice(calls, idx, None):
+            lineno = c.location.rng.start.line
+            if lineno > last:
+                break
+            callee = self.module.resolve(c.callee)
+            if not isinstance(callee, ir.Function) or not callee.formals:
+                continue
+            line = types.line(lineno)
+            paren = c.callee.location.rng.end.column
+            if not line.startswith("(", paren):
+                continue
+            callee_types = self.function_types(callee)
+            for formal, (column, _) in zip(callee.formals, call_arguments(line, paren)):
+                hint = lsT.InlayHint(
+                    pos_to_lsppos(location.Position(column, lineno), self.columns),
+                    f"{formal.name.name}:",
+                    kind=lsT.InlayHintKind.Parameter,
+                    padding_right=True,
+                )
+                if t := callee_types.type_of(formal.name.name):
+                    hint.tooltip = t
+                yield hint
+
+    def inlay_hints(self, rng: lsT.Range) -> List[lsT.InlayHint]:
+        """
+        The types of the local values used in rng, where they aren't written
+        in front of them, and the names of the formals that the arguments of
+        the calls in rng are passed to. Only the functions that overlap rng
+        are looked at.
+        """
+        functions = self.module.functions
+        idx = bisect.bisect_right(
+            functions, rng.start.line, key=lambda f: f.location.rng.start.line
+        )
+        hints = []
+        for f in itertools.islice(functions, max(idx - 1, 0), None):
+            frng = f.location.rng
+            if frng.start.line > rng.end.line:
+                break
+            if frng.end.line < rng.start.line or not isinstance(f, ir.Define):
+                continue
+            types = self.function_types(f)
+            f, segments = self._parsed(f)
+            clip = self.to_lsprng(f.location.rng)
+            clip = lsT.Range(max(clip.start, rng.start), min(clip.end, rng.end))
+            hints.extend(self._value_hints(f, segments.range(clip), types))
+            hints.extend(self._argument_hints(f, clip.start.line, clip.end.line, types))
+        return hints
+
+    def local_occurrences(
+        self, i: ir.IR, n: ir.Name
+    ) -> Optional[Tuple[ir.Name, List[ir.Name]]]:
+        """
+        If n refers to a name local to a function, return its definition and
+        its uses in the function
+        """
+        if not isinstance(i, (ir.Formal, ir.StatementWithValue, ir.Label)):
+            return None
+        if f := self.module.function_at(n.location.rng.start):
+            du = self.def_use(f)
+            key = "%" + n.basename()
+            if d := du.definition(key):
+                return d, du.uses_of(key)
+        return None
+
+    @functools.cached_property
+    def call_graph(self) -> CallGraph:
+        return CallGraph.build(self.module.functions)
+
+    def call_hierarchy_item(self, f: ir.Function) -> lsT.CallHierarchyItem:
+        return lsT.CallHierarchyItem(
+            f.name.basename(),
+            lsT.SymbolKind.Function,
+            self.uri,
+            self.to_lsprng(f.location.rng),
+            self.to_lsprng(f.name.location.rng),
+            data=f.name.name,
+        )
+
+    def completions(
+        self, prefix: str, pos: location.Position
+    ) -> Tuple[List[Tuple[str, Optional[ir.IR]]], bool]:
+        """
+        Find the names starting with prefix that are visible at pos, with the
+        most local names first. Returns at most COMPLETION_LIMIT names, and
+        whether there were more.
+        """
+        sigil = prefix[0]
+        if sigil == "!":
+            return self._metadata_completions(prefix, COMPLETION_LIMIT)
+        indexes: List[PrefixIndex] = []
+        if sigil == "%" and (f := self.module.function_at(pos)):
+            indexes.append(self.local_index(f))
+        indexes.append(self.global_index[sigil])
+
+        res = []
+        incomplete = False
+        for idx in indexes:
+            found, more = idx.find(prefix, COMPLETION_LIMIT - len(res))
+            res.extend(found)
+            incomplete = incomplete or more
+        return res, incomplete
+
+    def folding_ranges(self) -> List[lsT.FoldingRange]:
+        """
+        Fold function bodies, the basic blocks in them, and runs of
+        consecutive attribute groups and metadata
+        """
+        folds = []
+
+        def fold(start: int, end: int):
+            if end > start:
+                folds.append(
+                    lsT.FoldingRange(start, end, kind=lsT.FoldingRangeKind.Region)
+                )
+
+        def fold_runs(spans: Iterable[Tuple[int, int]]):
+            run = None
+            for start, end in sorted(spans):
+                if run and start <= run[1] + 1:
+                    run = (run[0], max(run[1], end))
+                    continue
+                if run:
+                    fold(*run)
+                run = (start, end)
+            if run:
+                fold(*run)
+
+        for f in self.module.functions:
+            if not isinstance(f, ir.Define):
+                continue
+            # keep the closing brace visible
+            body_end = f.location.rng.end.line - 1
+            fold(f.location.rng.start.line, body_end)
+            labels = [
+                s.location.rng.start.line
+                for s in f.statements
+                if isinstance(s, ir.Label)
+            ]
+            for start, next in zip(labels, labels[1:] + [body_end + 1]):
+                fold(start, next - 1)
+
+        fold_runs(
+            (a.location.rng.start.line, a.location.rng.end.line)
+            for a in self.module.attributes
+        )
+        fold_runs(self.module.metadata.line_spans())
+        return folds
+
     def find_name_segment(self, pos: lsT.Position) -> Optional[LSPIRName]:
         """
         find the segment at the location, or None
         """
         return self.name_segments.find(pos)
-    
+
     def resolve(self, n: LSPIRName) -> Optional[ir.IR]:
         """
         resolve a name to its definition, if any
         """
         return self.module.resolve(n.name)
-    
+
+    def can_rename(self, i: ir.IR) -> bool:
+        """
+        Whether every occurrence of i is known and the file can be edited,
+        so that it can be renamed
+        """
+        return not self.read_only
+
     @property
     def filename(self):
         return self.uri.removeprefix("file://")
 
-    # @functools.lru_cache(maxsize=None)
-    def _lines(self):
-        with open(self.filename, "r") as f:
-            return f.readlines()
+    @property
+    def read_only(self) -> bool:
+        """
+        Compressed files are only used for navigation
+        """
+        return is_compressed(self.filename)
+
+    def _lines(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        """
+        The lines [start, end) of the text that was parsed
+        """
+        if self.document is not None:
+            return self.document[start:end]
+        if self.source is not None:
+            return self.source.lines(start, end)
+        # only read as far as needed, compressed files can't be seeked
+        with open_text(self.filename) as f:
+            return list(itertools.islice(f, start, end))
 
     def lines(self, rng: Optional[location.Range]) -> List[str]:
-        lines = self._lines()
-        if rng:
-            return range_to_lines(rng, lines)
-        return lines
+        if not rng:
+            return self._lines()
+        # only the lines of the range are read
+        lines = self._lines(rng.start.line, rng.end.line + 1)
+        shifted = location.Range(
+            location.Position(rng.start.column, 0),
+            location.Position(rng.end.column, rng.end.line - rng.start.line),
+        )
+        return range_to_lines(shifted, lines)
+
+
+LARGE_FILE_SIZE = 500 * 1024 * 1024
+"""
+Files at least this many bytes are opened in large-file mode, unless
+overridden by the 'largeFileSize' initialization option
+"""
+
+WINDOW_LINES = 2000
+"""
+The number of lines around a position that are fully indexed in large-file mode
+"""
+
+MAX_WINDOWS = 8
+"""
+The number of windows kept in large-file mode, before the least recently
+used one is evicted
+"""
+
+
+@dataclass
+class Window:
+    """
+    A fully indexed range of lines, [start, end), of a file in large-file mode
+    """
+
+    start: int
+    end: int
+    module: ir.Module
+    name_segments: PositionList[LSPIRName]
+
+    def __contains__(self, line: int) -> bool:
+        return self.start <= line < self.end
+
+
+@dataclass
+class LargeFileInfo(FileInfo):
+    """
+    A file that is too large to fully index. The module only has the top
+    level skeleton of the file, and name segments and local symbols are only
+    built for windows of lines around the positions that are asked about.
+    """
+
+    line_index: "LineIndex" = field(default=None)
+    # least recently used first. The tuple is replaced rather than changed,
+    # so that queries on other threads always see a consistent set
+    windows: Tuple[Window, ...] = field(init=False, default=())
+
+    def build_occurrences(self, token: CancelToken = NEVER):
+        from lllsp.index.occurrences import OccurrenceIndex
+
+        # only the names in the windows are known
+        occurrences = OccurrenceIndex()
+        for w in self.windows:
+            for n in w.name_segments.elts:
+                token.check()
+                if i := self._resolve_in(w, n.name):
+                    occurrences.add(i, n.name)
+            for f in w.module.functions:
+                if isinstance(f, ir.Define):
+                    for s in f.statements:
+                        if isinstance(s, ir.Label):
+                            occurrences.add(s, s)
+        self.occurrences = occurrences
+
+    def _window_bounds(self, line: int) -> Tuple[int, int]:
+        start = max(0, line - WINDOW_LINES // 2)
+        end = min(self.line_index.num_lines, line + WINDOW_LINES // 2)
+        # never split a function, so its locals can be resolved
+        if f := self.module.function_at(location.Position(0, start)):
+            start = f.location.rng.start.line
+        if f := self.module.function_at(location.Position(0, end)):
+            end = f.location.rng.end.line + 1
+        return start, end
+
+    def window(self, line: int) -> Window:
+        """
+        Return the window containing line, indexing it if needed
+        """
+        windows = self.windows
+        for w in windows:
+            if line in w:
+                if w is not windows[-1]:
+                    self.windows = tuple(x for x in windows if x is not w) + (w,)
+                return w
+
+        start, end = self._window_bounds(line)
+        text = self.line_index.read(start, end)
+        with TextReader(text, self.filename, start) as r:
+            module = IRParser().parse(r)
+        with TextReader(text, self.filename, start) as r:
+            names = NameParser().parse(r)
+        segments = PositionList(lambda x: x.rng)
+        segments.merge([LSPIRName(n, self.columns) for n in names])
+        w = Window(start, end, module, segments)
+        windows = self.windows + (w,)
+        self.windows = windows[-MAX_WINDOWS:]
+
+        if len(windows) > MAX_WINDOWS:
+            self._local_indexes.clear()
+            self._def_uses.clear()
+            self._function_types.clear()
+            self._cfgs.clear()
+        self.build_occurrences()
+        return w
+
+    def find_name_segment(self, pos: lsT.Position) -> Optional[LSPIRName]:
+        return self.window(pos.line).name_segments.find(pos)
 
-        
+    def can_rename(self, i: ir.IR) -> bool:
+        # a window always holds the whole function, so only locals are safe
+        locals = (ir.Formal, ir.StatementWithValue, ir.Label)
+        return isinstance(i, locals) and super().can_rename(i)
+
+    def _resolve_in(self, w: Window, n: ir.Name) -> Optional[ir.IR]:
+        return w.module.resolve(n) or self.module.resolve(n)
+
+    def resolve(self, n: LSPIRName) -> Optional[ir.IR]:
+        return self._resolve_in(self.window(n.name.location.rng.start.line), n.name)
+
+    def _parsed(self, f: ir.Function) -> Tuple[ir.Function, PositionList[LSPIRName]]:
+        # the skeleton has no locals, use the function from the window instead
+        start = f.location.rng.start
+        w = self.window(start.line)
+        return w.module.function_at(start) or f, w.name_segments
+
+    def _lines(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        if end is None:
+            end = self.line_index.num_lines
+        return split_lines(self.line_index.read(start, end))
+
+
+PREINDEX_JOBS = 2
+"""
+The number of processes that pre-index the workspace, unless overridden by
+the 'preindexJobs' initialization option
+"""
+
+QUERY_WORKERS = 8
+"""
+The number of threads that queries and reparses run on, so that a burst of
+queries doesn't queue behind a slow one or behind a reparse
+"""
+
+CANCEL_POLL = 0.05
+"""
+How often, in seconds, a request waiting for another request's parse checks
+whether it was cancelled
+"""
+
+CHANGE_DELAY = 0.1
+"""
+How long, in seconds, a change waits before reparsing, so that a burst of
+keystrokes is parsed once, for the last of them
+"""
+
+
+class CancellableProtocol(LanguageServerProtocol):
+    """
+    Handles $/cancelRequest for the requests that run on a thread, which
+    pygls can't cancel. Each of them gets a CancelToken that is current on
+    its thread while it runs, and that cancelling the request sets. The
+    handler stops at the next point it checks the token, and the request
+    is answered with a RequestCancelled error.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tokens: Dict[Any, CancelToken] = dict()
+
+    def _execute_request(self, msg_id, handler, params):
+        if not is_thread_function(handler):
+            return super()._execute_request(msg_id, handler, params)
+        token = self._tokens[msg_id] = CancelToken()
+
+        @functools.wraps(handler)
+        def run(params):
+            try:
+                with cancel.scope(token):
+                    # it may have been cancelled while it was queued
+                    token.check()
+                    return handler(params)
+            finally:
+                self._tokens.pop(msg_id, None)
+
+        super()._execute_request(msg_id, run, params)
+
+    def _execute_request_err_callback(self, msg_id, exc):
+        if isinstance(exc, Cancelled):
+            log(f"cancelled request {msg_id}")
+            error = JsonRpcRequestCancelled(f'Request with id "{msg_id}" is canceled')
+            self._send_response(msg_id, error=error.to_response_error())
+            return
+        super()._execute_request_err_callback(msg_id, exc)
+
+    def _handle_cancel_notification(self, msg_id):
+        if token := self._tokens.get(msg_id):
+            token.cancel()
+        else:
+            super()._handle_cancel_notification(msg_id)
+
+
+class DocumentProtocol(CancellableProtocol):
+    """
+    Settles on the position encoding that is cheapest to map, and keeps the
+    text of open documents in a DocumentWorkspace
+    """
+
+    @lsp_method(lsT.INITIALIZE)
+    def lsp_initialize(self, params: lsT.InitializeParams) -> lsT.InitializeResult:
+        from lllsp.lsp.document import DocumentWorkspace
+
+        # the base method without the wrapper pygls adds to call the server's
+        # own initialize handler, which the wrapper of this one calls instead,
+        # once the workspace is replaced
+        result = LanguageServerProtocol.lsp_initialize.__wrapped__(self, params)
+
+        # pygls settles on utf-16 whenever the client offers it, but the
+        # parser counts code points, so utf-32 needs no mapping at all and
+        # utf-8 is cheaper for the client to apply
+        encoding = UTF16
+        general = params.capabilities.general
+        offered = (general and general.position_encodings) or []
+        for e in (UTF32, UTF8):
+            if e in offered:
+                encoding = e
+                result.capabilities.position_encoding = lsT.PositionEncodingKind(e)
+                break
+        self._server.position_encoding = encoding
+
+        # no documents are open yet, so the workspace can be replaced by one
+        # that keeps their text in a DocumentStore and uses our codec
+        sync = result.capabilities.text_document_sync
+        workspace = self.workspace
+        self._workspace = DocumentWorkspace(
+            workspace.root_uri,
+            sync.change if isinstance(sync, lsT.TextDocumentSyncOptions) else sync,
+            list(workspace.folders.values()),
+            position_encoding=encoding,
+        )
+        return result
 
 
 class LLLSP(LanguageServer):
-    def __init__(self):
-        super().__init__("lllsp", "v0.1")
+    def __init__(self, profile: Optional["StartupProfile"] = None):
+        super().__init__(
+            "lllsp",
+            "v0.1",
+            protocol_cls=DocumentProtocol,
+            max_workers=QUERY_WORKERS,
+        )
 
+        # the latest published snapshot of each file
         self.files: Dict[str, FileInfo] = dict()
+        # parses in progress, so that queries for a file that isn't parsed
+        # yet wait for the same parse, and the token that cancels it once
+        # none of them want it any more
+        self._parsing: Dict[str, Tuple[concurrent.futures.Future, SharedToken]] = dict()
+        # the parse that was started last for each file
+        self._latest: Dict[str, int] = dict()
+        self._parse_ids = itertools.count()
+        self.large_file_size = LARGE_FILE_SIZE
+        self.position_encoding = UTF16
+        self.profile = profile
+        self.preindex = False
+        self.preindex_jobs = PREINDEX_JOBS
+        self.preindexer: Optional["Preindexer"] = None
+        self.last_activity = 0.0
+
+    @functools.cached_property
+    def workspace_index(self) -> "WorkspaceIndex":
+        """
+        The top level symbols of every file, for workspace/symbol and for
+        navigating between files
+        """
+        from lllsp.lsp.workspace import WorkspaceIndex
 
-    def file_info(self, uri: str, rebuild=False) -> FileInfo:
+        return WorkspaceIndex()
 
-        if rebuild or uri not in self.files:
-            filename = uri.removeprefix("file://")
-            log(f"parsing {uri}")
-            with Reader(filename) as r:
-                parser = IRParser()
-                f = FileInfo(uri, parser.parse(r))
-            log(f"finished ir parsing {uri}")
-            with Reader(filename) as r:
-                parser = NameParser()
-                f.build_name_segments(parser.parse(r))
-            log(f"finished parsing {uri}")
+    @functools.cached_property
+    def converter(self):
+        """
+        Used to encode results that are cached
+        """
+        return default_converter()
+
+    def file_info(
+        self,
+        uri: str,
+        rebuild=False,
+        document: Optional["DocumentStore"] = None,
+        version: Optional[int] = None,
+    ) -> FileInfo:
+        """
+        The latest snapshot of a file, parsing it if there is none yet or if
+        rebuild is set. The file is read from disk, unless a snapshot of an
+        unsaved document is given, along with its version. Queries keep
+        using the previous snapshot while a rebuild is in progress, and a
+        snapshot is only published if no newer parse of the file was
+        started in the meantime.
+
+        A parse is cancelled once every request waiting for it is. A request
+        that is still waiting then starts it again.
+        """
+        self.last_activity = time.monotonic()
+        token = cancel.current()
+        while True:
+            if not rebuild and (f := self.files.get(uri)):
+                return f
+
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            shared = SharedToken()
+            shared.share(token)
+            if rebuild:
+                self._parsing[uri] = (future, shared)
+                break
+            current, current_token = self._parsing.setdefault(uri, (future, shared))
+            if current is future:
+                break
+            current_token.share(token)
+            try:
+                return self._wait(current, token)
+            except Cancelled:
+                # raises if it was this request that was cancelled
+                token.check()
+
+        parse_id = next(self._parse_ids)
+        self._latest[uri] = parse_id
+        try:
+            f = self._parse(uri, document, version, shared)
+        except BaseException as e:
+            # before failing it, so that a request that starts the parse
+            # again doesn't find it
+            self._end_parse(uri, future)
+            future.set_exception(e)
+            raise
+        finally:
+            self._end_parse(uri, future)
+
+        if self._latest.get(uri) == parse_id:
             self.files[uri] = f
+            self.workspace_index.update(uri, f.workspace_symbols(), f.stamp)
+            if self.preindexer:
+                self.preindexer.skip(f.filename)
+        future.set_result(f)
+        return f
+
+    def _end_parse(self, uri: str, future: concurrent.futures.Future):
+        if (entry := self._parsing.get(uri)) and entry[0] is future:
+            del self._parsing[uri]
+
+    def _wait(self, future: concurrent.futures.Future, token: CancelToken) -> FileInfo:
+        """
+        Wait for another request's parse, unless this request is cancelled
+        first
+        """
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL)
+            except concurrent.futures.TimeoutError:
+                token.check()
+
+    def _parse(
+        self,
+        uri: str,
+        document: Optional["DocumentStore"] = None,
+        version: Optional[int] = None,
+        token: CancelToken = NEVER,
+    ) -> FileInfo:
+        filename = uri.removeprefix("file://")
+        # the text on disk isn't any version of the open document
+        if document is None:
+            version = None
+        previous = self.files.get(uri)
+        # taken before reading, so a change while parsing is never missed
+        stamp = FileStamp.of(filename) if document is None else None
+
+        # compressed files can't be read a window at a time
+        if (
+            document is None
+            and not is_compressed(filename)
+            and os.path.getsize(filename) >= self.large_file_size
+        ):
+            from lllsp.parser.skeleton import SkeletonParser
+
+            log(f"parsing {uri} in large-file mode")
+            module, line_index = SkeletonParser().parse(filename, token)
+            columns = ColumnMap(
+                self.position_encoding,
+                line_index.non_ascii,
+                lambda i: line_index.read(i, i + 1),
+            )
+            f = LargeFileInfo(uri, module, columns, version, line_index=line_index)
+            f.stamp = stamp
+            log(f"finished parsing {uri}")
             return f
+
+        log(f"parsing {uri}")
+        # the parser scans a single buffer, so an unsaved document is joined
+        # once for it
+        if document is not None:
+            text = document.text()
+        else:
+            with Reader(filename) as r:
+                text = r.text
+        from lllsp.parser.spans import SpanParser
+
+        # only the spans that changed since the previous snapshot are parsed
+        reuse = None if isinstance(previous, LargeFileInfo) else previous
+        parse = SpanParser().parse(
+            text,
+            filename,
+            reuse.spans if reuse else (),
+            reuse.module if reuse else None,
+            token,
+        )
+        columns = ColumnMap.from_lines(self.position_encoding, parse.non_ascii())
+        f = FileInfo(
+            uri,
+            parse.module,
+            columns,
+            version,
+            document,
+            TextLines(text) if document is None else None,
+        )
+        f.stamp = stamp
+        f.spans = parse.spans
+        log(
+            f"finished ir parsing {uri}, reused "
+            f"{sum(o is not None for o in parse.origins)}/{len(parse.spans)} spans"
+        )
+        f.build_span_names(parse, reuse, token)
+        if reuse:
+            f.keep_indexes(reuse, parse)
+        f.build_undefined(parse, previous, token)
+        f.build_symbols(parse, reuse)
+        log(f"finished parsing {uri}")
+        return f
+
+    def refresh(self, uri: str) -> FileInfo:
+        """
+        Reparse a file only if its contents on disk are not the ones its
+        snapshot was parsed from. A snapshot of unsaved text is kept if the
+        text was saved as it is.
+        """
+        f = self.files.get(uri)
+        if f is None:
+            return self.file_info(uri)
+        stamp = FileStamp.of(f.filename, f.stamp)
+        if f.document is not None:
+            with open_text(f.filename) as fp:
+                unchanged = fp.read() == f.document.text()
         else:
-            return self.files[uri]
+            unchanged = stamp.same_contents(f.stamp)
+        if unchanged:
+            f.stamp = stamp
+            return f
+        return self.file_info(uri, rebuild=True)
+
+    def file_changed(self, uri: str, kind: lsT.FileChangeType):
+        """
+        A file was changed outside of the editor, e.g. regenerated by a build
+        """
+        is_open = uri in self.workspace.text_documents
+        f = self.files.get(uri)
+        if kind == lsT.FileChangeType.Deleted:
+            if not is_open:
+                self.files.pop(uri, None)
+                self.workspace_index.remove(uri)
+            return
+
+        if is_open:
+            # unsaved edits win over the file on disk
+            if f and f.document is None:
+                self.publish(self.refresh(uri))
+            return
+
+        filename = uri.removeprefix("file://")
+        indexed = self.workspace_index.stamps.get(uri)
+        try:
+            stamp = FileStamp.of(filename, f.stamp if f else indexed)
+        except OSError:
+            return
+        if f and not stamp.same_contents(f.stamp):
+            # closed files are only reparsed when they are asked about again
+            self.files.pop(uri, None)
+        # keep the symbols of indexed files up to date, and pick up new files
+        # if the whole workspace is indexed
+        is_indexed = uri in self.workspace_index.files
+        if (is_indexed or self.preindex) and not stamp.same_contents(indexed):
+            from lllsp.lsp.workspace import summarize_file
+
+            stamp, symbols = summarize_file(
+                filename, self.position_encoding, self.large_file_size
+            )
+            self.workspace_index.update(uri, symbols, stamp)
+
+    def watch_files(self):
+        """
+        Ask the client to tell us about changes to IR files made outside of
+        the editor
+        """
+        watchers = [
+            lsT.FileSystemWatcher(glob_pattern="**/*" + suffix)
+            for suffix in LL_SUFFIXES
+        ]
+        self.register_capability(
+            lsT.RegistrationParams(
+                [
+                    lsT.Registration(
+                        "lllsp-watched-files",
+                        lsT.WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                        lsT.DidChangeWatchedFilesRegistrationOptions(watchers),
+                    )
+                ]
+            )
+        )
+
+    def busy(self) -> bool:
+        """
+        Whether a file was asked about recently, so background work should
+        wait
+        """
+        from lllsp.lsp.workspace import BUSY_DELAY
+
+        return time.monotonic() - self.last_activity < BUSY_DELAY
+
+    def start_preindex(self):
+        """
+        Index the top level of every file in the workspace folders in the
+        background
+        """
+        folders = [f.uri for f in self.workspace.folders.values()]
+        if not folders and self.workspace.root_uri:
+            folders = [self.workspace.root_uri]
+        paths = [uri.removeprefix("file://") for uri in folders]
+        from lllsp.lsp.workspace import Preindexer
+
+        self.preindexer = Preindexer(
+            self.workspace_index,
+            self.preindex_jobs,
+            self.position_encoding,
+            self.large_file_size,
+            self.busy,
+        )
+        for uri in self.files:
+            self.preindexer.skip(uri.removeprefix("file://"))
+        log(f"pre-indexing {paths}")
+        self.preindexer.start(paths)
 
+    def publish(self, f: FileInfo):
+        self.publish_diagnostics(f.uri, f.diagnostics(), version=f.version)
 
-def run_lsp():
 
-    server = LLLSP()
+def run_lsp(profile: Optional["StartupProfile"] = None):
+
+    server = LLLSP(profile)
+    if profile:
+        profile.mark("server created")
+
+    @server.feature(lsT.INITIALIZE)
+    def initialize(ls: LLLSP, params: lsT.InitializeParams):
+        opts = params.initialization_options or {}
+        if (size := opts.get("largeFileSize")) is not None:
+            ls.large_file_size = size
+        ls.preindex = bool(opts.get("preindex", False))
+        if (jobs := opts.get("preindexJobs")) is not None:
+            ls.preindex_jobs = jobs
+        if ls.profile:
+            ls.profile.mark("initialize")
+            ls.profile.report()
+
+    @server.feature(lsT.INITIALIZED)
+    def initialized(ls: LLLSP, params: lsT.InitializedParams):
+        caps = ls.client_capabilities.workspace
+        watched = caps and caps.did_change_watched_files
+        if watched and watched.dynamic_registration:
+            ls.watch_files()
+        if ls.preindex:
+            ls.start_preindex()
+
+    @server.command("lllsp.pauseIndexing")
+    def pause_indexing(ls: LLLSP, args):
+        if ls.preindexer:
+            ls.preindexer.pause()
+
+    @server.command("lllsp.resumeIndexing")
+    def resume_indexing(ls: LLLSP, args):
+        if ls.preindexer:
+            ls.preindexer.resume()
+
+    @server.command("lllsp.cancelIndexing")
+    def cancel_indexing(ls: LLLSP, args):
+        if ls.preindexer:
+            ls.preindexer.cancel()
+
+    @server.command("lllsp.memoryReport")
+    @server.thread()
+    def memory_report_command(ls: LLLSP, args):
+        """
+        Report the approximate memory retained by each file and the
+        workspace index. Passing {"tracemalloc": N} also reports the N lines
+        that allocated the most, starting tracemalloc on the first call.
+        """
+        from lllsp.lsp.memory import memory_report
+
+        opts = (args[0] if args else None) or {}
+        report = memory_report(ls.files, ls.workspace_index, opts.get("tracemalloc"))
+        for uri, sizes in report["files"].items():
+            log(f"{uri}: {sizes['total'] / 2**20:.1f} MiB")
+        log(f"total: {report['total'] / 2**20:.1f} MiB")
+        return report
+
+    def _block_at(
+        ls: LLLSP, args
+    ) -> Tuple[FileInfo, Optional[Tuple["ControlFlowGraph", "BasicBlock"]]]:
+        params = args[0]
+        fi = ls.file_info(params["textDocument"]["uri"])
+        pos = params["position"]
+        return fi, fi.block_at(lsT.Position(pos["line"], pos["character"]))
+
+    @server.command("lllsp.predecessors")
+    @server.thread()
+    def predecessors(ls: LLLSP, args):
+        """
+        The terminators that branch to the basic block at a position. Takes
+        the same {"textDocument", "position"} argument as a definition
+        request.
+        """
+        fi, found = _block_at(ls, args)
+        if not found:
+            return []
+        cfg, b = found
+        return [fi.block_location(p, terminator=True) for p in cfg.predecessors(b)]
+
+    @server.command("lllsp.successors")
+    @server.thread()
+    def successors(ls: LLLSP, args):
+        """
+        The labels of the basic blocks that the block at a position branches
+        to
+        """
+        fi, found = _block_at(ls, args)
+        if not found:
+            return []
+        cfg, b = found
+        return [fi.block_location(s) for s in cfg.successors(b)]
 
     @server.feature(lsT.TEXT_DOCUMENT_DID_OPEN)
-    async def did_open(ls: LLLSP, params: lsT.DidOpenTextDocumentParams):
+    @server.thread()
+    def did_open(ls: LLLSP, params: lsT.DidOpenTextDocumentParams):
         uri = params.text_document.uri
         # TODO: instead of using the uri, can I avoid file IO overhead by parsing the string? does it matter that much?
-        fi = ls.file_info(uri)
-
+        # a cached snapshot may be stale if the file changed while it was closed
+        fi = ls.refresh(uri)
+        ls.publish(fi)
 
     @server.feature(lsT.TEXT_DOCUMENT_DID_SAVE)
-    async def did_save(ls: LLLSP, params: lsT.DidSaveTextDocumentParams):
+    @server.thread()
+    def did_save(ls: LLLSP, params: lsT.DidSaveTextDocumentParams):
         uri = params.text_document.uri
-        fi = ls.file_info(uri, rebuild=True)
+        fi = ls.refresh(uri)
+        ls.publish(fi)
 
+    @server.feature(lsT.WORKSPACE_DID_CHANGE_WATCHED_FILES)
+    @server.thread()
+    def did_change_watched_files(ls: LLLSP, params: lsT.DidChangeWatchedFilesParams):
+        for change in params.changes:
+            ls.file_changed(change.uri, change.type)
+
+    @server.feature(lsT.TEXT_DOCUMENT_DID_CHANGE)
+    @server.thread()
+    def did_change(ls: LLLSP, params: lsT.DidChangeTextDocumentParams):
+        uri = params.text_document.uri
+        doc = ls.workspace.get_text_document(uri)
+        time.sleep(CHANGE_DELAY)
+        # a later change is already waiting to reparse
+        if doc.version != params.text_document.version:
+            return
+        fi = ls.files.get(uri)
+        # large files are only reparsed when they are saved
+        if not fi or fi.read_only or isinstance(fi, LargeFileInfo):
+            return
+        from lllsp.lsp.document import DocumentStore, StoreDocument
+
+        if isinstance(doc, StoreDocument):
+            document = doc.snapshot()
+        else:
+            document = DocumentStore(doc.source)
+        # a later change may have been applied while taking the snapshot
+        version = params.text_document.version
+        if doc.version != version:
+            return
+        fi = ls.file_info(uri, rebuild=True, document=document, version=version)
+        if fi.version == params.text_document.version:
+            ls.publish(fi)
 
     @server.feature(lsT.TEXT_DOCUMENT_DECLARATION)
     @server.feature(lsT.TEXT_DOCUMENT_DEFINITION)
-    async def goto_def(ls: LLLSP, params: lsT.DeclarationParams | lsT.DefinitionParams):
+    @server.thread()
+    def goto_def(ls: LLLSP, params: lsT.DeclarationParams | lsT.DefinitionParams):
         uri = params.text_document.uri
         fi = ls.file_info(uri)
 
@@ -163,15 +1631,32 @@ def run_lsp():
             if i := fi.resolve(seg):
                 log("i", i)
                 loc = i.location
-                if isinstance(i, (ir.Function, ir.TypeDefinition, ir.Metadata, ir.Constant, ir.Attribute)):
+                if isinstance(
+                    i,
+                    (
+                        ir.Function,
+                        ir.TypeDefinition,
+                        ir.Metadata,
+                        ir.Constant,
+                        ir.Attribute,
+                    ),
+                ):
                     loc = i.name.location
-                elif isinstance(i,  ir.StatementWithValue):
+                elif isinstance(i, ir.StatementWithValue):
                     loc = i.value.location
-                locs.append(loc_to_lsploc(loc))
+                locs.append(fi.to_lsploc(loc))
+            # a declared function may be defined in another file
+            if isinstance(seg.name, ir.SymbolName) and (
+                i is None or isinstance(i, ir.Declare)
+            ):
+                for s in ls.workspace_index.definitions(seg.name.name):
+                    if s.uri != uri:
+                        locs.append(s.location())
         return locs
 
     @server.feature(lsT.TEXT_DOCUMENT_REFERENCES)
-    async def refs(ls: LLLSP, params: lsT.ReferenceParams):
+    @server.thread()
+    def refs(ls: LLLSP, params: lsT.ReferenceParams):
         uri = params.text_document.uri
         fi = ls.file_info(uri)
 
@@ -183,21 +1668,149 @@ def run_lsp():
             log("seg", seg)
             if i := fi.resolve(seg):
                 log("i", i)
-                loc = i.location
-                if isinstance(i, ir.Function):
-                    loc = i.name.location
-                locs.append(loc_to_lsploc(loc))
-            # TODO add a module.references()
+                if local := fi.local_occurrences(i, seg.name):
+                    decl, uses = local
+                    occurrences = [decl] + uses
+                else:
+                    decl = ir.definition_name(i)
+                    occurrences = fi.occurrences.get(i)
+                token = cancel.current()
+                for n in occurrences:
+                    token.check()
+                    is_decl = decl and n.location.rng == decl.location.rng
+                    if is_decl and not params.context.include_declaration:
+                        continue
+                    locs.append(lsT.Location(uri, fi.to_lsprng(n.location.rng)))
         return locs
 
+    @server.feature(lsT.TEXT_DOCUMENT_DOCUMENT_HIGHLIGHT)
+    @server.thread()
+    def highlight(ls: LLLSP, params: lsT.DocumentHighlightParams):
+        fi = ls.file_info(params.text_document.uri)
+
+        if seg := fi.find_name_segment(params.position):
+            if i := fi.resolve(seg):
+                if local := fi.local_occurrences(i, seg.name):
+                    decl, uses = local
+                else:
+                    decl = ir.definition_name(i)
+                    uses = fi.occurrences.get(i)
+                highlights = []
+                if decl:
+                    highlights.append(
+                        lsT.DocumentHighlight(
+                            fi.to_lsprng(decl.location.rng),
+                            lsT.DocumentHighlightKind.Write,
+                        )
+                    )
+                token = cancel.current()
+                for n in uses:
+                    token.check()
+                    if decl and n.location.rng == decl.location.rng:
+                        continue
+                    highlights.append(
+                        lsT.DocumentHighlight(
+                            fi.to_lsprng(n.location.rng),
+                            lsT.DocumentHighlightKind.Read,
+                        )
+                    )
+                return highlights
+        return None
+
+    @server.feature(lsT.TEXT_DOCUMENT_PREPARE_RENAME)
+    @server.thread()
+    def prepare_rename(ls: LLLSP, params: lsT.PrepareRenameParams):
+        fi = ls.file_info(params.text_document.uri)
+
+        if seg := fi.find_name_segment(params.position):
+            if (i := fi.resolve(seg)) and fi.can_rename(i):
+                if decl := ir.definition_name(i):
+                    return lsT.PrepareRenameResult_Type1(
+                        basename_range(seg.name, fi.columns), decl.basename()
+                    )
+        return None
+
+    @server.feature(lsT.TEXT_DOCUMENT_RENAME)
+    @server.thread()
+    def rename(ls: LLLSP, params: lsT.RenameParams):
+        uri = params.text_document.uri
+        fi = ls.file_info(uri)
+
+        m = _rename_regex.fullmatch(params.new_name)
+        if not m:
+            return None
+        new_name = m.group(1)
+
+        if seg := fi.find_name_segment(params.position):
+            if (i := fi.resolve(seg)) and fi.can_rename(i):
+                edits = [
+                    lsT.TextEdit(basename_range(n, fi.columns), new_name)
+                    for n in fi.occurrences.get(i)
+                ]
+                return lsT.WorkspaceEdit(changes={uri: edits})
+        return None
+
+    @server.feature(lsT.TEXT_DOCUMENT_PREPARE_CALL_HIERARCHY)
+    @server.thread()
+    def prepare_call_hierarchy(ls: LLLSP, params: lsT.CallHierarchyPrepareParams):
+        fi = ls.file_info(params.text_document.uri)
+
+        if seg := fi.find_name_segment(params.position):
+            if isinstance(i := fi.resolve(seg), ir.Function):
+                return [fi.call_hierarchy_item(i)]
+        return None
+
+    @server.feature(lsT.CALL_HIERARCHY_INCOMING_CALLS)
+    @server.thread()
+    def incoming_calls(ls: LLLSP, params: lsT.CallHierarchyIncomingCallsParams):
+        fi = ls.file_info(params.item.uri)
+
+        callee = params.item.data
+        calls = []
+        for caller in fi.call_graph.callers(callee):
+            rngs = [
+                fi.to_lsprng(c.callee.location.rng)
+                for c in CallGraph.calls(caller, callee)
+            ]
+            calls.append(
+                lsT.CallHierarchyIncomingCall(fi.call_hierarchy_item(caller), rngs)
+            )
+        return calls
+
+    @server.feature(lsT.CALL_HIERARCHY_OUTGOING_CALLS)
+    @server.thread()
+    def outgoing_calls(ls: LLLSP, params: lsT.CallHierarchyOutgoingCallsParams):
+        fi = ls.file_info(params.item.uri)
+
+        caller = fi.module.symbols.get(params.item.data)
+        if not isinstance(caller, ir.Define):
+            return None
+        rngs: Dict[str, List[lsT.Range]] = dict()
+        for c in caller.calls:
+            rngs.setdefault(c.callee.name, []).append(
+                fi.to_lsprng(c.callee.location.rng)
+            )
+        calls = []
+        for callee, from_rngs in rngs.items():
+            if isinstance(f := fi.module.symbols.get(callee), ir.Function):
+                calls.append(
+                    lsT.CallHierarchyOutgoingCall(fi.call_hierarchy_item(f), from_rngs)
+                )
+        return calls
+
+    @server.feature(lsT.WORKSPACE_SYMBOL)
+    @server.thread()
+    def workspace_symbol(ls: LLLSP, params: lsT.WorkspaceSymbolParams):
+        return [s.to_lsp() for s in ls.workspace_index.search(params.query)]
+
     @server.feature(lsT.TEXT_DOCUMENT_HOVER)
-    async def hover(ls: LLLSP, params: lsT.HoverParams):
+    @server.thread()
+    def hover(ls: LLLSP, params: lsT.HoverParams):
         text_doc = ls.workspace.get_text_document(params.text_document.uri)
         fi = ls.file_info(text_doc.uri)
 
         pos = params.position
 
-
         log("hover")
         if seg := fi.find_name_segment(pos):
             log("seg", seg)
@@ -208,21 +1821,75 @@ def run_lsp():
                 # get the first line of the location
                 line = fi.lines(loc.rng)[0].strip()
                 content = lsT.MarkedString_Type1("llvm", line)
-                hov = lsT.Hover(content, rng_to_lsprng(loc.rng))
+                hov = lsT.Hover(content, fi.to_lsprng(loc.rng))
                 return hov
         return None
 
     @server.feature(lsT.TEXT_DOCUMENT_DOCUMENT_SYMBOL)
-    async def doc_sym(ls: LLLSP, params: lsT.DocumentSymbolParams):
+    @server.thread()
+    def doc_sym(ls: LLLSP, params: lsT.DocumentSymbolParams):
         text_doc = ls.workspace.get_text_document(params.text_document.uri)
         fi = ls.file_info(text_doc.uri)
 
-        si = []
-        # TODO: actually implement this
-        for i in fi.functions():
-            s = lsT.SymbolInformation(loc_to_lsploc(i.location), i.name.basename(), lsT.SymbolKind.Function)
-            si.append(s)
-        return si
+        # cache the encoded symbols, so repeated requests for a large
+        # document don't have to rebuild and re-serialize the whole outline
+        return fi.cached(
+            "documentSymbol",
+            text_doc.version,
+            lambda: ls.converter.unstructure(fi.document_symbols(cancel.current())),
+        )
 
-    server.start_io()
+    @server.feature(lsT.TEXT_DOCUMENT_INLAY_HINT)
+    @server.thread()
+    def inlay_hint(ls: LLLSP, params: lsT.InlayHintParams):
+        fi = ls.file_info(params.text_document.uri)
+        return fi.inlay_hints(params.range)
 
+    @server.feature(lsT.TEXT_DOCUMENT_FOLDING_RANGE)
+    @server.thread()
+    def folding_range(ls: LLLSP, params: lsT.FoldingRangeParams):
+        text_doc = ls.workspace.get_text_document(params.text_document.uri)
+        fi = ls.file_info(text_doc.uri)
+
+        return fi.cached(
+            "foldingRange",
+            text_doc.version,
+            lambda: ls.converter.unstructure(fi.folding_ranges()),
+        )
+
+    @server.feature(
+        lsT.TEXT_DOCUMENT_COMPLETION,
+        lsT.CompletionOptions(trigger_characters=["%", "@", "!", "#"]),
+    )
+    @server.thread()
+    def completion(ls: LLLSP, params: lsT.CompletionParams):
+        text_doc = ls.workspace.get_text_document(params.text_document.uri)
+        fi = ls.file_info(text_doc.uri)
+
+        pos = params.position
+        lines = text_doc.lines
+        line = lines[pos.line] if pos.line < len(lines) else ""
+        # the open document's own text may differ from the parsed file
+        columns = ColumnMap.from_text(ls.position_encoding, line)
+        column = columns.from_client(0, pos.character)
+        m = _completion_prefix_regex.search(line[:column])
+        if not m:
+            return None
+        prefix = m.group()
+
+        found, incomplete = fi.completions(prefix, location.Position(column, pos.line))
+        start = lsT.Position(pos.line, columns.to_client(0, m.start()))
+        rng = lsT.Range(start, pos)
+        items = []
+        for rank, (name, i) in enumerate(found):
+            items.append(
+                lsT.CompletionItem(
+                    name,
+                    kind=completion_kind(i),
+                    sort_text=f"{rank:04d}",
+                    text_edit=lsT.TextEdit(rng, name),
+                )
+            )
+        return lsT.CompletionList(incomplete, items)
+
+    server.start_io()
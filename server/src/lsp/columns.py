@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, Callable, List, Optional
+from array import array
+import bisect
+import itertools
+
+import lsprotocol.types as lsT
+from pygls.workspace.position_codec import PositionCodec
+
+UTF8 = "utf-8"
+UTF16 = "utf-16"
+UTF32 = "utf-32"
+
+
+def _unit_widths(text: str, encoding: str) -> Iterable[int]:
+    if encoding == UTF8:
+        return (len(c.encode()) for c in text)
+    return (2 if c > "\uffff" else 1 for c in text)
+
+
+class ColumnMap:
+    """
+    Maps the code point columns used by the parser to the columns of the
+    position encoding negotiated with the client, and back.
+
+    Only lines with non-ASCII text need a table, which is built the first
+    time the line is asked about. Every other line, and every line when the
+    encoding is utf-32, is mapped as is without allocating anything.
+    """
+
+    def __init__(
+        self,
+        encoding: str = UTF16,
+        non_ascii: Iterable[int] = (),
+        read_line: Optional[Callable[[int], str]] = None,
+    ):
+        self.encoding = encoding
+        self.lines = set() if encoding == UTF32 else set(non_ascii)
+        self._read_line = read_line
+        self._tables: Dict[int, array] = {}
+
+    @classmethod
+    def from_text(cls, encoding: str, text: str) -> "ColumnMap":
+        """
+        Build the map for a whole document, keeping only its non-ASCII lines
+        """
+        if encoding == UTF32 or text.isascii():
+            return cls(encoding)
+        return cls.from_lines(
+            encoding,
+            {i: line for i, line in enumerate(text.split("\n")) if not line.isascii()},
+        )
+
+    @classmethod
+    def from_lines(cls, encoding: str, non_ascii: Dict[int, str]) -> "ColumnMap":
+        """
+        Build the map from the non-ASCII lines of a document, by their number
+        """
+        if encoding == UTF32 or not non_ascii:
+            return cls(encoding)
+        return cls(encoding, non_ascii, non_ascii.__getitem__)
+
+    def _table(self, line: int) -> Optional[array]:
+        """
+        The number of client units before each code point of the line, and
+        at its end
+        """
+        if line not in self.lines:
+            return None
+        if (t := self._tables.get(line)) is None:
+            text = self._read_line(line)
+            widths = _unit_widths(text, self.encoding)
+            t = array("l", itertools.accumulate(widths, initial=0))
+            self._tables[line] = t
+        return t
+
+    def to_client(self, line: int, column: int) -> int:
+        t = self._table(line)
+        if t is None:
+            return column
+        last = len(t) - 1
+        if column > last:
+            return t[last] + column - last
+        return t[column]
+
+    def from_client(self, line: int, column: int) -> int:
+        t = self._table(line)
+        if t is None:
+            return column
+        last = len(t) - 1
+        if column > t[last]:
+            return last + column - t[last]
+        # a column inside a character maps to the start of the character
+        return bisect.bisect_right(t, column) - 1
+
+
+class ColumnCodec(PositionCodec):
+    """
+    The workspace's codec for open documents. pygls miscounts the utf-8 and
+    utf-32 units of characters outside of the BMP, so count them the same
+    way as ColumnMap does.
+    """
+
+    def client_num_units(self, chars: str) -> int:
+        if self.encoding == UTF32 or chars.isascii():
+            return len(chars)
+        return sum(_unit_widths(chars, self.encoding))
+
+    def position_from_client_units(
+        self, lines: List[str], position: lsT.Position
+    ) -> lsT.Position:
+        if len(lines) == 0:
+            return lsT.Position(0, 0)
+        if position.line >= len(lines):
+            return lsT.Position(len(lines) - 1, self.client_num_units(lines[-1]))
+        line = lines[position.line].replace("\r\n", "\n")
+        column = ColumnMap.from_text(self.encoding, line).from_client(
+            0, position.character
+        )
+        return lsT.Position(position.line, min(column, len(line)))
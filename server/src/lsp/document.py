@@ -0,0 +1,331 @@
+from typing import List, Tuple, Iterator, Optional, Sequence, overload
+from array import array
+import itertools
+import threading
+
+import lsprotocol.types as lsT
+from pygls.workspace import Workspace, TextDocument
+
+from lllsp.lsp.columns import ColumnCodec, UTF16
+from lllsp.parser.reader import split_lines
+
+CHUNK_LINES = 256
+"""
+The number of lines a DocumentStore keeps together. Chunks are split when
+they grow to twice this size.
+"""
+
+
+def document_lines(text: str) -> List[str]:
+    """
+    The lines of a document, split like split_lines does, with an empty last
+    line after a final newline, since a position can be on it. There is
+    always at least one line.
+    """
+    lines = split_lines(text)
+    if not lines or lines[-1].endswith("\n"):
+        lines.append("")
+    return lines
+
+
+class _Fenwick:
+    """
+    Prefix sums of a list of counts, that can be changed and searched in
+    logarithmic time
+    """
+
+    def __init__(self, counts: Sequence[int]):
+        n = len(counts)
+        self.tree = array("q", [0]) * (n + 1)
+        for i, c in enumerate(counts, 1):
+            self.tree[i] += c
+            if (parent := i + (i & -i)) <= n:
+                self.tree[parent] += self.tree[i]
+
+    def copy(self) -> "_Fenwick":
+        f = _Fenwick.__new__(_Fenwick)
+        f.tree = array("q", self.tree)
+        return f
+
+    def add(self, i: int, delta: int):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """
+        The sum of the first i counts
+        """
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k: int) -> Tuple[int, int]:
+        """
+        The index of the count that the kth unit falls in, and how many units
+        come before that count. Past the end, the index is the number of
+        counts.
+        """
+        i = 0
+        step = 1 << (len(self.tree).bit_length() - 1)
+        while step:
+            if i + step < len(self.tree) and self.tree[i + step] <= k:
+                i += step
+                k -= self.tree[i]
+            step >>= 1
+        return i, self.prefix(i)
+
+
+class DocumentStore(Sequence[str]):
+    """
+    The text of an open document, as a sequence of its lines. The lines are
+    kept in chunks of about CHUNK_LINES, with the number of lines and
+    characters before each chunk kept in Fenwick trees, so that finding a
+    line or an offset and applying an edit take logarithmic time plus the
+    size of a chunk, instead of copying the whole document.
+
+    Chunks are never changed, only replaced, so a snapshot shares them with
+    the store it was taken from and only copies the list of chunks.
+    Windows line endings are stored as '\\n', like the parser expects.
+    """
+
+    def __init__(self, text: str = ""):
+        lines = document_lines(text.replace("\r\n", "\n"))
+        self._chunks: List[Tuple[str, ...]] = [
+            tuple(lines[i : i + CHUNK_LINES]) for i in range(0, len(lines), CHUNK_LINES)
+        ]
+        self._index()
+        self._text: Optional[str] = None
+        # edits come in on the server's thread while queries read the lines
+        self._lock = threading.RLock()
+
+    def _index(self):
+        self._line_counts = _Fenwick([len(c) for c in self._chunks])
+        self._char_counts = _Fenwick([sum(map(len, c)) for c in self._chunks])
+
+    def snapshot(self) -> "DocumentStore":
+        """
+        A copy of the store that later edits don't change
+        """
+        with self._lock:
+            s = DocumentStore.__new__(DocumentStore)
+            s._chunks = list(self._chunks)
+            s._line_counts = self._line_counts.copy()
+            s._char_counts = self._char_counts.copy()
+            s._text = self._text
+            s._lock = threading.RLock()
+            return s
+
+    def __len__(self) -> int:
+        return self._line_counts.prefix(len(self._chunks))
+
+    def num_chars(self) -> int:
+        return self._char_counts.prefix(len(self._chunks))
+
+    def _locate(self, line: int) -> Tuple[int, int]:
+        """
+        The chunk a line is in, and its index in the chunk
+        """
+        chunk, before = self._line_counts.find(line)
+        return chunk, line - before
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+    @overload
+    def __getitem__(self, i: slice) -> List[str]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return list(self.lines(start, stop))
+        with self._lock:
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("line out of range")
+            chunk, idx = self._locate(i)
+            return self._chunks[chunk][idx]
+
+    def lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """
+        The lines [start, end), read a chunk at a time
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        chunk, idx = self._locate(start)
+        remaining = end - start
+        for c in itertools.islice(self._chunks, chunk, None):
+            taken = c[idx : idx + remaining]
+            yield from taken
+            remaining -= len(taken)
+            if remaining <= 0:
+                return
+            idx = 0
+
+    def __iter__(self) -> Iterator[str]:
+        return self.lines()
+
+    def text(self) -> str:
+        """
+        The whole text. It is only joined once for each version.
+        """
+        if self._text is None:
+            self._text = "".join(itertools.chain.from_iterable(self._chunks))
+        return self._text
+
+    def offset_at(self, line: int, column: int) -> int:
+        """
+        The offset of a position, in code points
+        """
+        if line >= len(self):
+            return self.num_chars()
+        chunk, idx = self._locate(line)
+        c = self._chunks[chunk]
+        offset = self._char_counts.prefix(chunk) + sum(map(len, c[:idx]))
+        return offset + min(column, len(c[idx]))
+
+    def position_at(self, offset: int) -> Tuple[int, int]:
+        """
+        The line and column of an offset, in code points
+        """
+        if offset >= self.num_chars():
+            last = len(self) - 1
+            return last, len(self[last])
+        chunk, before = self._char_counts.find(offset)
+        line = self._line_counts.prefix(chunk)
+        offset -= before
+        for l in self._chunks[chunk]:
+            if offset < len(l):
+                break
+            offset -= len(l)
+            line += 1
+        return line, offset
+
+    def replace(self, start: Tuple[int, int], end: Tuple[int, int], text: str):
+        """
+        Replace the text between two (line, column) positions, in code points
+        """
+        text = text.replace("\r\n", "\n")
+        with self._lock:
+            last = len(self) - 1
+            eof = (last, len(self[last]))
+            (start_line, start_col), (end_line, end_col) = sorted(
+                [min(start, eof), min(end, eof)]
+            )
+            first_chunk, first_idx = self._locate(start_line)
+            last_chunk, last_idx = self._locate(end_line)
+            first = self._chunks[first_chunk][first_idx]
+            end_text = self._chunks[last_chunk][last_idx]
+            # a column past the end of a line is at its end, before the newline
+            head = first[: min(start_col, len(first.rstrip("\n")))]
+            tail = end_text[min(end_col, len(end_text.rstrip("\n"))) :]
+            edited = document_lines(head + text + tail)
+            if tail.endswith("\n"):
+                # the line after the edit already follows
+                edited.pop()
+            lines = (
+                self._chunks[first_chunk][:first_idx]
+                + tuple(edited)
+                + self._chunks[last_chunk][last_idx + 1 :]
+            )
+            if len(lines) >= 2 * CHUNK_LINES:
+                chunks = [
+                    lines[i : i + CHUNK_LINES]
+                    for i in range(0, len(lines), CHUNK_LINES)
+                ]
+            else:
+                chunks = [lines]
+
+            if first_chunk == last_chunk and len(chunks) == 1:
+                old = self._chunks[first_chunk]
+                self._chunks[first_chunk] = lines
+                self._line_counts.add(first_chunk, len(lines) - len(old))
+                self._char_counts.add(
+                    first_chunk, sum(map(len, lines)) - sum(map(len, old))
+                )
+            else:
+                self._chunks[first_chunk : last_chunk + 1] = chunks
+                self._index()
+            self._text = None
+
+
+class StoreDocument(TextDocument):
+    """
+    An open document whose text is kept in a DocumentStore, so that the
+    client's incremental changes are applied without copying the document
+    """
+
+    def __init__(self, uri: str, source: Optional[str] = None, **kwargs):
+        super().__init__(uri, source, **kwargs)
+        self.store = DocumentStore(self.source if source is None else source)
+        # the store holds the text from now on
+        self._source = None
+
+    def snapshot(self) -> DocumentStore:
+        return self.store.snapshot()
+
+    def _position(self, position: lsT.Position) -> Tuple[int, int]:
+        p = self._position_codec.position_from_client_units(self.lines, position)
+        return p.line, p.character
+
+    def _apply_incremental_change(
+        self, change: lsT.TextDocumentContentChangeEvent_Type1
+    ) -> None:
+        self.store.replace(
+            self._position(change.range.start),
+            self._position(change.range.end),
+            change.text,
+        )
+
+    def _apply_full_change(self, change: lsT.TextDocumentContentChangeEvent) -> None:
+        self.store = DocumentStore(change.text)
+
+    @property
+    def lines(self) -> DocumentStore:  # type: ignore[override]
+        return self.store
+
+    @property
+    def source(self) -> str:
+        if getattr(self, "store", None) is None:
+            return super().source
+        return self.store.text()
+
+    def offset_at_position(self, client_position: lsT.Position) -> int:
+        return self.store.offset_at(*self._position(client_position))
+
+
+class DocumentWorkspace(Workspace):
+    """
+    A workspace that keeps the text of open documents in DocumentStores, and
+    maps their positions with a ColumnCodec
+    """
+
+    def __init__(self, *args, position_encoding: str = UTF16, **kwargs):
+        super().__init__(*args, position_encoding=position_encoding, **kwargs)
+        self._codec = ColumnCodec(position_encoding)
+
+    @property
+    def position_codec(self) -> ColumnCodec:
+        return self._codec
+
+    def _create_text_document(
+        self,
+        doc_uri: str,
+        source: Optional[str] = None,
+        version: Optional[int] = None,
+        language_id: Optional[str] = None,
+    ) -> TextDocument:
+        return StoreDocument(
+            doc_uri,
+            source=source,
+            version=version,
+            language_id=language_id,
+            sync_kind=self._sync_kind,
+            position_codec=self._codec,
+        )
@@ -0,0 +1,135 @@
+from typing import List, Dict, Iterable, Tuple, Set, Any, Optional
+import enum
+import gc
+import sys
+import types
+
+# shared by every file, or not owned by the objects that refer to them
+_SKIPPED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.MethodType,
+    types.CodeType,
+    types.FrameType,
+    enum.Enum,
+)
+
+
+def _referents(o: Any) -> Iterable[Any]:
+    if isinstance(o, (str, bytes, int, float)) or o is None:
+        return ()
+    # unlike reading __dict__, this doesn't create the dicts of objects
+    # whose attributes are stored inline
+    return gc.get_referents(o)
+
+
+def retained_size(roots: Iterable[Any], seen: Set[int]) -> int:
+    """
+    The approximate number of bytes retained by the objects reachable from
+    roots. Objects in seen are not counted, and the objects that are counted
+    are added to it, so an object shared by several roots is only counted
+    for the first one measured.
+    """
+    total = 0
+    stack = list(roots)
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIPPED):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(_referents(o))
+    return total
+
+
+def file_report(fi: Any, seen: Set[int]) -> Dict[str, int]:
+    """
+    The retained size of a FileInfo, broken down by what holds on to it.
+    The parts are measured in order, so what is shared between them is
+    counted for the first, and 'other' is whatever no part accounts for.
+    """
+    m = fi.module
+    windows = getattr(fi, "windows", ())
+    parts: List[Tuple[str, List[Any]]] = [
+        ("module.types", [m.types]),
+        ("module.constants", [m.constants]),
+        ("module.functions", [m.functions]),
+        ("module.attributes", [m.attributes]),
+        ("module.metadata", [m.metadata]),
+        ("module.other", [m]),
+        (
+            "lines",
+            [fi.document, fi.source, fi.columns, getattr(fi, "line_index", None)],
+        ),
+        ("name_segments.elts", [fi.name_segments.elts]),
+        ("name_segments.segments", [fi.name_segments.segments]),
+        ("windows", [windows]),
+        (
+            "indexes",
+            [
+                fi.occurrences,
+                fi.undefined,
+                fi._local_indexes,
+                fi._def_uses,
+                fi._cfgs,
+                *(
+                    fi.__dict__.get(k)
+                    for k in ("global_index", "metadata_index", "call_graph")
+                ),
+            ],
+        ),
+        ("results", [fi._cache]),
+        ("other", [fi]),
+    ]
+    report = {
+        name: retained_size((r for r in roots if r is not None), seen)
+        for name, roots in parts
+    }
+    report["total"] = sum(report.values())
+    return report
+
+
+def tracemalloc_report(top: int) -> Dict[str, Any]:
+    """
+    The 'top' source lines that allocated the most memory that is still
+    live. Tracing has to be on for allocations to be attributed, so if it
+    isn't yet it is started, and only allocations from then on are seen.
+    """
+    import tracemalloc
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        return {"started": True, "top": []}
+    stats = tracemalloc.take_snapshot().statistics("lineno")
+    return {
+        "started": False,
+        "top": [
+            {
+                "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                "size": s.size,
+                "count": s.count,
+            }
+            for s in stats[:top]
+        ],
+    }
+
+
+def memory_report(
+    files: Dict[str, Any], workspace_index: Any, top: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    The approximate retained size of each file's snapshot and of the
+    workspace index, and optionally a tracemalloc report of the 'top' lines
+    """
+    report: Dict[str, Any] = dict()
+    # before measuring, so that the ids it collects aren't in the snapshot
+    if top:
+        report["tracemalloc"] = tracemalloc_report(top)
+    seen: Set[int] = set()
+    report["files"] = {uri: file_report(fi, seen) for uri, fi in list(files.items())}
+    report["workspaceIndex"] = retained_size([workspace_index], seen)
+    report["total"] = report["workspaceIndex"] + sum(
+        f["total"] for f in report["files"].values()
+    )
+    return report
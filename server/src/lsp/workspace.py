@@ -0,0 +1,443 @@
+from dataclasses import dataclass
+from typing import List, Dict, Iterable, Tuple, Set, Optional, Callable
+import concurrent.futures
+import functools
+import itertools
+import os
+import sys
+import threading
+
+import lsprotocol.types as lsT
+
+import lllsp.ir as ir
+import lllsp.ir.location as location
+from lllsp.index.trigrams import TrigramIndex
+from lllsp.lsp.columns import ColumnMap
+from lllsp.parser import IRParser
+from lllsp.parser.reader import Reader, FileStamp, is_compressed
+from lllsp.parser.skeleton import SkeletonParser
+
+WORKSPACE_SYMBOL_LIMIT = 500
+"""
+The most symbols returned for one workspace/symbol request
+"""
+
+PREINDEX_NICENESS = 10
+"""
+How much lower the priority of the pre-indexing processes is
+"""
+
+BUSY_DELAY = 1.0
+"""
+Pre-indexing waits until no request came in for this many seconds
+"""
+
+PREINDEX_BATCH = 16
+"""
+The pre-indexer adds the symbols of this many files to the workspace index
+at a time, since every update copies the search index
+"""
+
+
+def _rng(rng: location.Range, columns: ColumnMap) -> Tuple[int, int, int, int]:
+    return (
+        rng.start.line,
+        columns.to_client(rng.start.line, rng.start.column),
+        rng.end.line,
+        columns.to_client(rng.end.line, rng.end.column),
+    )
+
+
+def _lsprng(rng: Tuple[int, int, int, int]) -> lsT.Range:
+    return lsT.Range(lsT.Position(rng[0], rng[1]), lsT.Position(rng[2], rng[3]))
+
+
+def _bare(name: str) -> str:
+    """
+    A name without its sigil or quotes
+    """
+    return name[1:].strip('"')
+
+
+@functools.lru_cache(maxsize=None)
+def _cxxfilt() -> Optional[str]:
+    import shutil
+
+    return shutil.which("c++filt")
+
+
+# the demangled form of every name c++filt was given, None if it isn't one
+_demangled: Dict[str, Optional[str]] = dict()
+
+
+def demangle(names: Iterable[str]) -> Dict[str, str]:
+    """
+    The demangled forms of the mangled C++ and Rust names among names, if
+    c++filt is installed. The names that weren't demangled before are all
+    demangled by a single c++filt, and remembered.
+    """
+    mangled = [n for n in names if n.startswith(("_Z", "__Z", "_R"))]
+    missing = list(dict.fromkeys(n for n in mangled if n not in _demangled))
+    if missing and (cxxfilt := _cxxfilt()) is not None:
+        import subprocess
+
+        try:
+            out = subprocess.run(
+                [cxxfilt],
+                input="\n".join(missing),
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.splitlines()
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"failed to demangle names: {e}", file=sys.stderr)
+        else:
+            for m, d in zip(missing, out):
+                _demangled[m] = d if d != m else None
+    return {m: d for m in mangled if (d := _demangled.get(m))}
+
+
+@dataclass
+class WorkspaceSymbol:
+    """
+    A top level symbol of a file in the workspace. The columns are already
+    in the client's position encoding, so symbols can be built in another
+    process.
+    """
+
+    name: str
+    kind: lsT.SymbolKind
+    uri: str
+    rng: Tuple[int, int, int, int]
+    selection: Tuple[int, int, int, int]
+    # declarations are only listed, not navigated to
+    declaration: bool = False
+    demangled: Optional[str] = None
+
+    def location(self) -> lsT.Location:
+        return lsT.Location(self.uri, _lsprng(self.selection))
+
+    def search_keys(self) -> List[str]:
+        keys = [_bare(self.name)]
+        if self.demangled:
+            keys.append(self.demangled)
+        return keys
+
+    def to_lsp(self) -> lsT.WorkspaceSymbol:
+        # clients filter the results by their names again, so a symbol found
+        # by its demangled name has to be listed by it. The name it has in
+        # the IR goes along as its data.
+        if self.demangled:
+            return lsT.WorkspaceSymbol(
+                name=self.demangled,
+                kind=self.kind,
+                location=self.location(),
+                data=self.name,
+            )
+        return lsT.WorkspaceSymbol(
+            name=self.name, kind=self.kind, location=self.location()
+        )
+
+
+# the uri of a file, its symbols, and the contents they were found in
+FileSymbols = Tuple[str, List[WorkspaceSymbol], Optional[FileStamp]]
+
+_kinds: List[Tuple[type, lsT.SymbolKind]] = [
+    (ir.TypeDefinition, lsT.SymbolKind.Struct),
+    (ir.Constant, lsT.SymbolKind.Variable),
+    (ir.Attribute, lsT.SymbolKind.Property),
+    (ir.Function, lsT.SymbolKind.Function),
+]
+
+
+def item_symbols(
+    uri: str, items: Iterable[ir.IR], columns: ColumnMap
+) -> List[WorkspaceSymbol]:
+    """
+    The symbols of the top level entities among items, without their
+    demangled names
+    """
+    res = []
+    for i in items:
+        kind = next((k for t, k in _kinds if isinstance(i, t)), None)
+        if kind is None:
+            continue
+        res.append(
+            WorkspaceSymbol(
+                i.name.name,
+                kind,
+                uri,
+                _rng(i.location.rng, columns),
+                _rng(i.name.location.rng, columns),
+                isinstance(i, ir.Declare),
+            )
+        )
+    return res
+
+
+def demangle_symbols(symbols: List[WorkspaceSymbol]):
+    demangled = demangle(_bare(s.name) for s in symbols)
+    for s in symbols:
+        s.demangled = demangled.get(_bare(s.name))
+
+
+def module_symbols(
+    uri: str, module: ir.Module, columns: ColumnMap
+) -> List[WorkspaceSymbol]:
+    res = item_symbols(
+        uri,
+        itertools.chain(
+            module.types, module.constants, module.attributes, module.functions
+        ),
+        columns,
+    )
+    demangle_symbols(res)
+    return res
+
+
+def summarize_file(
+    filename: str, encoding: str, large_file_size: int
+) -> Tuple[FileStamp, List[WorkspaceSymbol]]:
+    """
+    Parse the top level of a file and return its symbols, and the contents
+    they were found in. This is run in the pre-indexing processes.
+    """
+    uri = "file://" + filename
+    stamp = FileStamp.of(filename)
+    if not is_compressed(filename) and stamp.size >= large_file_size:
+        module, line_index = SkeletonParser().parse(filename)
+        columns = ColumnMap(
+            encoding, line_index.non_ascii, lambda i: line_index.read(i, i + 1)
+        )
+        return stamp, module_symbols(uri, module, columns)
+
+    with Reader(filename) as r:
+        columns = ColumnMap.from_text(encoding, r.text)
+        module = IRParser().parse(r)
+    return stamp, module_symbols(uri, module, columns)
+
+
+class WorkspaceIndex:
+    """
+    The top level symbols of every indexed file in the workspace, shared by
+    the open files and the pre-indexer. The lists in the tables are replaced
+    rather than changed, so that queries on other threads can read them
+    without locks. The search index is replaced by an updated copy, so
+    searches don't wait for updates either. Only updates, which come from
+    both, are serialized.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, List[WorkspaceSymbol]] = dict()
+        self.by_name: Dict[str, List[WorkspaceSymbol]] = dict()
+        # the contents on disk each file's symbols were found in, if known
+        self.stamps: Dict[str, FileStamp] = dict()
+        # the symbols by their names, and their demangled names
+        self._search = TrigramIndex[WorkspaceSymbol]()
+        self._update_lock = threading.Lock()
+
+    def _replace(self, old: List[WorkspaceSymbol], new: List[WorkspaceSymbol]):
+        """
+        Replace the symbols in old that aren't in new by the ones in new that
+        aren't in old. Symbols are compared by identity, so a file whose
+        unchanged parts kept their symbols only updates the rest.
+        """
+        old_ids = {id(s) for s in old}
+        new_ids = {id(s) for s in new}
+        removed = [s for s in old if id(s) not in new_ids]
+        added = [s for s in new if id(s) not in old_ids]
+        if not removed and not added:
+            return
+
+        search = self._search.copy()
+        for s in removed:
+            for key in s.search_keys():
+                search.remove(key, s)
+        for s in added:
+            for key in s.search_keys():
+                search.add(key, s)
+        self._search = search
+
+        gone = {id(s) for s in removed}
+        for name in {s.name for s in removed}:
+            others = [s for s in self.by_name.get(name, []) if id(s) not in gone]
+            if others:
+                self.by_name[name] = others
+            else:
+                self.by_name.pop(name, None)
+        for s in added:
+            self.by_name[s.name] = self.by_name.get(s.name, []) + [s]
+
+    def update(
+        self,
+        uri: str,
+        symbols: List[WorkspaceSymbol],
+        stamp: Optional[FileStamp] = None,
+    ):
+        """
+        Replace the symbols of a file
+        """
+        self.update_many([(uri, symbols, stamp)])
+
+    def update_many(self, files: List[FileSymbols]):
+        """
+        Replace the symbols of several files, copying the search index once
+        """
+        # the last update of a file wins
+        latest = {uri: (symbols, stamp) for uri, symbols, stamp in files}
+        with self._update_lock:
+            old: List[WorkspaceSymbol] = []
+            new: List[WorkspaceSymbol] = []
+            for uri, (symbols, stamp) in latest.items():
+                old.extend(self.files.get(uri, []))
+                new.extend(symbols)
+                self.files[uri] = symbols
+                if stamp:
+                    self.stamps[uri] = stamp
+                else:
+                    self.stamps.pop(uri, None)
+            self._replace(old, new)
+
+    def remove(self, uri: str):
+        with self._update_lock:
+            self._replace(self.files.pop(uri, []), [])
+            self.stamps.pop(uri, None)
+
+    def definitions(self, name: str) -> List[WorkspaceSymbol]:
+        return [s for s in self.by_name.get(name, []) if not s.declaration]
+
+    def search(
+        self, query: str, limit: int = WORKSPACE_SYMBOL_LIMIT
+    ) -> List[WorkspaceSymbol]:
+        """
+        The symbols whose name or demangled name best matches query, see
+        TrigramIndex.search
+        """
+        return self._search.search(query, limit)
+
+
+def _lower_priority():
+    os.nice(PREINDEX_NICENESS)
+
+
+class Preindexer:
+    """
+    Indexes the top level of every .ll file under the workspace folders in a
+    pool of low priority processes, at most 'jobs' files at a time. Files
+    are only submitted while the server isn't busy, indexing can be paused
+    and resumed, and cancelled altogether. Files that are opened are indexed
+    by the server itself, so they are skipped.
+    """
+
+    def __init__(
+        self,
+        index: WorkspaceIndex,
+        jobs: int,
+        encoding: str,
+        large_file_size: int,
+        is_busy: Callable[[], bool],
+    ):
+        self.index = index
+        self.jobs = max(1, jobs)
+        self.encoding = encoding
+        self.large_file_size = large_file_size
+        self.is_busy = is_busy
+        self._skip: Set[str] = set()
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, paths: List[str]):
+        self._thread = threading.Thread(
+            target=self._run, args=(paths,), name="preindex", daemon=True
+        )
+        self._thread.start()
+
+    def skip(self, filename: str):
+        """
+        Don't index a file, because the server already has a newer snapshot
+        """
+        self._skip.add(filename)
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def _wait_until_idle(self):
+        while not self.cancelled:
+            self._running.wait()
+            if not self.is_busy():
+                return
+            self._cancelled.wait(BUSY_DELAY)
+
+    def _finish(
+        self,
+        future: concurrent.futures.Future,
+        filename: str,
+        into: List[FileSymbols],
+    ):
+        try:
+            stamp, symbols = future.result()
+        except Exception as e:
+            print(f"failed to pre-index {filename}: {e}", file=sys.stderr)
+            return
+        into.append(("file://" + filename, symbols, stamp))
+
+    def _flush(self, finished: List[FileSymbols]):
+        # files opened in the meantime have newer symbols from the server
+        self.index.update_many(
+            [f for f in finished if f[0].removeprefix("file://") not in self._skip]
+        )
+        finished.clear()
+
+    def _run(self, paths: List[str]):
+        import multiprocessing
+        from lllsp.index import find_files
+
+        # the server has threads running, so forking it isn't safe
+        pool = concurrent.futures.ProcessPoolExecutor(
+            self.jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        )
+        in_flight: Dict[concurrent.futures.Future, str] = dict()
+        finished: List[FileSymbols] = []
+
+        def finish(futures: Iterable[concurrent.futures.Future]):
+            for f in futures:
+                self._finish(f, in_flight.pop(f), finished)
+                if len(finished) >= PREINDEX_BATCH:
+                    self._flush(finished)
+
+        try:
+            for filename in find_files(paths):
+                if filename in self._skip:
+                    continue
+                self._wait_until_idle()
+                if self.cancelled:
+                    break
+                if len(in_flight) >= self.jobs:
+                    done, _ = concurrent.futures.wait(
+                        in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    finish(done)
+                future = pool.submit(
+                    summarize_file, filename, self.encoding, self.large_file_size
+                )
+                in_flight[future] = filename
+            if not self.cancelled:
+                finish(concurrent.futures.as_completed(list(in_flight)))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._flush(finished)
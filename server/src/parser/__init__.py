@@ -1,4 +1,4 @@
-from typing import Optional, Any, List, Tuple, Sequence
+from typing import Optional, Any, List, Tuple, Sequence, Iterable
 from dataclasses import dataclass, field
 import io
 import os
@@ -7,6 +7,7 @@ import re
 
 import lllsp.ir as ir
 from lllsp.ir.location import Location, Range, Position
+from lllsp.cancel import CancelToken, NEVER
 from .reader import Reader, EOFException
 
 import sys
@@ -16,22 +17,29 @@ def log(*args, **kwargs):
     print(*args, **kwargs, file=sys.stderr)
 
 
-class IRParser:
+# compiled once, so creating a parser is free
+_value_name_regex = re.compile(r" *(%[a-zA-Z0-9_.]+)")
+_label_regex = re.compile(r" *([a-zA-Z0-9_.]+:)")
+_formal_regex = re.compile(r"\(?\s*([^,]*(%[a-zA-Z0-9_.]+)[^,()]*)(?=,|\))?")
+_name_regex = re.compile(r"([%#@!])[a-zA-Z0-9_.]+")
+_indent_regex = re.compile(r"[ \t]*")
+# the callee of a direct call, skipping over a function type like '(ptr, ...)'
+_call_regex = re.compile(
+    r"(?<![%@\w.])(?:call|invoke|callbr)\b[^@(;]*(?:\([^)]*\)[^@(;]*)?(@[a-zA-Z0-9_.]+)\("
+)
+
 
-    def __init__(self):
-        self._value_name_regex = re.compile(r"^ *(%[a-zA-Z0-9_.]+)")
-        self._label_regex = re.compile(r"^ *([a-zA-Z0-9_.]+:)")
-        self._formal_regex = re.compile(
-            r"\(?\s*([^,]*(%[a-zA-Z0-9_.]+)[^,()]*)(?=,|\))?"
-        )
+class IRParser:
 
-    def parse(self, reader: Reader) -> ir.Module:
+    def parse(self, reader: Reader, token: CancelToken = NEVER) -> ir.Module:
 
         loc = Location()
         mod = ir.Module(loc)
+        mod.metadata.filename = reader.filename
 
         start = reader.position()
         while not reader.eof():
+            token.check()
             if i := self.parse_one(reader):
                 mod.add(i)
         end = reader.position()
@@ -78,46 +86,38 @@ class IRParser:
         # read until newline
         reader.through("\n")
 
-    def _read_curly_block(self, reader: Reader) -> str:
+    def _read_curly_block(self, reader: Reader) -> Tuple[int, int]:
         return self._read_block(reader, "{", "}")
 
-    def _read_block(self, reader: Reader, start: str, end: str) -> str:
-        text = ""
-        text += reader.through(start)
-        pairs = 1
-        while True:
-            text += reader.until(start + end)
-            n = reader.read()
-            text += n
-            if n == start:
-                pairs += 1
-            else:
-                pairs -= 1
-            if pairs == 0:
-                break
-        return text
+    def _read_block(self, reader: Reader, start: str, end: str) -> Tuple[int, int]:
+        """
+        Read through a block, returning the offsets of the text read in the
+        reader's buffer
+        """
+        return reader.through_block(start, end)
 
     def _parse_statements(
         self, reader: Reader
-    ) -> List[ir.Statement | ir.Label]:
-        # parse all statements inside of curly braces
+    ) -> Tuple[List[ir.Statement | ir.Label], List[ir.CallSite]]:
+        # parse all statements inside of curly braces, and the direct calls
+        # they make
         start = reader.position()  # used to determine line info
-        text = self._read_curly_block(reader)
-        # split text based on newlines
-        lines = text.splitlines()
+        begin, end = self._read_curly_block(reader)
+        text = reader.text
         statements = []
-        for lineno, l in enumerate(lines):
-            if m := re.match(self._value_name_regex, l):
-                start_col = (
-                    start.column + m.start(1) if lineno == 0 else m.start(1)
-                )
-                name_end_col = (
-                    start.column + m.end(1) if lineno == 0 else m.end(1)
-                )
-                end_col = start.column + len(l) if lineno == 0 else len(l)
-                name_start = Position(start_col, start.line + lineno)
-                name_end = Position(name_end_col, start.line + lineno)
-                stmt_end = Position(end_col, start.line + lineno)
+        calls = []
+        # walk the lines of the block in place, the first line starts
+        # partway through the line in the file
+        line_begin = begin - start.column
+        lineno = start.line
+        while begin < end:
+            line_end = text.find("\n", begin, end)
+            if line_end == -1:
+                line_end = end
+            if m := _value_name_regex.match(text, begin, line_end):
+                name_start = Position(m.start(1) - line_begin, lineno)
+                name_end = Position(m.end(1) - line_begin, lineno)
+                stmt_end = Position(line_end - line_begin, lineno)
                 name = ir.ValueName(
                     Location(reader.filename, Range(name_start, name_end)),
                     m.group(1),
@@ -128,15 +128,9 @@ class IRParser:
                         name,
                     )
                 )
-            elif m := re.match(self._label_regex, l):
-                start_col = (
-                    start.column + m.start(1) if lineno == 0 else m.start(1)
-                )
-                name_end_col = (
-                    start.column + m.end(1) if lineno == 0 else m.end(1)
-                )
-                name_start = Position(start_col, start.line + lineno)
-                name_end = Position(name_end_col, start.line + lineno)
+            elif m := _label_regex.match(text, begin, line_end):
+                name_start = Position(m.start(1) - line_begin, lineno)
+                name_end = Position(m.end(1) - line_begin, lineno)
                 label = ir.Label(
                     Location(reader.filename, Range(name_start, name_end)),
                     m.group(1),
@@ -145,24 +139,42 @@ class IRParser:
             else:
                 # for now, no need to handle statements that don't have values
                 pass
-        return statements
+            if m := _call_regex.search(text, begin, line_end):
+                callee_start = Position(m.start(1) - line_begin, lineno)
+                callee_end = Position(m.end(1) - line_begin, lineno)
+                indent = _indent_regex.match(text, begin, line_end)
+                stmt_start = Position(indent.end() - line_begin, lineno)
+                stmt_end = Position(line_end - line_begin, lineno)
+                callee = ir.SymbolName(
+                    Location(reader.filename, Range(callee_start, callee_end)),
+                    m.group(1),
+                )
+                calls.append(
+                    ir.CallSite(
+                        Location(reader.filename, Range(stmt_start, stmt_end)),
+                        callee,
+                    )
+                )
+            begin = line_begin = line_end + 1
+            lineno += 1
+        return statements, calls
 
     def _parse_formals(self, reader: Reader) -> List[ir.Formal]:
         # parse everything in the ()
         start = reader.position()  # used to determine line info
-        text = self._read_block(reader, "(", ")")
+        text = reader.text[slice(*self._read_block(reader, "(", ")"))]
         if len(text.strip().removeprefix("(").removesuffix(")").strip()) == 0:
             return []
         # split based on ','
         # TODO: what if there are other commands in an arg attribute?
 
         formals = []
-        for m in re.finditer(self._formal_regex, text):
+        for m in re.finditer(_formal_regex, text):
             start_col = start.column + m.start(1)
             end_col = start.column + m.end(1)
             name_start_col = start.column + m.start(2)
             name_end_col = start.column + m.end(2)
-            
+
             name_start = Position(name_start_col, start.line)
             name_end = Position(name_end_col, start.line)
             name = ir.ValueName(
@@ -173,9 +185,7 @@ class IRParser:
             end_formal = Position(end_col, start.line)
             formals.append(
                 ir.Formal(
-                    Location(
-                        reader.filename, Range(start_formal, end_formal)
-                    ),
+                    Location(reader.filename, Range(start_formal, end_formal)),
                     name,
                 )
             )
@@ -188,11 +198,11 @@ class IRParser:
         name = ir.SymbolName(*reader.until_loc("( "))
 
         formals = self._parse_formals(reader)
-        stmts = self._parse_statements(reader)
+        stmts, calls = self._parse_statements(reader)
 
         end = reader.position()
         loc = Location(reader.filename, Range(start, end))
-        d = ir.Define(loc, name, formals, stmts)
+        d = ir.Define(loc, name, formals, stmts, calls)
         return d
 
     def _parse_declare(self, reader: Reader) -> Optional[ir.Declare]:
@@ -230,33 +240,24 @@ class IRParser:
         reader.through("=")
         reader.until("{")
 
-        body = self._read_curly_block(reader)
+        self._read_curly_block(reader)
 
         end = reader.position()
         loc = Location(reader.filename, Range(start, end))
         return ir.Attribute(loc, name)
 
-    def _parse_metadata(self, reader: Reader) -> Optional[ir.Metadata]:
+    def _parse_metadata(
+        self, reader: Reader
+    ) -> Optional[ir.Metadata | ir.MetadataSpan]:
         start = reader.position()
 
         name = ir.MetadataName(*reader.until_loc("= "))
-        reader.through("=")
-        reader.until("!d")
-        if reader.peek(3) == "dis":
-            # get rid of the distinct by reading to space
-            reader.until(" !")
-            reader.skip(" \t")
-        # we now should have "!"
-        if reader.read() != "!":
-            return None
-        reader.skip(" \t")
-        if reader.peek() == "{":
-            self._read_curly_block(reader)
-        else:
-            # we assume its a paren-like thing
-            self._read_block(reader, "(", ")")
+        # the body is never looked at, so skip it as fast as possible
+        end = reader.through_balanced_lines()
 
-        end = reader.position()
+        basename = name.basename()
+        if basename.isdigit():
+            return ir.MetadataSpan(int(basename), start, end)
         loc = Location(reader.filename, Range(start, end))
         return ir.Metadata(loc, name)
 
@@ -271,7 +272,7 @@ class IRParser:
         # read the next thing
         ident = reader.until(" ")
         if ident == "type":
-            body = self._read_curly_block(reader)
+            self._read_curly_block(reader)
             end = reader.position()
             loc = Location(reader.filename, Range(start, end))
             t = ir.TypeDefinition(loc, name)
@@ -290,12 +291,22 @@ class NameParser:
     Parse and extract everything that looks like a name
     """
 
-    def __init__(self):
-        self._name_regex = re.compile(r"([%#@!])[a-zA-Z0-9_.]+")
-
-    def parse(self, reader: Reader) -> List[ir.Name]:
+    def parse(self, reader: Reader, token: CancelToken = NEVER) -> List[ir.Name]:
+        first_line = reader.position().line
+        return self.parse_lines(reader.readlines(), reader.filename, first_line, token)
+
+    def parse_lines(
+        self,
+        lines: Iterable[str],
+        filename: str = "",
+        first_line: int = 0,
+        token: CancelToken = NEVER,
+    ) -> List[ir.Name]:
+        """
+        Parse lines as they are read from a stream, without needing the
+        whole text in one buffer
+        """
         names: List[ir.Name] = []
-        lines = reader.readlines()
         # TODO: this doesn't handle ':'
         name_types = {
             "%": ir.ValueName,
@@ -303,11 +314,12 @@ class NameParser:
             "@": ir.SymbolName,
             "!": ir.MetadataName,
         }
-        for lineno, l in enumerate(lines):
-            for m in re.finditer(self._name_regex, l):
+        for lineno, l in enumerate(lines, first_line):
+            token.check()
+            for m in re.finditer(_name_regex, l):
                 ty = name_types[m.group(1)]
                 start = Position(m.start(), lineno)
                 end = Position(m.end(), lineno)
-                loc = Location(reader.filename, Range(start, end))
+                loc = Location(filename, Range(start, end))
                 names.append(ty(loc, m.group(0)))
         return names
@@ -1,14 +1,13 @@
-
 from typing import Optional, Any, List, Tuple
 from dataclasses import dataclass, field
+from array import array
 import io
 import os
 import re
+import functools
 from lllsp.ir.location import Position, Location, Range
 
 
-
-
 # class FileStats:
 #     def __init__(self):
 #         self.num_chars_read = 0
@@ -20,7 +19,7 @@ from lllsp.ir.location import Position, Location, Range
 
 #     def count_newlines(self, s: str):
 #         self.num_newlines_read += s.count('\n')
-    
+
 #     def position(self) -> Position:
 
 
@@ -83,51 +82,129 @@ from lllsp.ir.location import Position, Location, Range
 #         self.index += 1
 #         return s
 
-    
 
 class EOFException(Exception):
     pass
 
-class Peeker:
 
-    def __init__(self, fp):
-        self.fp = fp
-        self.tell = 0
+def split_lines(text: str) -> List[str]:
+    """
+    Split text into lines, keeping their newlines. Unlike str.splitlines,
+    only '\\n' ends a line, like everywhere else lines are counted.
+    """
+    lines = [line + "\n" for line in text.split("\n")]
+    last = lines.pop()
+    if last != "\n":
+        lines.append(last[:-1])
+    return lines
 
-    def __enter__(self):
-        self.tell = self.fp.tell()
-        return self
 
-    def __exit__(self, *args):
-        self.fp.seek(self.tell, os.SEEK_SET)
+def strip_comment(line: str) -> str:
+    """
+    The line without its comment, if it has one outside of a string
+    """
+    i = 0
+    while (semi := line.find(";", i)) != -1:
+        quote = line.find('"', i, semi)
+        if quote == -1:
+            return line[:semi]
+        close = line.find('"', quote + 1)
+        if close == -1:
+            return line
+        i = close + 1
+    return line
+
+
+class TextLines:
+    """
+    A text kept in memory, with the offset every line starts at, so that a
+    range of lines is sliced out of it without splitting the lines before it.
+    The offsets are only found the first time a line is asked for.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+    @functools.cached_property
+    def _starts(self) -> array:
+        starts = array("q", [0])
+        starts.extend(m.end() for m in _newline_regex.finditer(self.text))
+        if starts[-1] != len(self.text):
+            starts.append(len(self.text))
+        return starts
+
+    def __len__(self) -> int:
+        return len(self._starts) - 1
+
+    def read(self, start: int, end: int) -> str:
+        """
+        The text of the lines [start, end)
+        """
+        starts = self._starts
+        start = max(0, min(start, len(self)))
+        end = max(start, min(end, len(self)))
+        return self.text[starts[start] : starts[end]]
+
+    def lines(self, start: int = 0, end: Optional[int] = None) -> List[str]:
+        return split_lines(self.read(start, len(self) if end is None else end))
+
+
+_newline_regex = re.compile("\n")
+_quoted_regex = re.compile(r'"[^"]*"')
+
+
+@functools.lru_cache(maxsize=None)
+def _any_of(chars: str) -> re.Pattern[str]:
+    return re.compile("[" + re.escape(chars) + "]")
+
+
+@functools.lru_cache(maxsize=None)
+def _run_of(chars: str) -> re.Pattern[str]:
+    return re.compile("[" + re.escape(chars) + "]*")
+
 
 class FileStats:
     def __init__(self):
         self.line = 0
         self.col = 0
-    
+
     def count(self, s: str):
-        for c in s:
-            if c == "\n":
-                self.col = 0
-                self.line += 1
-            else:
-                self.col += 1
+        self.count_range(s, 0, len(s))
+
+    def count_range(self, s: str, start: int, end: int):
+        """
+        Count the characters in s[start:end], without copying them
+        """
+        newlines = s.count("\n", start, end)
+        if newlines:
+            self.line += newlines
+            self.col = end - s.rfind("\n", start, end) - 1
+        else:
+            self.col += end - start
+
+
+class TextReader:
+    """
+    Reads text from a buffer, which all of the reading and scanning is done
+    on. The text can be a part of a larger file that starts at 'line'.
+    """
+
+    def __init__(self, text: str, filename: str = "", line: int = 0):
+        self.filename = filename
+        self._source = text
+        self._line = line
 
+    def _load(self) -> str:
+        return self._source
 
-class FileReader:
-    def __init__(self, filename: str):
-        self.filename = filename
-        
     def open(self):
-        self._fp = open(self.filename, "r")
+        self._text = self._load()
+        self._index = 0
         self._stats = FileStats()
-        with Peeker(self._fp):
-            self._fp.seek(0, os.SEEK_END)
-            self._size = self._fp.tell()
-    
+        self._stats.line = self._line
+
     def close(self):
-        self._fp.close()
+        self._text = ""
 
     def __enter__(self):
         self.open()
@@ -135,56 +212,52 @@ class FileReader:
 
     def __exit__(self, *args):
         self.close()
-    
+
+    @property
+    def text(self) -> str:
+        """
+        The underlying buffer, which offsets returned by the reader index into
+        """
+        return self._text
+
+    def offset(self) -> int:
+        return self._index
+
+    def _advance(self, end: int) -> str:
+        ret = self._text[self._index : end]
+        self._stats.count_range(self._text, self._index, end)
+        self._index = end
+        return ret
+
     def readall(self) -> str:
-        return self._fp.read()
+        return self._advance(len(self._text))
 
     def readlines(self) -> List[str]:
-        return self._fp.readlines()
+        return split_lines(self.readall())
 
     def read(self, n=1) -> str:
-        ret = self._fp.read(n)
-        if len(ret) != n:
+        if self._index + n > len(self._text):
             raise EOFException()
-        self._stats.count(ret)
-        return ret
+        return self._advance(self._index + n)
 
     def peek(self, n=1) -> str:
-        with Peeker(self._fp):
-            ret = self._fp.read(n)
-        if len(ret) != n:
+        if self._index + n > len(self._text):
             raise EOFException()
-        return ret
+        return self._text[self._index : self._index + n]
 
     def eof(self) -> bool:
-        return self._fp.tell() >= self._size
+        return self._index >= len(self._text)
 
     def skip(self, chars=" \t\n") -> str:
-        read = ""
-        while True:
-            c = self._fp.read(1)
-            if c == "":
-                break
-            if c not in chars:
-                self._fp.seek(self._fp.tell() - 1, os.SEEK_SET)
-                break
-            read += c
-        self._stats.count(read)
-        return read
+        m = _run_of(chars).match(self._text, self._index)
+        return self._advance(m.end())
 
     def until(self, chars: str) -> str:
-        read = ""
-        while True:
-            c = self._fp.read(1)
-            if c == "":
-                raise EOFException()
-            if c in chars:
-                self._fp.seek(self._fp.tell() - 1, os.SEEK_SET)
-                break
-            read += c
-        self._stats.count(read)
-        return read
-    
+        m = _any_of(chars).search(self._text, self._index)
+        if m is None:
+            raise EOFException()
+        return self._advance(m.start())
+
     def until_loc(self, chars: str) -> Tuple[Location, str]:
         start = self.position()
         read = self.until(chars)
@@ -192,23 +265,20 @@ class FileReader:
         return Location(self.filename, Range(start, end)), read
 
     def readr(self, pat: str | re.Pattern[str]) -> str:
-        read = ""
         if isinstance(pat, str):
             pat = re.compile(pat)
         matched = False
+        end = self._index
         while True:
-            c = self._fp.read(1)
-            if c == "":
+            if end >= len(self._text):
                 raise EOFException()
-            m = re.fullmatch(pat, read+c)
+            m = re.fullmatch(pat, self._text[self._index : end + 1])
             if not matched and m is not None:
                 matched = True
             elif matched and m is None:
-                self._fp.seek(self._fp.tell() - 1, os.SEEK_SET)
                 break
-            read += c
-        self._stats.count(read)
-        return read
+            end += 1
+        return self._advance(end)
 
     def readr_loc(self, pat: str | re.Pattern[str]) -> Tuple[Location, str]:
         start = self.position()
@@ -217,19 +287,171 @@ class FileReader:
         return Location(self.filename, Range(start, end)), read
 
     def through(self, chars: str) -> str:
-        read = ""
-        while True:
-            c = self._fp.read(1)
-            if c == "":
-                raise EOFException()
-            read += c
-            if c in chars:
+        m = _any_of(chars).search(self._text, self._index)
+        if m is None:
+            raise EOFException()
+        return self._advance(m.end())
+
+    def through_block(self, start: str, end: str) -> Tuple[int, int]:
+        """
+        Read through a bracketed block, like '{ ... }', in a single pass over
+        the buffer. Brackets inside of quoted strings and comments are
+        ignored. Returns the offsets of the text read, which starts at the
+        current position and ends after the closing bracket.
+        """
+        begin = self._index
+        text = self._text
+        opening = _any_of(start).search(text, begin)
+        if opening is None:
+            raise EOFException()
+        self._index = opening.end()
+        pairs = 1
+        for m in _any_of(start + end + '";').finditer(text, self._index):
+            if m.start() < self._index:
+                # inside of a string or comment we skipped over
+                continue
+            c = m.group()
+            if c == '"':
+                close = text.find('"', m.end())
+                self._index = len(text) if close == -1 else close + 1
+            elif c == ";":
+                newline = text.find("\n", m.end())
+                self._index = len(text) if newline == -1 else newline
+            else:
+                self._index = m.end()
+                pairs += 1 if c == start else -1
+                if pairs == 0:
+                    break
+        else:
+            raise EOFException()
+        self._stats.count_range(text, begin, self._index)
+        return begin, self._index
+
+    def through_balanced_lines(
+        self, opening: str = "({", closing: str = ")}"
+    ) -> Position:
+        """
+        Skip whole lines, until all of the brackets opened on them are closed.
+        Brackets inside of quoted strings and comments are ignored. Returns the
+        position of the end of the last line skipped, not including the newline.
+        """
+        end = self.position()
+        depth = 0
+        while not self.eof():
+            newline = self._text.find("\n", self._index)
+            if newline == -1:
+                newline = len(self._text)
+            text = self._text[self._index : newline]
+            end = Position(self._stats.col + len(text), self._stats.line)
+            self._advance(min(newline + 1, len(self._text)))
+
+            if '"' in text:
+                text = re.sub(_quoted_regex, "", text)
+            if ";" in text:
+                text = text[: text.index(";")]
+            depth += sum(text.count(c) for c in opening)
+            depth -= sum(text.count(c) for c in closing)
+            if depth <= 0:
                 break
-        self._stats.count(read)
-        return read
-    
+        return end
+
     def position(self) -> Position:
         return Position(self._stats.col, self._stats.line)
 
+
+def _open_gzip(filename: str, mode: str) -> io.TextIOBase:
+    import gzip
+
+    return gzip.open(filename, mode)
+
+
+def _open_lzma(filename: str, mode: str) -> io.TextIOBase:
+    import lzma
+
+    return lzma.open(filename, mode)
+
+
+COMPRESSED_SUFFIXES = {".gz": _open_gzip, ".xz": _open_lzma, ".lzma": _open_lzma}
+"""
+The suffixes of compressed files that can be read, and how to open them.
+The compression modules are only imported when they are needed.
+"""
+
+LL_SUFFIXES = (".ll",) + tuple(".ll" + s for s in COMPRESSED_SUFFIXES)
+"""
+The suffixes of the IR files that are searched for in directories
+"""
+
+CHUNK_SIZE = 1024 * 1024
+"""
+The number of bytes read at a time to hash a file
+"""
+
+
+def is_compressed(filename: str) -> bool:
+    return os.path.splitext(filename)[1] in COMPRESSED_SUFFIXES
+
+
+def open_text(filename: str) -> io.TextIOBase:
+    """
+    Open a file for reading text, decompressing it as it is read if it is
+    compressed
+    """
+    if opener := COMPRESSED_SUFFIXES.get(os.path.splitext(filename)[1]):
+        return opener(filename, "rt")
+    return open(filename, "r")
+
+
+@dataclass(frozen=True)
+class FileStamp:
+    """
+    Identifies the contents of a file on disk. The digest is only computed
+    again if the modification time or size changed.
+    """
+
+    mtime_ns: int
+    size: int
+    digest: bytes
+
+    @staticmethod
+    def _digest(filename: str) -> bytes:
+        import hashlib
+
+        h = hashlib.blake2b(digest_size=16)
+        with open(filename, "rb") as fp:
+            while chunk := fp.read(CHUNK_SIZE):
+                h.update(chunk)
+        return h.digest()
+
+    @classmethod
+    def of(cls, filename: str, previous: Optional["FileStamp"] = None) -> "FileStamp":
+        st = os.stat(filename)
+        if (
+            previous
+            and previous.mtime_ns == st.st_mtime_ns
+            and previous.size == st.st_size
+        ):
+            return previous
+        return cls(st.st_mtime_ns, st.st_size, cls._digest(filename))
+
+    def same_contents(self, other: Optional["FileStamp"]) -> bool:
+        return other is not None and self.digest == other.digest
+
+
+class FileReader(TextReader):
+    """
+    Reads a file by loading it into a buffer. Compressed files are
+    decompressed as they are read, so only the text is kept in memory, but
+    the parser still needs all of it in one buffer.
+    """
+
+    def __init__(self, filename: str):
+        super().__init__("", filename)
+
+    def _load(self) -> str:
+        with open_text(self.filename) as fp:
+            return fp.read()
+
+
 # Reader = FileReader | TextReader
 Reader = FileReader
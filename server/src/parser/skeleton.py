@@ -0,0 +1,139 @@
+from typing import List, Tuple, Optional
+from array import array
+import re
+
+import lllsp.ir as ir
+from lllsp.ir.location import Location, Range, Position
+from lllsp.cancel import CancelToken, NEVER
+
+
+class LineIndex:
+    """
+    The byte offset of every STRIDE-th line of a file, so that a range of
+    lines can be read without reading everything before it, and the numbers
+    of the lines that are not plain ASCII
+    """
+
+    STRIDE = 1024
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.offsets = array("q")
+        self.num_lines = 0
+        self.non_ascii = array("q")
+
+    def add_line(self, offset: int, ascii: bool = True):
+        if self.num_lines % self.STRIDE == 0:
+            self.offsets.append(offset)
+        if not ascii:
+            self.non_ascii.append(self.num_lines)
+        self.num_lines += 1
+
+    def read(self, start: int, end: int) -> str:
+        """
+        Read the lines [start, end) of the file
+        """
+        start = max(0, min(start, self.num_lines))
+        end = max(start, min(end, self.num_lines))
+        if start == end:
+            return ""
+        with open(self.filename, "rb") as fp:
+            fp.seek(self.offsets[start // self.STRIDE])
+            for _ in range(start % self.STRIDE):
+                fp.readline()
+            text = b"".join(fp.readline() for _ in range(end - start))
+        return text.decode(errors="replace").replace("\r\n", "\n")
+
+
+_name_regex = re.compile(rb"[%@!#][a-zA-Z0-9_.]+")
+_name_types = {
+    ord("%"): ir.ValueName,
+    ord("@"): ir.SymbolName,
+    ord("!"): ir.MetadataName,
+    ord("#"): ir.AttributeName,
+}
+
+
+def _width(text: bytes) -> int:
+    """
+    The number of characters in a line
+    """
+    return len(text) if text.isascii() else len(text.decode(errors="replace"))
+
+
+class SkeletonParser:
+    """
+    Find just the top level entities in a file, with a single pass over its
+    lines that never holds more than one line in memory. Function bodies are
+    skipped, so Defines have no formals or statements.
+    """
+
+    def _name(
+        self, filename: str, lineno: int, line: bytes, start: int = 0
+    ) -> Optional[ir.Name]:
+        m = _name_regex.search(line, start)
+        if not m:
+            return None
+        start_col = _width(line[: m.start()])
+        end_col = start_col + len(m.group())
+        loc = Location(
+            filename,
+            Range(Position(start_col, lineno), Position(end_col, lineno)),
+        )
+        return _name_types[line[m.start()]](loc, m.group().decode())
+
+    def parse(
+        self, filename: str, token: CancelToken = NEVER
+    ) -> Tuple[ir.Module, LineIndex]:
+        mod = ir.Module(Location(filename))
+        mod.metadata.filename = filename
+        lines = LineIndex(filename)
+
+        # the define we are in the body of, if any
+        define: Optional[Tuple[Position, ir.SymbolName]] = None
+
+        offset = 0
+        lineno = 0
+        with open(filename, "rb") as fp:
+            for line in fp:
+                token.check()
+                lines.add_line(offset, line.isascii())
+                offset += len(line)
+                text = line.rstrip(b"\r\n")
+                start = Position(0, lineno)
+                end = Position(_width(text), lineno)
+                loc = Location(filename, Range(start, end))
+                c = text[:1]
+
+                if define:
+                    if c == b"}":
+                        body = Location(filename, Range(define[0], end))
+                        mod.add(ir.Define(body, define[1], [], []))
+                        define = None
+                elif c == b"d":
+                    name = self._name(filename, lineno, text, text.find(b"@"))
+                    if isinstance(name, ir.SymbolName):
+                        if text.startswith(b"define"):
+                            define = (start, name)
+                        elif text.startswith(b"declare"):
+                            mod.add(ir.Declare(loc, name, []))
+                elif c in (b"%", b"@", b"!") or text.startswith(b"attributes"):
+                    name = self._name(filename, lineno, text)
+                    if isinstance(name, ir.ValueName):
+                        if b"= type" in text:
+                            mod.add(ir.TypeDefinition(loc, name))
+                    elif isinstance(name, ir.SymbolName):
+                        mod.add(ir.Constant(loc, name))
+                    elif isinstance(name, ir.AttributeName):
+                        mod.add(ir.Attribute(loc, name))
+                    elif isinstance(name, ir.MetadataName):
+                        if name.basename().isdigit():
+                            id = int(name.basename())
+                            mod.add(ir.MetadataSpan(id, start, end))
+                        else:
+                            mod.add(ir.Metadata(loc, name))
+                lineno += 1
+
+        end = Position(0, lineno)
+        mod.location = Location(filename, Range(Position(), end))
+        return mod, lines
@@ -0,0 +1,275 @@
+from typing import List, Dict, Tuple, Optional, Sequence, Iterator, TypeVar
+from dataclasses import dataclass, field, fields
+from array import array
+import itertools
+import re
+
+import lllsp.ir as ir
+from lllsp.ir.location import Location, Range, Position
+from lllsp.cancel import CancelToken, NEVER
+from . import IRParser, NameParser
+from .reader import TextReader, EOFException
+
+_define_regex = re.compile(r"^define\b", re.M)
+# every 100th numbered metadata node starts a new span, so that the
+# boundaries only depend on the text around them, and an edit doesn't move
+# the boundaries after it
+_chunk_regex = re.compile(r"^!\d*00 = ", re.M)
+
+
+def scan_spans(text: str) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Split text into spans of whole top level entities, without parsing it:
+    each define through the line that closes its body, and the text between
+    them, cut at every 100th numbered metadata node. Yields the start and
+    end offset, the first line and the line after the last of each span.
+    """
+    bounds = [0]
+
+    def cut(offset: int):
+        if bounds[-1] < offset < len(text):
+            bounds.append(offset)
+
+    pos = 0
+    while pos < len(text):
+        d = _define_regex.search(text, pos)
+        region_end = d.start() if d else len(text)
+        for m in _chunk_regex.finditer(text, pos, region_end):
+            cut(m.start())
+        if d is None:
+            break
+        cut(d.start())
+        close = text.find("\n}", d.end())
+        end = text.find("\n", close + 1) if close != -1 else -1
+        pos = len(text) if end == -1 else end + 1
+        cut(pos)
+    bounds.append(len(text))
+
+    line = 0
+    for start, end in zip(bounds, bounds[1:]):
+        next_line = line + text.count("\n", start, end)
+        # the last line doesn't need to end with a newline
+        yield start, end, line, next_line + (end > start and text[end - 1] != "\n")
+        line = next_line
+
+
+@dataclass
+class SourceSpan:
+    """
+    A span of whole lines of a file, and the top level entities parsed from
+    it, recorded so that a later parse can reuse them if the text of the span
+    is unchanged
+    """
+
+    # the first line, and the line after the last
+    start: int
+    end: int
+    # a hash of the text of the span
+    key: int
+    items: List[ir.IR] = field(default_factory=list)
+    # the numbered metadata nodes, which the module only keeps the position of
+    metadata: array = field(default_factory=lambda: array("l"))
+    # a hash of the names the span defines at the top level, which names in
+    # other spans can refer to
+    names_key: int = 0
+    # the lines that are not plain ASCII, by their offset from the first line
+    non_ascii: List[Tuple[int, str]] = field(default_factory=list)
+    # where the entity that runs off the end of the span is, if one does,
+    # like a definition that is still being typed. The span's items are the
+    # ones before it.
+    error: Optional[Location] = None
+
+
+def _shift_location(loc: Location, delta: int) -> Location:
+    start, end = loc.rng.start, loc.rng.end
+    return Location(
+        loc.filename,
+        Range(
+            Position(start.column, start.line + delta),
+            Position(end.column, end.line + delta),
+        ),
+    )
+
+
+def _error_location(text: str, offset: int, filename: str, first_line: int) -> Location:
+    """
+    The location of the unfinished entity that starts at offset in text,
+    through the end of the text, without the whitespace around it
+    """
+
+    def position(offset: int) -> Position:
+        line_start = text.rfind("\n", 0, offset) + 1
+        return Position(offset - line_start, first_line + text.count("\n", 0, offset))
+
+    end = len(text.rstrip())
+    start = min(len(text) - len(text[offset:].lstrip()), end)
+    return Location(filename, Range(position(start), position(end)))
+
+
+_fields: Dict[type, Tuple[str, ...]] = dict()
+
+IRT = TypeVar("IRT", bound=ir.IR)
+
+
+def shifted(i: IRT, delta: int) -> IRT:
+    """
+    A copy of i, and of everything in it, moved down by delta lines. Cached
+    properties, like the symbols of a function, are left out of the copy so
+    that they are built from the copy.
+    """
+    cls = type(i)
+    if (names := _fields.get(cls)) is None:
+        names = _fields[cls] = tuple(f.name for f in fields(cls))
+    new = cls.__new__(cls)
+    d = new.__dict__
+    for n in names:
+        v = getattr(i, n)
+        if isinstance(v, Location):
+            v = _shift_location(v, delta)
+        elif isinstance(v, ir.IR):
+            v = shifted(v, delta)
+        elif isinstance(v, list):
+            v = [shifted(x, delta) for x in v]
+        d[n] = v
+    return new
+
+
+@dataclass
+class SpanParse:
+    module: ir.Module
+    spans: List[SourceSpan]
+    # for each span, the span of the previous parse it was reused from, or
+    # None if it was parsed
+    origins: List[Optional[SourceSpan]]
+    # the names found in each span that was parsed, by its index
+    names: Dict[int, List[ir.Name]]
+
+    def globals_key(self) -> int:
+        """
+        A hash of the top level definitions of the module, which only
+        changes if a span that defines something at the top level did
+        """
+        return hash(tuple(s.names_key for s in self.spans))
+
+    def non_ascii(self) -> Dict[int, str]:
+        """
+        The lines of the file that are not plain ASCII, by their number
+        """
+        return {s.start + i: line for s in self.spans for i, line in s.non_ascii}
+
+
+class SpanParser:
+    """
+    Parses a file a top level span at a time. The spans whose text is the
+    same as a span of a previous parse reuse its entities instead of being
+    parsed again, as they are if the span didn't move, or moved to their new
+    lines if it did.
+    """
+
+    def parse(
+        self,
+        text: str,
+        filename: str,
+        previous: Sequence[SourceSpan] = (),
+        previous_module: Optional[ir.Module] = None,
+        token: CancelToken = NEVER,
+    ) -> SpanParse:
+        reusable: Dict[int, List[SourceSpan]] = dict()
+        for s in previous:
+            reusable.setdefault(s.key, []).append(s)
+
+        last_line = text.count("\n")
+        end = Position(len(text) - text.rfind("\n") - 1, last_line)
+        module = ir.Module(Location(filename, Range(Position(), end)))
+        module.metadata.filename = filename
+        res = SpanParse(module, [], [], dict())
+
+        for start, stop, line, end_line in scan_spans(text):
+            token.check()
+            chunk = text[start:stop]
+            span = SourceSpan(line, end_line, hash(chunk))
+            old = None
+            if previous_module is not None and (candidates := reusable.get(span.key)):
+                old = next((c for c in candidates if c.start == line), candidates[0])
+                self._reuse(span, old, previous_module, module)
+            else:
+                res.names[len(res.spans)] = self._parse(
+                    span, chunk, filename, module, token
+                )
+            res.spans.append(span)
+            res.origins.append(old)
+        return res
+
+    def _parse(
+        self,
+        span: SourceSpan,
+        chunk: str,
+        filename: str,
+        module: ir.Module,
+        token: CancelToken,
+    ) -> List[ir.Name]:
+        piece = ir.Module(Location())
+        piece.metadata.filename = filename
+        parser = IRParser()
+        with TextReader(chunk, filename, span.start) as r:
+            at = 0
+            try:
+                while not r.eof():
+                    token.check()
+                    at = r.offset()
+                    if i := parser.parse_one(r):
+                        piece.add(i)
+            except EOFException:
+                span.error = _error_location(chunk, at, filename, span.start)
+        span.items = list(
+            itertools.chain(
+                [piece.source_filename] if piece.source_filename else [],
+                piece.target_info,
+                piece.types,
+                piece.constants,
+                piece.functions,
+                piece.attributes,
+                piece.metadata.named.values(),
+            )
+        )
+        span.metadata = array("l", piece.metadata.ids())
+        defined = (ir.definition_name(i) for i in span.items)
+        span.names_key = hash(
+            (tuple(n.name for n in defined if n), span.metadata.tobytes())
+        )
+        if not chunk.isascii():
+            span.non_ascii = [
+                (i, line)
+                for i, line in enumerate(chunk.split("\n"))
+                if not line.isascii()
+            ]
+        self._add(span, module, piece.metadata, 0)
+        with TextReader(chunk, filename, span.start) as r:
+            return NameParser().parse(r, token)
+
+    def _reuse(
+        self,
+        span: SourceSpan,
+        old: SourceSpan,
+        previous_module: ir.Module,
+        module: ir.Module,
+    ):
+        delta = span.start - old.start
+        span.items = old.items if delta == 0 else [shifted(i, delta) for i in old.items]
+        span.metadata = old.metadata
+        span.names_key = old.names_key
+        span.non_ascii = old.non_ascii
+        if old.error is not None:
+            span.error = _shift_location(old.error, delta) if delta else old.error
+        self._add(span, module, previous_module.metadata, delta)
+
+    def _add(
+        self,
+        span: SourceSpan,
+        module: ir.Module,
+        metadata: ir.MetadataTable,
+        delta: int,
+    ):
+        for i in span.items:
+            module.add(i)
+        module.metadata.copy_spans(metadata, span.metadata, delta)
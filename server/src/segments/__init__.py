@@ -19,12 +19,14 @@
 #
 
 from dataclasses import dataclass, field
-from typing import List, Tuple, Optional, TypeVar, Callable, Generic, Self
+from typing import List, Tuple, Optional, TypeVar, Callable, Generic, Iterable, Self
 from bisect import bisect_left, bisect_right
+import heapq
 from lsprotocol.types import Position, Range
 
 EltT = TypeVar("EltT")
 
+
 @dataclass
 class PositionList(Generic[EltT]):
     get_range: Callable[[EltT], Range]
@@ -43,9 +45,7 @@ class PositionList(Generic[EltT]):
                                   |---------| D
     """
 
-    segments: List[Tuple[Position, Optional[EltT], int]] = field(
-        default_factory=list
-    )
+    segments: List[Tuple[Position, Optional[EltT], int]] = field(default_factory=list)
     """
     A flattened representation of the list of elements, where each element
     represents the beginning of a new item that continues until the next
@@ -62,9 +62,41 @@ class PositionList(Generic[EltT]):
     position in logarithmic time.
     """
 
+    def _disjoint_segments(
+        self, elts: List[EltT], into: List[Tuple[Position, Optional[EltT], int]]
+    ) -> bool:
+        """
+        Build the segments of elements that don't overlap each other, like
+        the names in a file, in a single pass. Returns False, without
+        changing 'into', as soon as two of them overlap.
+        """
+        segs: List[Tuple[Position, Optional[EltT], int]] = []
+        last_end: Optional[Position] = None
+        for idx, elt in enumerate(elts):
+            rng = self.get_range(elt)
+            if last_end is not None:
+                if rng.start < last_end:
+                    return False
+                if rng.start > last_end:
+                    segs.append((last_end, None, -1))
+            # an empty element is replaced by the one starting where it does
+            while segs and segs[-1][0] == rng.start:
+                segs.pop()
+            segs.append((rng.start, elt, idx))
+            last_end = rng.end
+        if last_end is not None:
+            segs.append((last_end, None, -1))
+        while into and segs and into[-1][0] == segs[0][0]:
+            into.pop()
+        into.extend(segs)
+        return True
+
     def _elements_to_segments(
         self, elts: List[EltT], into: List[Tuple[Position, Optional[EltT], int]]
     ):
+        if self._disjoint_segments(elts, into):
+            return
+
         # A list of not-yet-closed segments, sorted descending by their end positions
         # (so that we can pop the last one to close it).
         ongoing: List[Tuple[Position, EltT, int]] = []
@@ -137,12 +169,8 @@ class PositionList(Generic[EltT]):
         self.elts.append(elt)
 
     def _get_elt_range(self, rng: Range):
-        start = bisect_left(
-            self.elts, rng.start, key=lambda x: self.get_range(x).start
-        )
-        end = bisect_right(
-            self.elts, rng.end, key=lambda x: self.get_range(x).start
-        )
+        start = bisect_left(self.elts, rng.start, key=lambda x: self.get_range(x).start)
+        end = bisect_right(self.elts, rng.end, key=lambda x: self.get_range(x).start)
         return (start, end)
 
     def _get_segment_range(self, rng: Range):
@@ -153,9 +181,7 @@ class PositionList(Generic[EltT]):
     def _update_segments(
         self, rng: Range, new_segments: List[Tuple[Position, EltT, int]]
     ):
-        new_segments = [
-            seg for seg in new_segments if rng.start <= seg[0] < rng.end
-        ]
+        new_segments = [seg for seg in new_segments if rng.start <= seg[0] < rng.end]
 
         seg_start, seg_end = self._get_segment_range(rng)
         if seg_end > 0:
@@ -198,6 +224,143 @@ class PositionList(Generic[EltT]):
     def overwrite(self, elt: EltT):
         self._set_range(self.get_range(elt), [elt])
 
+    def _span(self, batch: List[EltT]) -> Range:
+        """
+        The range that has to be rebuilt to merge in a sorted batch. It is
+        widened to cover the elements already in the list that reach into
+        it, so that their segments are rebuilt along with the batch.
+        """
+        start = self.get_range(batch[0]).start
+        end = max(self.get_range(e).end for e in batch)
+        while (outer := self.find(start)) is not None:
+            outer_start = self.get_range(outer).start
+            if outer_start >= start:
+                break
+            start = outer_start
+        while True:
+            lo, hi = self._get_elt_range(Range(start, end))
+            reach = max((self.get_range(e).end for e in self.elts[lo:hi]), default=end)
+            if reach <= end:
+                return Range(start, end)
+            end = reach
+
+    def merge(self, batch: List[EltT]):
+        """
+        Merge a batch of elements, sorted by their start positions, into the
+        list. Only the elements and segments in the span of the batch are
+        rebuilt, so this is linear in the size of the batch and the span,
+        rather than a sort of the whole list.
+        """
+        if not batch:
+            return
+        if not self.elts:
+            self.elts.extend(batch)
+            self._rebuild_segments()
+            return
+        rng = self._span(batch)
+        lo, hi = self._get_elt_range(rng)
+        merged = list(
+            heapq.merge(self.elts[lo:hi], batch, key=lambda x: self.get_range(x).start)
+        )
+        self._set_range(rng, merged)
+
+    def merge_disjoint(self, batches: Iterable[List[EltT]]):
+        """
+        Merge batches that are each sorted by start position, and that don't
+        overlap each other, into the list. The batches that fall in a gap
+        between the elements already in the list have their segments built
+        on their own, and are all spliced in with a single pass over the
+        list. The rest are merged one at a time.
+        """
+        batches = sorted(
+            (b for b in batches if b), key=lambda b: self.get_range(b[0]).start
+        )
+        gaps = []
+        rest = []
+        last_end: Optional[Position] = None
+        for b in batches:
+            rng = Range(
+                self.get_range(b[0]).start, max(self.get_range(e).end for e in b)
+            )
+            lo, hi = self._get_elt_range(rng)
+            segs: List[Tuple[Position, Optional[EltT], int]] = []
+            in_gap = (
+                (last_end is None or last_end <= rng.start)
+                and lo == hi
+                and self.find(rng.start) is None
+                and self._disjoint_segments(b, segs)
+            )
+            if in_gap:
+                gaps.append((rng, lo, b, segs))
+                last_end = rng.end
+            else:
+                rest.append(b)
+
+        elts: List[EltT] = []
+        segments: List[Tuple[Position, Optional[EltT], int]] = []
+
+        def push(seg: Tuple[Position, Optional[EltT], int]):
+            while segments and segments[-1][0] == seg[0]:
+                segments.pop()
+            segments.append(seg)
+
+        elt_at = seg_at = 0
+        for rng, lo, b, segs in gaps:
+            elts.extend(self.elts[elt_at:lo])
+            elts.extend(b)
+            elt_at = lo
+            seg_lo = bisect_left(self.segments, rng.start, key=lambda x: x[0])
+            for seg in self.segments[seg_at:seg_lo]:
+                push(seg)
+            for seg in segs:
+                push(seg)
+            seg_at = seg_lo
+        if gaps:
+            elts.extend(self.elts[elt_at:])
+            for seg in self.segments[seg_at:]:
+                push(seg)
+            self.elts[:] = elts
+            self.segments[:] = segments
+
+        for b in rest:
+            self.merge(b)
+
+    def extend(self, batch: List[EltT]):
+        """
+        Add a batch of elements, sorted by their start positions, that start
+        after every element in the list ends. If they don't overlap each
+        other, their segments are built in a single pass and appended,
+        otherwise the batch is merged.
+        """
+        if not batch:
+            return
+        start = self.get_range(batch[0]).start
+        if (
+            self.segments and start < self.segments[-1][0]
+        ) or not self._disjoint_segments(batch, self.segments):
+            self.merge(batch)
+            return
+        self.elts.extend(batch)
+
+    def extend_from(self, other: Self, rng: Range):
+        """
+        Add the elements of another list that start in [rng.start, rng.end),
+        along with its segments there, without building them again. The
+        range has to start after every element in the list ends, and no
+        element of the other list may cross its ends.
+        """
+        key = lambda x: self.get_range(x).start
+        lo = bisect_left(other.elts, rng.start, key=key)
+        hi = bisect_left(other.elts, rng.end, lo, key=key)
+        if lo == hi:
+            return
+        self.elts.extend(other.elts[lo:hi])
+        seg_lo, seg_hi = other._get_segment_range(rng)
+        segs = other.segments[seg_lo:seg_hi]
+        while self.segments and segs and self.segments[-1][0] == segs[0][0]:
+            self.segments.pop()
+        self.segments.extend(segs)
+
     def overwrite_range(self, rng: Range, other: Self):
         other_start, other_end = other._get_elt_range(rng)
         self._set_range(rng, other.elts[other_start:other_end])
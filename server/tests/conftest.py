@@ -0,0 +1,24 @@
+from typing import Callable
+
+import pytest
+
+from lllsp.lsp import LLLSP, FileInfo
+
+
+@pytest.fixture
+def ls() -> LLLSP:
+    return LLLSP()
+
+
+@pytest.fixture
+def parse(ls, tmp_path) -> Callable[..., FileInfo]:
+    """
+    Write a file into a temporary directory, and open it in the server
+    """
+
+    def parse(text: str, name: str = "t.ll") -> FileInfo:
+        path = tmp_path / name
+        path.write_text(text)
+        return ls.file_info(path.as_uri())
+
+    return parse
@@ -0,0 +1,73 @@
+import lllsp.ir as ir
+from lllsp.index.calls import CallGraph
+from lllsp.lsp.document import DocumentStore
+
+SOURCE = """\
+declare void @leaf()
+
+define void @a() {
+  call void @leaf()
+  call void @b()
+  call void @leaf()
+  ret void
+}
+
+define void @b() {
+  invoke void @leaf() to label %ok unwind label %ok
+ok:
+  ret void
+}
+
+define void @c() {
+  call void @a()
+  ret void
+}
+"""
+
+
+def callers(g: CallGraph, name: str):
+    return [f.name.name for f in g.callers(name)]
+
+
+def test_callers_in_file_order(parse):
+    f = parse(SOURCE)
+    g = f.call_graph
+    assert callers(g, "@leaf") == ["@a", "@b"]
+    assert callers(g, "@b") == ["@a"]
+    assert callers(g, "@a") == ["@c"]
+    assert callers(g, "@c") == []
+
+    a = f.module.symbols["@a"]
+    assert [c.callee.location.rng.start.line for c in g.calls(a, "@leaf")] == [3, 5]
+    assert g.calls(f.module.symbols["@leaf"], "@a") == []
+
+
+def test_call_hierarchy_item(parse):
+    f = parse(SOURCE)
+    item = f.call_hierarchy_item(f.module.symbols["@b"])
+    assert item.name == "b"
+    assert item.data == "@b"
+    assert (item.range.start.line, item.range.end.line) == (9, 13)
+    start = item.selection_range.start
+    assert (start.line, start.character) == (9, 12)
+
+
+def test_call_graph_follows_edits(ls, parse):
+    f = parse(SOURCE)
+    # built before the edit, so the next snapshot updates a copy of it
+    assert callers(f.call_graph, "@leaf") == ["@a", "@b"]
+
+    text = SOURCE.replace("  call void @a()\n", "  call void @leaf()\n")
+    text = text.replace("  call void @b()\n", "")
+    g = ls.file_info(f.uri, rebuild=True, document=DocumentStore(text), version=2)
+    assert "call_graph" in g.__dict__
+    assert callers(g.call_graph, "@leaf") == ["@a", "@b", "@c"]
+    assert callers(g.call_graph, "@a") == []
+    assert callers(g.call_graph, "@b") == []
+
+    fresh = CallGraph.build(g.module.functions)
+    for name in ("@leaf", "@a", "@b", "@c"):
+        assert g.call_graph.callers(name) == fresh.callers(name)
+    assert all(isinstance(c, ir.Define) for c in g.call_graph.callers("@leaf"))
+    # the previous snapshot is unchanged
+    assert callers(f.call_graph, "@leaf") == ["@a", "@b"]
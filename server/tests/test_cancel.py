@@ -0,0 +1,56 @@
+import pytest
+
+from lllsp import cancel
+from lllsp.cancel import CancelToken, Cancelled, SharedToken, NEVER
+
+
+def test_check_raises_once_cancelled():
+    token = CancelToken()
+    token.check()
+    token.cancel()
+    with pytest.raises(Cancelled):
+        token.check()
+
+
+def test_callbacks_run_once():
+    token = CancelToken()
+    calls = []
+    token.on_cancel(lambda: calls.append(1))
+    token.cancel()
+    token.cancel()
+    # added after the token was cancelled
+    token.on_cancel(lambda: calls.append(2))
+    assert calls == [1, 2]
+
+
+def test_never_is_not_cancelled():
+    NEVER.cancel()
+    NEVER.check()
+
+
+def test_shared_token_waits_for_every_request():
+    shared = SharedToken()
+    first, second = CancelToken(), CancelToken()
+    shared.share(first)
+    shared.share(second)
+    first.cancel()
+    assert not shared.cancelled
+    second.cancel()
+    assert shared.cancelled
+
+
+def test_shared_token_with_uncancellable_work():
+    shared = SharedToken()
+    request = CancelToken()
+    shared.share(request)
+    shared.share(NEVER)
+    request.cancel()
+    assert not shared.cancelled
+
+
+def test_scope():
+    token = CancelToken()
+    assert cancel.current() is NEVER
+    with cancel.scope(token):
+        assert cancel.current() is token
+    assert cancel.current() is NEVER
@@ -0,0 +1,80 @@
+from typing import List, Optional
+
+import lllsp.ir as ir
+from lllsp.index.cfg import ControlFlowGraph
+from lllsp.parser import IRParser
+from lllsp.parser.reader import TextReader
+
+
+def build(text: str) -> ControlFlowGraph:
+    with TextReader(text, "t.ll") as r:
+        m = IRParser().parse(r)
+    f = m.functions[0]
+    assert isinstance(f, ir.Define)
+    return ControlFlowGraph.build(f, text.split("\n")[:-1], 0)
+
+
+def names(blocks) -> List[Optional[str]]:
+    return [b.name for b in blocks]
+
+
+def test_switch_over_several_lines():
+    cfg = build(
+        """\
+define void @f(i32 %x) personality ptr @p {
+  %a = add i32 %x, 1 ; br label %bogus
+  switch i32 %x, label %d [
+    i32 0, label %b0
+    i32 1, label %b1
+    i32 2, label %b0
+  ]
+b0:
+  invoke void @g() to label %d unwind label %lp
+b1:
+  indirectbr ptr blockaddress(@f, %d), [label %d, label %b0]
+lp:
+  %l = landingpad { ptr, i32 } cleanup
+  resume { ptr, i32 } %l
+d:
+  ret void
+}
+"""
+    )
+    assert names(cfg.blocks) == [None, "%b0", "%b1", "%lp", "%d"]
+    entry, b0, b1, lp, d = cfg.blocks
+    assert (entry.start, entry.end) == (1, 6)
+    # the switch is the terminator, not the lines of its cases
+    assert entry.terminator == 2
+    assert names(cfg.successors(entry)) == ["%d", "%b0", "%b1"]
+    assert names(cfg.successors(b0)) == ["%d", "%lp"]
+    assert names(cfg.successors(b1)) == ["%d", "%b0"]
+    assert names(cfg.successors(lp)) == []
+    assert names(cfg.predecessors(d)) == [None, "%b0", "%b1"]
+    assert names(cfg.predecessors(b0)) == [None, "%b1"]
+
+
+def test_blocks_by_name_and_line():
+    cfg = build(
+        """\
+define i32 @f(i1 %c) {
+entry:
+  br i1 %c, label %then, label %exit
+
+then:                     ; preds = %entry
+  br label %exit
+
+exit:
+  %r = phi i32 [ 0, %entry ], [ 1, %then ]
+  ret i32 %r
+}
+"""
+    )
+    assert names(cfg.blocks) == ["%entry", "%then", "%exit"]
+    assert cfg.block("%then") is cfg.blocks[1]
+    assert cfg.block("%missing") is None
+    assert cfg.block_at(0) is None
+    assert cfg.block_at(3) is cfg.blocks[0]
+    assert cfg.block_at(8) is cfg.blocks[2]
+    assert cfg.block_at(10) is None
+    assert cfg.blocks[2].terminator == 9
+    assert names(cfg.successors(cfg.blocks[0])) == ["%then", "%exit"]
@@ -0,0 +1,66 @@
+import lsprotocol.types as lsT
+import pytest
+
+from lllsp.lsp.columns import ColumnCodec, ColumnMap, UTF8, UTF16, UTF32
+
+# 'é' is one utf-16 unit and two utf-8 bytes, '😀' is outside of the BMP, so
+# two utf-16 units and four utf-8 bytes
+TEXT = """\
+declare void @g(metadata, i32)
+define void @f(i32 %x) {
+  call void @g(metadata !"é😀x", i32 %x)
+  ret void
+}
+"""
+LINE = 2
+# the code point columns of 'é', '😀', 'x', '%x' and the end of the line
+COLUMNS = [26, 27, 28, 36, 39]
+
+UNITS = {
+    UTF8: [26, 28, 32, 40, 43],
+    UTF16: [26, 27, 29, 37, 40],
+    UTF32: COLUMNS,
+}
+
+
+@pytest.mark.parametrize("encoding", sorted(UNITS))
+def test_round_trip(encoding):
+    m = ColumnMap.from_text(encoding, TEXT)
+    units = [m.to_client(LINE, c) for c in COLUMNS]
+    assert units == UNITS[encoding]
+    assert [m.from_client(LINE, u) for u in units] == COLUMNS
+
+
+def test_ascii_lines_are_not_mapped():
+    m = ColumnMap.from_text(UTF16, TEXT)
+    assert m.lines == {LINE}
+    assert m.to_client(0, 12) == 12
+    assert m._tables == {}
+    assert ColumnMap.from_text(UTF32, TEXT).lines == set()
+
+
+def test_columns_inside_or_past_a_character():
+    m = ColumnMap.from_text(UTF16, TEXT)
+    # the second unit of the surrogate pair maps to the start of '😀'
+    assert m.from_client(LINE, 28) == 27
+    # past the end of the line, a unit is a code point
+    assert m.to_client(LINE, 41) == 42
+    assert m.from_client(LINE, 42) == 41
+
+
+def test_server_positions_use_utf16(parse):
+    f = parse(TEXT)
+    seg = f.find_name_segment(lsT.Position(LINE, 38))
+    assert seg.name.name == "%x"
+    assert seg.name.location.rng.start.column == 36
+    rng = f.to_lsprng(seg.name.location.rng)
+    assert (rng.start.character, rng.end.character) == (37, 39)
+
+
+def test_codec_counts_like_the_map():
+    lines = TEXT.splitlines(keepends=True)
+    for encoding, units in UNITS.items():
+        codec = ColumnCodec(encoding)
+        assert codec.client_num_units(lines[LINE].rstrip("\n")) == units[-1]
+        pos = codec.position_from_client_units(lines, lsT.Position(LINE, units[3]))
+        assert pos == lsT.Position(LINE, COLUMNS[3])
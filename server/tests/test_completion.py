@@ -0,0 +1,75 @@
+import lllsp.ir as ir
+from lllsp.ir.location import Position
+from lllsp.lsp.document import DocumentStore
+from lllsp.parser import IRParser
+from lllsp.parser.reader import TextReader
+
+SOURCE = """\
+%struct.a = type { i32 }
+@alpha = global i32 0
+@beta = global i32 0
+
+define void @also(i32 %arg) {
+  %a1 = add i32 %arg, 1
+  ret void
+}
+
+!llvm.ident = !{!1}
+!1 = !{}
+!2 = !{}
+!10 = !{}
+!12 = !{}
+!100 = !{}
+"""
+
+
+def names(found):
+    return [n for n, _ in found]
+
+
+def test_locals_come_before_globals(parse):
+    f = parse(SOURCE)
+    found, more = f.completions("%", Position(2, 5))
+    assert names(found) == ["%a1", "%arg", "%struct.a"]
+    assert not more
+    # outside of a function, only the types
+    found, _ = f.completions("%", Position(0, 1))
+    assert names(found) == ["%struct.a"]
+
+
+def test_globals(parse):
+    f = parse(SOURCE)
+    found, _ = f.completions("@al", Position(0, 0))
+    assert names(found) == ["@alpha", "@also"]
+    assert isinstance(found[1][1], ir.Define)
+
+
+def test_metadata_in_name_order(parse):
+    f = parse(SOURCE)
+    found, more = f.completions("!", Position(0, 0))
+    assert names(found) == ["!1", "!10", "!100", "!12", "!2", "!llvm.ident"]
+    assert not more
+    found, more = f._metadata_completions("!1", 3)
+    assert names(found) == ["!1", "!10", "!100"]
+    assert more
+
+
+def test_ids_with_prefix():
+    with TextReader(SOURCE, "t.ll") as r:
+        table = IRParser().parse(r).metadata
+    assert list(table.ids_with_prefix("")) == [1, 10, 100, 12, 2]
+    assert list(table.ids_with_prefix("1")) == [1, 10, 100, 12]
+    assert list(table.ids_with_prefix("10")) == [10, 100]
+    assert list(table.ids_with_prefix("3")) == []
+    assert list(table.ids_with_prefix("01")) == []
+    assert list(table.ids_with_prefix("x")) == []
+
+
+def test_indexes_follow_edits(ls, parse):
+    f = parse(SOURCE)
+    assert names(f.completions("@", Position(0, 0))[0]) == ["@alpha", "@also", "@beta"]
+    text = SOURCE.replace("@beta = global i32 0", "@gamma = global i32 0")
+    g = ls.file_info(f.uri, rebuild=True, document=DocumentStore(text), version=2)
+    assert names(g.completions("@", Position(0, 0))[0]) == ["@alpha", "@also", "@gamma"]
+    # the previous snapshot is unchanged
+    assert names(f.completions("@", Position(0, 0))[0]) == ["@alpha", "@also", "@beta"]
@@ -0,0 +1,63 @@
+import gzip
+import lzma
+
+import lsprotocol.types as lsT
+import pytest
+
+import lllsp.ir as ir
+from lllsp.index import find_files
+from lllsp.lsp import LargeFileInfo
+from lllsp.parser import IRParser
+from lllsp.parser.reader import FileReader, TextReader, is_compressed, open_text
+
+SOURCE = """\
+@g = global i32 0
+
+define i32 @f(i32 %x) {
+  %y = load i32, ptr @g
+  ret i32 %y
+}
+"""
+
+COMPRESS = {".gz": gzip.compress, ".xz": lzma.compress}
+
+
+@pytest.fixture(params=sorted(COMPRESS))
+def compressed(request, tmp_path) -> str:
+    path = tmp_path / f"t.ll{request.param}"
+    path.write_bytes(COMPRESS[request.param](SOURCE.encode()))
+    return str(path)
+
+
+def functions(m: ir.Module):
+    return [(f.name.name, f.location.rng) for f in m.functions]
+
+
+def test_reads_the_decompressed_text(compressed):
+    assert is_compressed(compressed)
+    with open_text(compressed) as fp:
+        assert fp.read() == SOURCE
+    with FileReader(compressed) as r:
+        m = IRParser().parse(r)
+    with TextReader(SOURCE, compressed) as r:
+        expected = IRParser().parse(r)
+    assert functions(m) == functions(expected)
+
+
+def test_server_opens_compressed_files_read_only(ls, compressed):
+    # never opened in large-file mode, as it can't be read a window at a time
+    ls.large_file_size = 1
+    f = ls.file_info("file://" + compressed)
+    assert not isinstance(f, LargeFileInfo)
+    assert f.read_only
+    assert f.lines(None) == SOURCE.splitlines(keepends=True)
+
+    seg = f.find_name_segment(lsT.Position(3, 22))
+    g = f.resolve(seg)
+    assert g.location.rng.start.line == 0
+    assert not f.can_rename(g)
+
+
+def test_compressed_files_are_found(tmp_path, compressed):
+    (tmp_path / "notes.txt").write_text("")
+    assert list(find_files([str(tmp_path)])) == [compressed]
@@ -0,0 +1,60 @@
+import lsprotocol.types as lsT
+
+from lllsp.index.defuse import DefUse
+
+SOURCE = """\
+define i32 @f(i32 %x, i32 %unused) {
+entry:
+  %0 = add i32 %x, 1
+  %cond = icmp eq i32 %0, %x
+  br i1 %cond, label %done, label %entry
+done:
+  ret i32 %0
+}
+
+define i32 @g(i32 %x) {
+  ret i32 %x
+}
+"""
+
+
+def lines(names):
+    return [(n.location.rng.start.line, n.location.rng.start.column) for n in names]
+
+
+def test_chains_of_a_function(parse):
+    f = parse(SOURCE)
+    du = f.def_use(f.module.symbols["@f"])
+    assert sorted(du.defs) == ["%0", "%cond", "%done", "%entry", "%unused", "%x"]
+    assert lines(du.uses_of("%x")) == [(2, 15), (3, 26)]
+    assert lines(du.uses_of("%0")) == [(3, 22), (6, 10)]
+    assert lines(du.uses_of("%entry")) == [(4, 34)]
+    assert du.uses_of("%unused") == []
+    assert du.definition("%y") is None
+
+
+def test_chains_are_built_once(parse):
+    f = parse(SOURCE)
+    fn = f.module.symbols["@f"]
+    du = f.def_use(fn)
+    assert isinstance(du, DefUse)
+    assert f.def_use(fn) is du
+    assert f.def_use(f.module.symbols["@g"]) is not du
+
+
+def test_local_occurrences_stay_in_the_function(parse):
+    f = parse(SOURCE)
+    seg = f.find_name_segment(lsT.Position(10, 11))
+    decl, uses = f.local_occurrences(f.resolve(seg), seg.name)
+    assert lines([decl]) == [(9, 18)]
+    assert lines(uses) == [(10, 10)]
+
+    # labels are defined by their statement, and used as '%done'
+    seg = f.find_name_segment(lsT.Position(4, 22))
+    decl, uses = f.local_occurrences(f.resolve(seg), seg.name)
+    assert lines([decl]) == [(5, 0)]
+    assert lines(uses) == [(4, 21)]
+
+    # globals have no def-use chain
+    seg = f.find_name_segment(lsT.Position(9, 11))
+    assert f.local_occurrences(f.resolve(seg), seg.name) is None
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+import lllsp.lsp.document as document
+from lllsp.lsp.document import DocumentStore
+
+
+def offset(text: str, line: int, column: int) -> int:
+    """
+    The offset of a position in text, clamped like DocumentStore.replace
+    """
+    lines = text.split("\n")
+    if line >= len(lines):
+        return len(text)
+    before = sum(len(l) + 1 for l in lines[:line])
+    return before + min(column, len(lines[line]))
+
+
+def check(store: DocumentStore, text: str):
+    assert store.text() == text
+    assert list(store) == document.document_lines(text)
+    assert len(store) == text.count("\n") + 1
+    assert store.num_chars() == len(text)
+
+
+def test_replace_within_a_line():
+    store = DocumentStore("define void @f() {\n  ret void\n}\n")
+    store.replace((1, 2), (1, 5), "unreachable")
+    check(store, "define void @f() {\n  unreachable void\n}\n")
+
+
+def test_replace_across_lines():
+    store = DocumentStore("a\nb\nc\nd")
+    store.replace((0, 1), (2, 0), "x\ny")
+    check(store, "ax\nyc\nd")
+
+
+def test_replace_past_the_end():
+    store = DocumentStore("a\nb")
+    store.replace((1, 1), (9, 9), "\nc\n")
+    check(store, "a\nb\nc\n")
+
+
+def test_windows_line_endings():
+    store = DocumentStore("a\r\nb\r\n")
+    store.replace((1, 0), (1, 1), "c\r\nd")
+    check(store, "a\nc\nd\n")
+
+
+def test_snapshot_is_unchanged_by_edits():
+    store = DocumentStore("a\nb\nc\n")
+    snapshot = store.snapshot()
+    store.replace((1, 0), (1, 1), "x")
+    check(snapshot, "a\nb\nc\n")
+    check(store, "a\nx\nc\n")
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_replace_matches_text(seed: int, monkeypatch: pytest.MonkeyPatch):
+    # small chunks, so that edits cross and split them
+    monkeypatch.setattr(document, "CHUNK_LINES", 4)
+    rnd = random.Random(seed)
+    text = "".join(f"line {i}\n" for i in range(40))
+    store = DocumentStore(text)
+    for _ in range(50):
+        lines = len(store)
+        start = (rnd.randrange(lines + 1), rnd.randrange(10))
+        end = (rnd.randrange(lines + 1), rnd.randrange(10))
+        new = rnd.choice(["", "x", "\n", "a\nb", "\n\n\n\n\n\n\n\n\n\n"])
+        store.replace(start, end, new)
+        lo, hi = sorted([offset(text, *start), offset(text, *end)])
+        text = text[:lo] + new + text[hi:]
+        check(store, text)
+        line = rnd.randrange(len(store))
+        col = rnd.randrange(len(store[line].rstrip("\n")) + 1)
+        assert store.position_at(store.offset_at(line, col)) == (line, col)
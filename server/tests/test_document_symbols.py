@@ -0,0 +1,82 @@
+import lsprotocol.types as lsT
+
+SOURCE = """\
+define void @f() {
+  ret void, !dbg !3
+}
+
+!3 = !DILocation(line: 1, scope: !4)
+!4 = distinct !DISubprogram(name: "f")
+!llvm.module.flags = !{!5}
+!5 = !{i32 2, !"Debug Info Version", i32 3}
+"""
+
+
+def test_groups_contain_their_children(parse):
+    f = parse(SOURCE)
+    symbols = f.document_symbols()
+    metadata = next(s for s in symbols if s.name == "metadata")
+    # named metadata is listed before the numbered nodes
+    assert [c.name for c in metadata.children] == [
+        "!llvm.module.flags",
+        "!3",
+        "!4",
+        "!5",
+    ]
+    assert metadata.range.start == lsT.Position(4, 0)
+    assert metadata.range.end == lsT.Position(7, 43)
+    assert metadata.selection_range == metadata.children[1].selection_range
+    for c in metadata.children:
+        assert metadata.range.start <= c.range.start
+        assert c.range.end <= metadata.range.end
+
+
+OUTLINE = """\
+%struct.S = type { i32 }
+@g = global i32 0
+
+define void @f() #0 {
+entry:
+  br label %exit
+
+exit:
+  ret void
+}
+
+declare void @h()
+
+attributes #0 = { nounwind }
+"""
+
+
+def test_outline_covers_every_top_level_entity(parse):
+    symbols = parse(OUTLINE).document_symbols()
+    assert [(s.name, s.kind) for s in symbols] == [
+        ("struct.S", lsT.SymbolKind.Struct),
+        ("g", lsT.SymbolKind.Variable),
+        ("f", lsT.SymbolKind.Function),
+        ("h", lsT.SymbolKind.Function),
+        ("attributes", lsT.SymbolKind.Namespace),
+    ]
+    f = symbols[2]
+    assert f.range == lsT.Range(lsT.Position(3, 0), lsT.Position(9, 1))
+    assert [(c.name, c.kind) for c in f.children] == [
+        ("entry", lsT.SymbolKind.Key),
+        ("exit", lsT.SymbolKind.Key),
+    ]
+    assert [c.name for c in symbols[4].children] == ["#0"]
+
+
+def test_cached_per_version(parse):
+    f = parse(OUTLINE)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return f.document_symbols()
+
+    first = f.cached("documentSymbol", 1, compute)
+    assert f.cached("documentSymbol", 1, compute) is first
+    assert len(calls) == 1
+    f.cached("documentSymbol", 2, compute)
+    assert len(calls) == 2
@@ -0,0 +1,56 @@
+SOURCE = """\
+define i32 @f(i32 %x) {
+entry:
+  %c = icmp eq i32 %x, 0
+  br i1 %c, label %a, label %b
+a:
+  ret i32 1
+b:
+  ret i32 0
+}
+
+define void @g() {
+  ret void
+}
+
+declare void @h()
+
+attributes #0 = { nounwind }
+attributes #1 = { noreturn }
+
+attributes #2 = { cold }
+
+!0 = !{i32 1}
+!1 = !{!0,
+       !0}
+!llvm.ident = !{!0}
+
+!2 = !{}
+"""
+
+
+def test_folding_ranges(parse):
+    f = parse(SOURCE)
+    folds = sorted((r.start_line, r.end_line) for r in f.folding_ranges())
+    assert folds == [
+        # @f up to its closing brace, then each of its blocks
+        (0, 7),
+        (1, 3),
+        (4, 5),
+        (6, 7),
+        # @g has no labels, so only its body folds
+        (10, 11),
+        # consecutive attribute groups and metadata fold as one
+        (16, 17),
+        (21, 24),
+    ]
+
+
+def test_metadata_line_spans(parse):
+    f = parse(SOURCE)
+    assert sorted(f.module.metadata.line_spans()) == [
+        (21, 21),
+        (22, 23),
+        (24, 24),
+        (26, 26),
+    ]
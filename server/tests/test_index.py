@@ -0,0 +1,94 @@
+import json
+import subprocess
+import sys
+
+from lllsp.index import run_index
+
+A = """\
+@g = global i32 0
+
+define i32 @f(i32 %x) {
+  %v = load i32, ptr @g
+  ret i32 %v
+}
+"""
+
+B = """\
+declare i32 @f(i32)
+"""
+
+
+def records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def write_workspace(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.ll").write_text(A)
+    (tmp_path / "sub" / "b.ll").write_text(B)
+    (tmp_path / "notes.txt").write_text("not IR")
+
+
+def test_records(tmp_path):
+    write_workspace(tmp_path)
+    out = tmp_path / "out.jsonl"
+    run_index([str(tmp_path)], str(out), jobs=1)
+    recs = records(out)
+    a = str(tmp_path / "a.ll")
+    b = str(tmp_path / "sub" / "b.ll")
+    assert {r["file"] for r in recs} == {a, b}
+
+    symbols = [(r["file"], r["name"], r["type"]) for r in recs if r["kind"] == "symbol"]
+    assert symbols == [
+        (a, "@g", "global"),
+        (a, "@f", "function"),
+        (b, "@f", "function"),
+    ]
+
+    assert {
+        "kind": "definition",
+        "name": "%v",
+        "range": [3, 2, 3, 4],
+        "scope": "@f",
+        "file": a,
+    } in recs
+    load = next(
+        r
+        for r in recs
+        if r["kind"] == "reference" and r["name"] == "@g" and r["range"][0] == 3
+    )
+    assert load["definition"] == [0, 0, 0, 2]
+
+
+def test_errors_are_records(tmp_path):
+    (tmp_path / "bad.ll").write_text("define void @f() {\n")
+    out = tmp_path / "out.jsonl"
+    run_index([str(tmp_path / "bad.ll")], str(out))
+    [rec] = records(out)
+    assert rec["kind"] == "error"
+    assert rec["file"] == str(tmp_path / "bad.ll")
+
+
+def test_command_line_with_several_processes(tmp_path):
+    write_workspace(tmp_path)
+    out = tmp_path / "out.jsonl"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "lllsp",
+            "index",
+            str(tmp_path),
+            "-o",
+            str(out),
+            "-j",
+            "2",
+        ],
+        check=True,
+    )
+    single = tmp_path / "single.jsonl"
+    run_index([str(tmp_path)], str(single), jobs=1)
+    # the files are written in the order they finish
+    key = lambda r: json.dumps(r, sort_keys=True)
+    assert sorted(records(out), key=key) == sorted(records(single), key=key)
@@ -0,0 +1,51 @@
+import lsprotocol.types as lsT
+
+SOURCE = """\
+define i32 @add(i32 %a, i32 %b) {
+  %s = add i32 %a, %b
+  ret i32 %s
+}
+
+declare void @ext(i32)
+
+define i32 @main(i32 %x) {
+  %y = mul i32 %x, %x
+  %r = call i32 @add(i32 %x, i32 %y)
+  call void @ext(i32 %r)
+  %c = icmp eq i32 %r, %y
+  ret i32 %r
+}
+"""
+
+
+def hints(f, start: int, end: int):
+    rng = lsT.Range(lsT.Position(start, 0), lsT.Position(end, 0))
+    return [
+        (h.position.line, h.position.character, h.label, h.tooltip)
+        for h in f.inlay_hints(rng)
+    ]
+
+
+def test_value_types_where_they_are_not_written(parse):
+    f = parse(SOURCE)
+    # the operands after the first have no type in front of them
+    assert hints(f, 0, 4) == [(1, 21, ": i32", None)]
+    assert [h for h in hints(f, 7, 14) if h[2].startswith(":")] == [
+        (8, 21, ": i32", None),
+        (11, 25, ": i32", None),
+    ]
+
+
+def test_argument_names(parse):
+    f = parse(SOURCE)
+    # the formals of a declare have no names
+    assert hints(f, 9, 11) == [
+        (9, 21, "%a:", "i32"),
+        (9, 29, "%b:", "i32"),
+    ]
+
+
+def test_only_the_range_is_hinted(parse):
+    f = parse(SOURCE)
+    assert hints(f, 2, 8) == []
+    assert hints(f, 11, 12) == [(11, 25, ": i32", None)]
@@ -0,0 +1,76 @@
+import lsprotocol.types as lsT
+import pytest
+
+import lllsp.lsp as L
+
+FUNCTION = """\
+define i32 @f{n}(i32 %x) {{
+  %y = add i32 %x, {n}
+  %z = call i32 @g(i32 %y)
+  ret i32 %z
+}}
+
+"""
+
+SOURCE = "@g = global i32 0\n\n" + "".join(FUNCTION.format(n=n) for n in range(20))
+
+
+def first_line(n: int) -> int:
+    return 2 + 6 * n
+
+
+@pytest.fixture
+def large(ls, parse, monkeypatch):
+    monkeypatch.setattr(L, "WINDOW_LINES", 8)
+    monkeypatch.setattr(L, "MAX_WINDOWS", 2)
+    ls.large_file_size = 1
+    f = parse(SOURCE)
+    assert isinstance(f, L.LargeFileInfo)
+    return f
+
+
+def test_skeleton_has_every_function(large):
+    assert [f.name.name for f in large.module.functions] == [
+        f"@f{n}" for n in range(20)
+    ]
+    assert large.windows == ()
+
+
+def test_window_never_splits_a_function(large):
+    # the middle of @f10, so both ends of the window fall inside functions
+    line = first_line(10) + 2
+    w = large.window(line)
+    assert w.start == first_line(9)
+    assert w.end == first_line(11) + 5
+    assert [f.name.name for f in w.module.functions] == ["@f9", "@f10", "@f11"]
+
+
+def test_names_resolve_in_a_window(large):
+    line = first_line(15) + 2
+    seg = large.find_name_segment(lsT.Position(line, 23))
+    assert seg.name.name == "%y"
+    i = large.resolve(seg)
+    assert isinstance(i, L.ir.StatementWithValue)
+    assert i.location.rng.start.line == first_line(15) + 1
+    assert [n.location.rng.start.line for n in large.occurrences.get(i)] == [
+        first_line(15) + 1,
+        line,
+    ]
+    assert large.can_rename(i)
+
+    # globals are resolved in the skeleton, but they may be used outside of
+    # the windows
+    seg = large.find_name_segment(lsT.Position(line, 17))
+    g = large.resolve(seg)
+    assert g.location.rng.start.line == 0
+    assert not large.can_rename(g)
+
+
+def test_least_recently_used_window_is_evicted(large):
+    a = large.window(first_line(1))
+    b = large.window(first_line(8))
+    assert large.window(first_line(1)) is a
+    large.window(first_line(16))
+    assert large.windows[0] is a
+    assert b not in large.windows
+    assert len(large.windows) == 2
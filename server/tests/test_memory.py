@@ -0,0 +1,56 @@
+import sys
+import tracemalloc
+
+from lllsp.lsp.memory import memory_report, retained_size
+
+SOURCE = """\
+@g = global i32 0
+
+define i32 @f(i32 %x) {
+  %v = load i32, ptr @g
+  ret i32 %v
+}
+"""
+
+
+def test_shared_objects_are_counted_once():
+    shared = ["x" * 1000]
+    seen = set()
+    first = retained_size([[shared]], seen)
+    assert first >= sys.getsizeof(shared[0])
+    # only the outer list is new
+    assert retained_size([[shared]], seen) == sys.getsizeof([shared])
+    # types and modules are shared by everything, so they are never counted
+    assert retained_size([sys, int], set()) == 0
+
+
+def test_memory_report(ls, parse):
+    f = parse(SOURCE)
+    g = parse(SOURCE, "u.ll")
+    ls.workspace_index.update(f.uri, f.workspace_symbols(), f.stamp)
+    report = memory_report(ls.files, ls.workspace_index)
+
+    assert "tracemalloc" not in report
+    assert sorted(report["files"]) == sorted([f.uri, g.uri])
+    for parts in report["files"].values():
+        assert parts["total"] == sum(v for k, v in parts.items() if k != "total")
+        assert parts["module.functions"] > 0
+        assert parts["name_segments.elts"] > 0
+    assert report["workspaceIndex"] > 0
+    assert report["total"] == report["workspaceIndex"] + sum(
+        parts["total"] for parts in report["files"].values()
+    )
+
+
+def test_tracemalloc_is_started_by_the_first_report(ls, parse):
+    parse(SOURCE)
+    assert not tracemalloc.is_tracing()
+    try:
+        report = memory_report(ls.files, ls.workspace_index, top=3)
+        assert report["tracemalloc"] == {"started": True, "top": []}
+        parse(SOURCE, "u.ll")
+        report = memory_report(ls.files, ls.workspace_index, top=3)
+        assert not report["tracemalloc"]["started"]
+        assert len(report["tracemalloc"]["top"]) == 3
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,56 @@
+import lllsp.ir as ir
+from lllsp.ir.location import Position
+from lllsp.parser import IRParser
+from lllsp.parser.reader import TextReader
+
+SOURCE = """\
+!llvm.dbg.cu = !{!0}
+!0 = distinct !DICompileUnit(file: !2)
+!2 = !DIFile(filename: "t.c",
+             directory: "/")
+!10 = !{}
+"""
+
+
+def parse(text: str) -> ir.Module:
+    with TextReader(text, "t.ll") as r:
+        return IRParser().parse(r)
+
+
+def test_numbered_nodes_are_decoded_on_lookup():
+    table = parse(SOURCE).metadata
+    assert len(table) == 4
+    assert list(table.ids()) == [0, 2, 10]
+    assert table.get(1) is None
+    assert table.get(11) is None
+    assert table.get(-1) is None
+
+    m = table.lookup("!2")
+    assert m is not None
+    assert m.name.name == "!2"
+    assert m.location.rng.start == Position(0, 2)
+    assert m.location.rng.end.line == 3
+    assert m.name.location.rng.end == Position(2, 2)
+
+
+def test_named_nodes():
+    m = parse(SOURCE).metadata.lookup("!llvm.dbg.cu")
+    assert m is not None
+    assert m.location.rng.start == Position(0, 0)
+
+
+def test_iteration_lists_named_nodes_first():
+    table = parse(SOURCE).metadata
+    assert [m.name.name for m in table] == ["!llvm.dbg.cu", "!0", "!2", "!10"]
+
+
+def test_copy_spans_moves_nodes():
+    table = parse(SOURCE).metadata
+    moved = ir.MetadataTable("t.ll")
+    moved.copy_spans(table, [2, 10], 5)
+    assert list(moved.ids()) == [2, 10]
+    assert len(moved) == 2
+    m = moved.get(2)
+    assert m is not None
+    assert m.location.rng.start == Position(0, 7)
+    assert m.location.rng.end.line == 8
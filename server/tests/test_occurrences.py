@@ -0,0 +1,58 @@
+import lsprotocol.types as lsT
+
+from lllsp.lsp.document import DocumentStore
+
+SOURCE = """\
+@g = global i32 0
+
+define i32 @f(i32 %x) {
+entry:
+  %v = load i32, ptr @g
+  br label %entry2
+
+entry2:
+  ret i32 %x
+}
+
+define i32 @h(i32 %x) {
+  %r = call i32 @f(i32 %x)
+  store i32 %r, ptr @g
+  ret i32 %r
+}
+"""
+
+
+def occurrences(f, line: int, character: int):
+    seg = f.find_name_segment(lsT.Position(line, character))
+    i = f.resolve(seg)
+    return [
+        (n.name, n.location.rng.start.line, n.location.rng.start.column)
+        for n in f.occurrences.get(i)
+    ]
+
+
+def test_globals_across_functions(parse):
+    f = parse(SOURCE)
+    assert occurrences(f, 4, 21) == [("@g", 0, 0), ("@g", 4, 21), ("@g", 13, 20)]
+    assert occurrences(f, 12, 16) == [("@f", 2, 11), ("@f", 12, 16)]
+
+
+def test_locals_stay_in_their_function(parse):
+    f = parse(SOURCE)
+    assert occurrences(f, 8, 10) == [("%x", 2, 18), ("%x", 8, 10)]
+    assert occurrences(f, 12, 23) == [("%x", 11, 18), ("%x", 12, 23)]
+    assert occurrences(f, 5, 12) == [("%entry2", 5, 11), ("entry2:", 7, 0)]
+
+
+def test_occurrences_follow_edits(ls, parse):
+    f = parse(SOURCE)
+    # moves every span down a line, and renames the global in one of them
+    text = "; comment\n" + SOURCE.replace(
+        "store i32 %r, ptr @g", "store i32 %r, ptr @k"
+    )
+    g = ls.file_info(f.uri, rebuild=True, document=DocumentStore(text), version=2)
+    assert occurrences(g, 5, 21) == [("@g", 1, 0), ("@g", 5, 21)]
+    assert occurrences(g, 9, 10) == [("%x", 3, 18), ("%x", 9, 10)]
+    text = text.replace("@g = global", "@k = global")
+    k = ls.file_info(f.uri, rebuild=True, document=DocumentStore(text), version=3)
+    assert occurrences(k, 1, 0) == [("@k", 1, 0), ("@k", 14, 20)]
@@ -0,0 +1,51 @@
+import lllsp.ir as ir
+from lllsp.parser import IRParser, NameParser
+from lllsp.parser.reader import TextReader
+
+SOURCE = """\
+@s = constant [4 x i8] c"}{\\0c\\00"
+define i32 @f(i32 %x) {
+entry:
+  %a = add i32 %x, 1 ; }
+  call void asm "{ }", ""()
+  ret i32 %a
+}
+\x0c
+define void @g() {
+  ret void
+}
+"""
+
+
+def parse(text: str) -> ir.Module:
+    with TextReader(text, "t.ll") as r:
+        return IRParser().parse(r)
+
+
+def test_blocks_end_at_their_closing_brace():
+    m = parse(SOURCE)
+    assert [f.name.name for f in m.functions] == ["@f", "@g"]
+    f, g = m.functions
+    assert (f.location.rng.start.line, f.location.rng.end.line) == (1, 6)
+    assert (g.location.rng.start.line, g.location.rng.end.line) == (8, 10)
+
+
+def test_names_are_numbered_by_newlines_only():
+    with TextReader(SOURCE, "t.ll") as r:
+        names = NameParser().parse(r)
+    lines = SOURCE.split("\n")
+    assert names
+    for n in names:
+        start = n.location.rng.start
+        assert lines[start.line][start.column :].startswith(n.name)
+    assert [n.location.rng.start.line for n in names if n.name == "@g"] == [8]
+
+
+def test_names_from_a_starting_line():
+    with TextReader("\x0c%a = %b\n@c\n", "t.ll", 5) as r:
+        names = NameParser().parse(r)
+    assert [(n.name, n.location.rng.start.line) for n in names] == [
+        ("%a", 5),
+        ("%b", 5),
+        ("@c", 6),
+    ]
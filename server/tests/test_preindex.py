@@ -0,0 +1,70 @@
+import lsprotocol.types as lsT
+
+from lllsp.lsp.columns import UTF16
+from lllsp.lsp.workspace import Preindexer, WorkspaceIndex, summarize_file
+
+SOURCE = """\
+%struct.{n} = type {{ i32 }}
+@g{n} = global i32 0
+declare void @ext()
+
+define void @f{n}() {{
+  ret void
+}}
+"""
+
+LARGE = 500 * 1024 * 1024
+
+
+def write(tmp_path, n: int) -> str:
+    path = tmp_path / f"f{n}.ll"
+    path.write_text(SOURCE.format(n=n))
+    return str(path)
+
+
+def test_summarize_file(tmp_path):
+    filename = write(tmp_path, 0)
+    stamp, symbols = summarize_file(filename, UTF16, LARGE)
+    assert stamp.size == len(SOURCE.format(n=0))
+    assert [(s.name, s.kind, s.declaration) for s in symbols] == [
+        ("%struct.0", lsT.SymbolKind.Struct, False),
+        ("@g0", lsT.SymbolKind.Variable, False),
+        ("@ext", lsT.SymbolKind.Function, True),
+        ("@f0", lsT.SymbolKind.Function, False),
+    ]
+    assert symbols[3].selection == (4, 12, 4, 15)
+    # large files only have their skeleton parsed, with the same symbols
+    _, skeleton = summarize_file(filename, UTF16, 1)
+    assert [(s.name, s.selection) for s in skeleton] == [
+        (s.name, s.selection) for s in symbols
+    ]
+
+
+def test_preindex_workspace(tmp_path):
+    files = [write(tmp_path, n) for n in range(4)]
+    index = WorkspaceIndex()
+    p = Preindexer(index, 2, UTF16, LARGE, lambda: False)
+    # already opened in the server
+    p.skip(files[1])
+    p.start([str(tmp_path)])
+    p._thread.join(60)
+    assert not p._thread.is_alive()
+
+    assert sorted(index.files) == sorted(
+        "file://" + f for i, f in enumerate(files) if i != 1
+    )
+    assert [s.uri for s in index.definitions("@f2")] == ["file://" + files[2]]
+    assert index.definitions("@f1") == []
+    assert index.definitions("@ext") == []
+    assert len(index.by_name["@ext"]) == 3
+    assert index.stamps["file://" + files[0]].size == len(SOURCE.format(n=0))
+
+
+def test_cancelled_preindex_indexes_nothing(tmp_path):
+    write(tmp_path, 0)
+    index = WorkspaceIndex()
+    p = Preindexer(index, 1, UTF16, LARGE, lambda: False)
+    p.cancel()
+    p.start([str(tmp_path)])
+    p._thread.join(60)
+    assert index.files == {}
@@ -0,0 +1,88 @@
+import os
+
+import lsprotocol.types as lsT
+import pytest
+
+from lllsp.lsp.document import DocumentStore
+
+SOURCE = """\
+define void @f() {
+  ret void
+}
+"""
+
+CHANGED = SOURCE.replace("@f", "@g")
+
+
+@pytest.fixture
+def initialized(ls, tmp_path):
+    ls.lsp.lsp_initialize(
+        lsT.InitializeParams(
+            capabilities=lsT.ClientCapabilities(), root_uri=tmp_path.as_uri()
+        )
+    )
+    return ls
+
+
+def touch(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_refresh_skips_unchanged_contents(ls, parse, tmp_path):
+    f = parse(SOURCE)
+    path = tmp_path / "t.ll"
+    touch(path)
+    g = ls.refresh(f.uri)
+    assert g is f
+    # the new modification time is kept, so the file isn't hashed again
+    assert g.stamp.mtime_ns == os.stat(path).st_mtime_ns
+
+    path.write_text(CHANGED)
+    g = ls.refresh(f.uri)
+    assert g is not f
+    assert [fn.name.name for fn in g.module.functions] == ["@g"]
+
+
+def test_refresh_keeps_saved_documents(ls, parse, tmp_path):
+    f = parse(SOURCE)
+    f = ls.file_info(f.uri, rebuild=True, document=DocumentStore(CHANGED), version=2)
+    # saved as it is
+    (tmp_path / "t.ll").write_text(CHANGED)
+    assert ls.refresh(f.uri) is f
+
+
+def test_changed_closed_files_are_dropped(initialized, parse, tmp_path):
+    ls = initialized
+    f = parse(SOURCE)
+    ls.workspace_index.update(f.uri, f.workspace_symbols(), f.stamp)
+
+    touch(tmp_path / "t.ll")
+    ls.file_changed(f.uri, lsT.FileChangeType.Changed)
+    assert ls.files[f.uri] is f
+
+    (tmp_path / "t.ll").write_text(CHANGED)
+    ls.file_changed(f.uri, lsT.FileChangeType.Changed)
+    assert f.uri not in ls.files
+    # the symbols of indexed files are kept up to date
+    assert [s.name for s in ls.workspace_index.files[f.uri]] == ["@g"]
+
+    ls.file_changed(f.uri, lsT.FileChangeType.Deleted)
+    assert f.uri not in ls.workspace_index.files
+
+
+def test_changed_open_files_are_reparsed(initialized, parse, tmp_path, monkeypatch):
+    ls = initialized
+    f = parse(SOURCE)
+    ls.workspace.put_text_document(lsT.TextDocumentItem(f.uri, "llvm", 1, SOURCE))
+    published = []
+    monkeypatch.setattr(ls, "publish", published.append)
+
+    (tmp_path / "t.ll").write_text(CHANGED)
+    ls.file_changed(f.uri, lsT.FileChangeType.Changed)
+    assert published == [ls.files[f.uri]]
+    assert [fn.name.name for fn in published[0].module.functions] == ["@g"]
+
+    # deleting an open file keeps it
+    ls.file_changed(f.uri, lsT.FileChangeType.Deleted)
+    assert f.uri in ls.files
@@ -0,0 +1,111 @@
+import random
+from typing import List
+
+import pytest
+from lsprotocol.types import Position, Range
+
+from lllsp.segments import PositionList
+
+
+def rng(start: int, end: int) -> Range:
+    return Range(Position(0, start), Position(0, end))
+
+
+def sorted_list(elts: List[Range]) -> PositionList[Range]:
+    pl = PositionList(lambda r: r)
+    pl.elts = list(elts)
+    pl.sort()
+    return pl
+
+
+def assert_same(pl: PositionList[Range], expected: List[Range]):
+    # of the ranges that start together, the first one in expected is the
+    # outer one, like the ones already in a list are for a merged batch
+    ref = sorted_list(expected)
+    assert sorted(pl.elts, key=lambda r: (r.start, r.end)) == sorted(
+        ref.elts, key=lambda r: (r.start, r.end)
+    )
+    for c in range(0, 120):
+        p = Position(0, c)
+        assert pl.find(p) == ref.find(p), c
+
+
+def random_ranges(rnd: random.Random, nested: bool) -> List[Range]:
+    elts = []
+    x = 0
+    while x < 100:
+        x += rnd.randint(0, 3)
+        width = rnd.randint(1, 4)
+        elts.append(rng(x, x + width))
+        x += width
+    if nested:
+        for start in rnd.sample(range(100), 3):
+            elts.append(rng(start, start + rnd.randint(1, 15)))
+    return elts
+
+
+def test_merge_into_empty():
+    pl = PositionList(lambda r: r)
+    batch = [rng(0, 2), rng(4, 6)]
+    pl.merge(batch)
+    assert_same(pl, batch)
+
+
+def test_merge_nested():
+    outer = rng(0, 20)
+    pl = sorted_list([outer, rng(30, 40)])
+    inner = [rng(5, 8), rng(10, 12)]
+    pl.merge(inner)
+    assert pl.find(Position(0, 6)) == inner[0]
+    assert pl.find(Position(0, 9)) == outer
+    assert_same(pl, [outer, rng(30, 40)] + inner)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_merge_matches_sort(seed: int):
+    rnd = random.Random(seed)
+    elts = random_ranges(rnd, nested=seed % 2 == 1)
+    kept = [e for e in elts if rnd.random() < 0.6]
+    added = sorted(
+        (e for e in elts if not any(e is k for k in kept)), key=lambda r: r.start
+    )
+    pl = sorted_list(kept)
+    pl.merge(added)
+    assert_same(pl, kept + added)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_merge_disjoint_matches_sort(seed: int):
+    rnd = random.Random(seed)
+    elts = random_ranges(rnd, nested=seed % 2 == 1)
+    kept = [e for e in elts if rnd.random() < 0.6]
+    added = sorted(
+        (e for e in elts if not any(e is k for k in kept)), key=lambda r: r.start
+    )
+    # runs of the added ranges that don't overlap each other
+    batches: List[List[Range]] = []
+    end = None
+    for e in added:
+        if not batches or (e.start >= end and rnd.random() < 0.5):
+            batches.append([])
+        batches[-1].append(e)
+        end = e.end if end is None else max(end, e.end)
+    rnd.shuffle(batches)
+    pl = sorted_list(kept)
+    pl.merge_disjoint(batches)
+    assert_same(pl, kept + added)
+
+
+def test_extend_and_extend_from():
+    first = [rng(0, 3), rng(1, 2), rng(5, 6)]
+    second = [rng(10, 12), rng(14, 20), rng(15, 16)]
+    pl = PositionList(lambda r: r)
+    pl.extend(first)
+    pl.extend(second)
+    assert_same(pl, first + second)
+
+    copy = PositionList(lambda r: r)
+    copy.extend_from(pl, rng(0, 10))
+    copy.extend_from(pl, rng(10, 30))
+    assert copy.elts == pl.elts
+    assert copy.segments == pl.segments
@@ -0,0 +1,88 @@
+import threading
+
+from lllsp.lsp.document import DocumentStore
+
+SOURCE = """\
+define void @f() {
+  ret void
+}
+"""
+
+EDITED = (
+    SOURCE
+    + """
+define void @g() {
+  ret void
+}
+"""
+)
+
+
+def names(f):
+    return [fn.name.name for fn in f.module.functions]
+
+
+def test_edits_publish_a_new_snapshot(ls, parse):
+    f = parse(SOURCE)
+    assert f.version is None
+    g = ls.file_info(f.uri, rebuild=True, document=DocumentStore(EDITED), version=2)
+    assert g is not f
+    assert g.version == 2
+    assert ls.file_info(f.uri) is g
+    # queries that took the previous snapshot still see it as it was
+    assert names(f) == ["@f"]
+    assert [n.name.name for n in f.name_segments.elts] == ["@f"]
+    assert names(g) == ["@f", "@g"]
+
+
+def test_stale_parse_is_not_published(ls, parse, monkeypatch):
+    f = parse(SOURCE)
+    parse_file = ls._parse
+
+    def parse_and_edit(uri, document, version, token):
+        # another edit arrives while version 2 is being parsed
+        if version == 2:
+            ls.file_info(uri, rebuild=True, document=DocumentStore(EDITED), version=3)
+        return parse_file(uri, document, version, token)
+
+    monkeypatch.setattr(ls, "_parse", parse_and_edit)
+    stale = ls.file_info(f.uri, rebuild=True, document=DocumentStore(SOURCE), version=2)
+    assert stale.version == 2
+    assert ls.file_info(f.uri).version == 3
+
+
+def test_queries_wait_for_the_parse_in_flight(ls, tmp_path, monkeypatch):
+    path = tmp_path / "t.ll"
+    path.write_text(SOURCE)
+    uri = path.as_uri()
+    parse_file = ls._parse
+    started = threading.Event()
+    release = threading.Event()
+    parses = []
+
+    def slow_parse(*args):
+        parses.append(args)
+        started.set()
+        release.wait(5)
+        return parse_file(*args)
+
+    monkeypatch.setattr(ls, "_parse", slow_parse)
+    results = [None, None]
+
+    def query(i):
+        results[i] = ls.file_info(uri)
+
+    first = threading.Thread(target=query, args=(0,))
+    first.start()
+    assert started.wait(5)
+    second = threading.Thread(target=query, args=(1,))
+    second.start()
+    # it waits for the first thread's parse rather than starting its own
+    second.join(0.2)
+    assert second.is_alive()
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert len(parses) == 1
+    assert results[0] is results[1] is ls.file_info(uri)
@@ -0,0 +1,106 @@
+from typing import List
+
+import pytest
+
+import lllsp.ir as ir
+from lllsp.parser import IRParser
+from lllsp.parser.reader import TextReader
+from lllsp.parser.spans import SpanParse, SpanParser
+
+SOURCE = """\
+source_filename = "t.c"
+target triple = "x86_64-unknown-linux-gnu"
+
+%struct.S = type { i32, ptr }
+
+@g = global i32 0, align 4
+
+define i32 @f(i32 %x) #0 !dbg !5 {
+entry:
+  %a = add i32 %x, 1
+  ret i32 %a
+}
+
+define void @g2() #0 {
+  call void @h(), !dbg !7
+  ret void
+}
+
+declare void @h()
+
+attributes #0 = { nounwind }
+
+!llvm.dbg.cu = !{!0}
+!0 = distinct !DICompileUnit(language: DW_LANG_C99, file: !1)
+!1 = !DIFile(filename: "t.c", directory: "/")
+!5 = distinct !DISubprogram(name: "f", unit: !0)
+!7 = !DILocation(line: 3, scope: !5)
+"""
+
+
+def dump(m: ir.Module) -> str:
+    numbered = [(id, m.metadata.get(id)) for id in m.metadata.ids()]
+    return repr(
+        (
+            m.location,
+            m.source_filename,
+            m.target_info,
+            m.types,
+            m.constants,
+            m.functions,
+            m.attributes,
+            m.metadata.named,
+            numbered,
+        )
+    )
+
+
+def fresh(text: str) -> ir.Module:
+    with TextReader(text, "t.ll") as r:
+        return IRParser().parse(r)
+
+
+def reparse(previous: SpanParse, text: str) -> SpanParse:
+    return SpanParser().parse(text, "t.ll", previous.spans, previous.module)
+
+
+def edit(lines: List[str], at: int, remove: int, *added: str) -> str:
+    return "\n".join(lines[:at] + list(added) + lines[at + remove :])
+
+
+def test_parse_matches_the_parser():
+    assert dump(SpanParser().parse(SOURCE, "t.ll").module) == dump(fresh(SOURCE))
+
+
+def test_unchanged_text_reuses_everything():
+    first = SpanParser().parse(SOURCE, "t.ll")
+    second = reparse(first, SOURCE)
+    assert second.origins == first.spans
+    assert second.names == {}
+    for old, new in zip(first.spans, second.spans):
+        assert new.items is old.items
+    assert dump(second.module) == dump(fresh(SOURCE))
+
+
+@pytest.mark.parametrize(
+    "at, remove, added",
+    [
+        # a comment before everything moves every span
+        (0, 0, ["; moved"]),
+        # a changed function
+        (9, 1, ["  %a = sub i32 %x, 1"]),
+        # a new function between two others
+        (13, 0, ["define void @new() {", "  ret void", "}", ""]),
+        # a removed function
+        (13, 5, []),
+        # new metadata
+        (27, 0, ["!9 = !{!1}"]),
+    ],
+)
+def test_reuse_matches_a_fresh_parse(at: int, remove: int, added: List[str]):
+    first = SpanParser().parse(SOURCE, "t.ll")
+    text = edit(SOURCE.split("\n"), at, remove, *added)
+    second = reparse(first, text)
+    assert any(o is not None for o in second.origins)
+    assert dump(second.module) == dump(fresh(text))
+    assert dump(second.module) == dump(SpanParser().parse(text, "t.ll").module)
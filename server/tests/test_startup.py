@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+LAZY = [
+    "lllsp.index.cfg",
+    "lllsp.index.occurrences",
+    "lllsp.index.trigrams",
+    "lllsp.index.types",
+    "lllsp.index.undefined",
+    "lllsp.lsp.document",
+    "lllsp.lsp.memory",
+    "lllsp.lsp.workspace",
+    "lllsp.parser.skeleton",
+    "lllsp.parser.spans",
+]
+
+CHECK = """\
+import sys
+import lllsp.lsp
+
+lllsp.lsp.LLLSP()
+print("\\n".join(sorted(sys.modules)))
+"""
+
+
+def startup_modules():
+    # a new interpreter, as other tests have already imported everything
+    out = subprocess.run(
+        [sys.executable, "-c", CHECK], check=True, capture_output=True, text=True
+    ).stdout
+    return set(out.split())
+
+
+def test_feature_modules_are_not_imported_at_startup():
+    modules = startup_modules()
+    assert "lllsp.lsp" in modules
+    assert [m for m in LAZY if m in modules] == []
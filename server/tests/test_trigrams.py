@@ -0,0 +1,92 @@
+import lsprotocol.types as lsT
+
+from lllsp.index.trigrams import TrigramIndex
+from lllsp.lsp.workspace import WorkspaceIndex, WorkspaceSymbol
+
+KEYS = [
+    "parse_value",
+    "parse",
+    "ir.parse",
+    "reparse",
+    "Parser",
+    "parse_module_summary",
+    "write",
+    "pa",
+]
+
+
+def index(keys=KEYS) -> TrigramIndex[str]:
+    idx: TrigramIndex[str] = TrigramIndex()
+    for k in keys:
+        idx.add(k, k)
+    return idx
+
+
+def test_ranking():
+    # the key itself, then the keys starting with it, shorter first, then the
+    # ones where it starts a word, then the rest
+    assert index().search("parse", 10) == [
+        "parse",
+        "Parser",
+        "parse_value",
+        "parse_module_summary",
+        "ir.parse",
+        "reparse",
+    ]
+    assert index().search("PARSE", 2) == ["parse", "Parser"]
+
+
+def test_every_word_of_the_query_matches():
+    assert index().search("parse module", 10) == ["parse_module_summary"]
+    assert index().search("pa", 3) == ["pa", "parse", "Parser"]
+    assert index().search("", 2) == KEYS[:2]
+
+
+def test_close_keys_follow_the_matches():
+    # shares most of its trigrams with "parse_value" only
+    assert index().search("parse_valeu", 10) == ["parse_value"]
+    assert index().search("xyz", 10) == []
+
+
+def test_removed_values_and_copies():
+    idx = index()
+    idx.add("parse", "other")
+    copy = idx.copy()
+    copy.remove("parse", "parse")
+    copy.remove("reparse", "reparse")
+    copy.add("unparse", "unparse")
+    assert copy.search("parse", 2) == ["other", "Parser"]
+    assert "reparse" not in copy.search("parse", 10)
+    assert "unparse" in copy.search("parse", 10)
+    # the original is unchanged
+    assert idx.search("parse", 2) == ["parse", "other"]
+    assert "unparse" not in idx.search("parse", 10)
+    assert len(idx) == len(KEYS)
+
+
+def symbol(name: str, uri: str = "file:///a.ll", declaration=False):
+    return WorkspaceSymbol(
+        name, lsT.SymbolKind.Function, uri, (0, 0, 1, 0), (0, 0, 0, 1), declaration
+    )
+
+
+def test_workspace_index():
+    ws = WorkspaceIndex()
+    f, g = symbol("@f"), symbol("@foo")
+    decl = symbol("@foo", "file:///b.ll", declaration=True)
+    ws.update("file:///a.ll", [f, g])
+    ws.update("file:///b.ll", [decl])
+    # searched for without their sigils
+    assert ws.search("foo") == [g, decl]
+    assert ws.definitions("@foo") == [g]
+
+    # symbols that are kept aren't indexed again
+    h = symbol("@bar")
+    ws.update("file:///a.ll", [g, h])
+    assert ws.search("f") == [g, decl]
+    assert ws.search("bar") == [h]
+    assert ws.by_name["@foo"] == [g, decl]
+
+    ws.remove("file:///b.ll")
+    assert ws.search("foo") == [g]
+    assert "file:///b.ll" not in ws.files
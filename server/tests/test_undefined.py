@@ -0,0 +1,107 @@
+import pytest
+
+import lllsp.ir as ir
+from lllsp.lsp.document import DocumentStore
+
+SOURCE = """\
+@g = global i32 0
+
+define i32 @f(i32 %x) {
+  %a = add i32 %x, 1
+  ret i32 %a
+}
+
+define i32 @main() {
+  %r = call i32 @f(i32 1)
+  %v = load i32, ptr @g
+  ret i32 %r
+}
+"""
+
+
+UNDEFINED = """\
+define i32 @u(i32) {
+  %a = add i32 %0, %1
+  %b = call i32 @missing(i32 %a) ; @commented
+  call void @llvm.dbg.value(metadata !"%notaname", metadata !7), !dbg !8
+  br label %nowhere
+}
+
+define void @v() #3 {
+  ret void, !prof !{!"branch_weights"}
+}
+"""
+
+
+@pytest.fixture
+def server(ls, parse):
+    return ls, parse(SOURCE).uri
+
+
+def edit(server, text: str, version: int = 1):
+    ls, uri = server
+    return ls.file_info(
+        uri, rebuild=True, document=DocumentStore(text), version=version
+    )
+
+
+def undefined(f):
+    return [
+        (d.message, d.range.start.line, d.range.start.character)
+        for d in f.diagnostics()
+    ]
+
+
+def test_defined_names_have_no_diagnostics(parse):
+    assert parse(SOURCE).diagnostics() == []
+
+
+def test_undefined_names(parse):
+    f = parse(UNDEFINED)
+    # %0 is the unnamed formal, and names in comments and strings are skipped
+    assert undefined(f) == [
+        ("use of undefined value '%1'", 1, 19),
+        ("use of undefined value '@missing'", 2, 16),
+        ("use of undefined value '@llvm.dbg.value'", 3, 12),
+        ("use of undefined metadata '!7'", 3, 60),
+        ("use of undefined metadata '!8'", 3, 70),
+        ("use of undefined value '%nowhere'", 4, 11),
+        ("use of undefined attribute group '#3'", 7, 17),
+    ]
+
+
+def test_undefined_names_follow_edits(server):
+    f = edit(server, UNDEFINED)
+    before = undefined(f)
+    # the chunks of the unchanged spans are reused, and moved down a line
+    f = edit(server, "\n" + UNDEFINED, 2)
+    assert undefined(f) == [(m, line + 1, c) for m, line, c in before]
+    # defining a global clears its uses in the other spans
+    f = edit(server, "\n" + UNDEFINED + "declare i32 @missing(i32)\n", 3)
+    assert "use of undefined value '@missing'" not in [m for m, *_ in undefined(f)]
+
+
+@pytest.mark.parametrize(
+    "unfinished",
+    ["define void @new(i32 %y) {\n  %z = add", "@h = ", "%struct.U = type {"],
+)
+def test_unfinished_definition(server, unfinished: str):
+    f = edit(server, SOURCE + unfinished)
+    # the spans before the unfinished one are still parsed and resolved
+    assert [fn.name.name for fn in f.module.functions] == ["@f", "@main"]
+    main = f.module.functions[1]
+    assert isinstance(main, ir.Define)
+    assert f.module.resolve(main.calls[0].callee) is f.module.functions[0]
+
+    diagnostics = f.diagnostics()
+    assert [d.message for d in diagnostics] == ["incomplete definition"]
+    assert diagnostics[0].range.start.line == SOURCE.count("\n")
+    assert diagnostics[0].range.start.character == 0
+
+
+def test_finishing_a_definition_clears_its_error(server):
+    f = edit(server, SOURCE + "define void @new() {\n")
+    assert f.diagnostics()
+    f = edit(server, SOURCE + "define void @new() {\n  ret void\n}\n")
+    assert f.diagnostics() == []
+    assert [fn.name.name for fn in f.module.functions] == ["@f", "@main", "@new"]